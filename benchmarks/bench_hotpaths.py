@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""
+Benchmarks of pipeapp hot paths on synthetic data.
+
+Each benchmark reports the median wall time of `--repeat` runs, in ms:
+    tab_file_reader_plain / _gzip:      read all records of a tab file (`--scale` x 500K lines)
+    open_file_plain / _gzip:            read all lines of the same files
+    tab_file_writer_plain / _gzip:      write the same records with `tab_file_writer` (gzip: BGZF)
+    fasta_index / fasta_iter:           build the .fai index of / read all sequences of a FASTA file
+                                        (`--scale` x 100K proteins); fasta_iter_lines: the same with a line loop
+    manifest_write / manifest_read:     write and read a manifest of `--scale` x 1M entries
+    config_from_yaml / _nocache:        load a config file with and without the compiled config cache
+    copy_files / move_files:            copy and move `--scale` x 200 files of 256 KB
+    pipeline_app_workdir:               PipelineApp workdir setup (incl. removal of the old one) and teardown
+    example_app_cold_start:             interpreter launch to `ExampleApp.init()` (see bench_startup.py)
+
+Results are compared to a JSON baseline; the benchmark fails (exit code 1) if any of them regressed by more than
+the threshold. Run with `--save-baseline` to (re)create the baseline on the current machine; compare only results
+measured with the same `--scale`.
+"""
+
+# region: imports
+import gzip
+import io
+import os
+import sys
+import random
+import tempfile
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from collections import OrderedDict
+from subprocess import run
+
+from benchlib import src_dir, baselines_dir, time_ms, add_gate_args, gate
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+default_baseline = os.path.join(baselines_dir, 'hotpaths.json')
+TAB_LINES = 500000
+FASTA_RECORDS = 100000
+MANIFEST_ENTRIES = 1000000
+TRANSFER_FILES = 200
+TRANSFER_FILE_SIZE = 256 * 1024
+CONFIG_KEYS = 2000
+# endregion
+
+# region: variables
+benchmarks = OrderedDict()  # name -> function (data dir, scale, repeat) -> ms
+
+
+# endregion
+
+
+# region: functions
+def benchmark(name):
+    """ Register benchmark function. """
+    def register(func):
+        benchmarks[name] = func
+        return func
+    return register
+
+
+def _make_tab_file(data_dir, scale):
+    """ Write tab file and its gzipped copy (once per data dir); return their names. """
+    plain = os.path.join(data_dir, 'records.tsv')
+    gzipped = plain + '.gz'
+    if not os.path.exists(gzipped):
+        rnd = random.Random(1)
+        with open(plain, 'w') as fh:
+            fh.write('#id\tcontig\tstart\tend\tstrand\tscore\n')
+            for i in range(int(TAB_LINES * scale)):
+                start = rnd.randrange(10 ** 7)
+                fh.write('gene_{}\tcontig_{}\t{}\t{}\t{}\t{:.3f}\n'.format(
+                    i, rnd.randrange(1000), start, start + rnd.randrange(100, 5000), rnd.choice('+-'), rnd.random()))
+        with open(plain, 'rb') as fin, gzip.open(gzipped, 'wb', compresslevel=6) as fout:
+            fout.write(fin.read())
+    return plain, gzipped
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+@benchmark('tab_file_reader_plain')
+def bench_tab_file_reader_plain(data_dir, scale, repeat):
+    from pipeapp.lib.shell import tab_file_reader
+    plain, _ = _make_tab_file(data_dir, scale)
+    return time_ms(lambda: _consume(tab_file_reader(plain)), repeat)
+
+
+@benchmark('tab_file_reader_gzip')
+def bench_tab_file_reader_gzip(data_dir, scale, repeat):
+    from pipeapp.lib.shell import tab_file_reader
+    _, gzipped = _make_tab_file(data_dir, scale)
+    return time_ms(lambda: _consume(tab_file_reader(gzipped, gzip=True)), repeat)
+
+
+def _read_lines(filename):
+    from pipeapp.lib.shell import open_file
+    with open_file(filename) as fh:
+        _consume(fh)
+
+
+@benchmark('open_file_plain')
+def bench_open_file_plain(data_dir, scale, repeat):
+    plain, _ = _make_tab_file(data_dir, scale)
+    return time_ms(lambda: _read_lines(plain), repeat)
+
+
+@benchmark('open_file_gzip')
+def bench_open_file_gzip(data_dir, scale, repeat):
+    _, gzipped = _make_tab_file(data_dir, scale)
+    return time_ms(lambda: _read_lines(gzipped), repeat)
+
+
+def _write_tab_file(filename, records):
+    from pipeapp.lib.shell import tab_file_writer
+    with tab_file_writer(filename, ['id', 'contig', 'start', 'end', 'strand', 'score']) as writer:
+        writer.write_rows(records)
+
+
+@benchmark('tab_file_writer_plain')
+def bench_tab_file_writer_plain(data_dir, scale, repeat):
+    from pipeapp.lib.shell import tab_file_reader
+    plain, _ = _make_tab_file(data_dir, scale)
+    records = [tuple(r.values()) for r in tab_file_reader(plain)]
+    return time_ms(lambda: _write_tab_file(os.path.join(data_dir, 'written.tsv'), records), repeat)
+
+
+@benchmark('tab_file_writer_gzip')
+def bench_tab_file_writer_gzip(data_dir, scale, repeat):
+    from pipeapp.lib.shell import tab_file_reader
+    plain, _ = _make_tab_file(data_dir, scale)
+    records = [tuple(r.values()) for r in tab_file_reader(plain)]
+    return time_ms(lambda: _write_tab_file(os.path.join(data_dir, 'written.tsv.gz'), records), repeat)
+
+
+def _make_fasta_file(data_dir, scale):
+    filename = os.path.join(data_dir, 'proteins.faa')
+    if not os.path.exists(filename):
+        rnd = random.Random(1)
+        residues = 'ACDEFGHIKLMNPQRSTVWY'
+        with open(filename, 'w') as fh:
+            for i in range(int(FASTA_RECORDS * scale)):
+                seq = ''.join(rnd.choices(residues, k=rnd.randrange(50, 800)))
+                fh.write('>WP_{:09d}.1 protein {}\n'.format(i, i))
+                fh.write(''.join(seq[j:j + 60] + '\n' for j in range(0, len(seq), 60)))
+    return filename
+
+
+@benchmark('fasta_index')
+def bench_fasta_index(data_dir, scale, repeat):
+    from pipeapp.lib.fasta import IndexedFasta
+    filename = _make_fasta_file(data_dir, scale)
+
+    def build():
+        with IndexedFasta(filename, save_index=False) as fasta:
+            return fasta.index
+    return time_ms(build, repeat)
+
+
+@benchmark('fasta_iter')
+def bench_fasta_iter(data_dir, scale, repeat):
+    from pipeapp.lib.fasta import IndexedFasta
+    filename = _make_fasta_file(data_dir, scale)
+
+    def read():
+        with IndexedFasta(filename) as fasta:
+            _consume(fasta)
+    return time_ms(read, repeat)
+
+
+def _read_fasta_lines(filename):
+    records, name, lines = [], None, []
+    with open(filename) as fh:
+        for line in fh:
+            if line.startswith('>'):
+                if name is not None:
+                    records.append((name, ''.join(lines)))
+                name, lines = line[1:].split(None, 1)[0], []
+            else:
+                lines.append(line.rstrip())
+    if name is not None:
+        records.append((name, ''.join(lines)))
+    return records
+
+
+@benchmark('fasta_iter_lines')
+def bench_fasta_iter_lines(data_dir, scale, repeat):
+    filename = _make_fasta_file(data_dir, scale)
+    return time_ms(lambda: _read_fasta_lines(filename), repeat)
+
+
+def _manifest_entries(data_dir, scale):
+    # paths in a few hundred (existing) directories, as the manifests of a big run have
+    dirs = [os.path.join(data_dir, 'genomes', 'g{:03d}'.format(i)) for i in range(300)]
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    return ('{}/protein_{:07d}.faa'.format(dirs[i % len(dirs)], i) for i in range(int(MANIFEST_ENTRIES * scale)))
+
+
+@benchmark('manifest_write')
+def bench_manifest_write(data_dir, scale, repeat):
+    from pipeapp.lib.manifest import ManifestFile
+    filename = os.path.join(data_dir, 'write.mft')
+    entries = list(_manifest_entries(data_dir, scale))
+    return time_ms(lambda: ManifestFile(filename, action='iter').write(entries), repeat)
+
+
+@benchmark('manifest_read')
+def bench_manifest_read(data_dir, scale, repeat):
+    from pipeapp.lib.manifest import ManifestFile
+    filename = os.path.join(data_dir, 'read.mft')
+    ManifestFile(filename, action='iter').write(_manifest_entries(data_dir, scale))
+    return time_ms(lambda: ManifestFile(filename, action='read'), repeat)
+
+
+def _make_config_file(data_dir):
+    filename = os.path.join(data_dir, 'config.yaml')
+    with open(filename, 'w') as fh:
+        fh.write('app:\n')
+        for i in range(CONFIG_KEYS):
+            if i % 10 == 0:
+                fh.write('  section_{}:\n'.format(i))
+                fh.write('    list: [{}]\n'.format(', '.join(str(j) for j in range(10))))
+            fh.write('    key_{}: value {}\n'.format(i, i))
+    return filename
+
+
+@benchmark('config_from_yaml')
+def bench_config_from_yaml(data_dir, scale, repeat):
+    from pipeapp.lib.config import Config
+    filename = _make_config_file(data_dir)
+    Config().from_yaml(filename, root_key='app')  # fill the cache
+    return time_ms(lambda: Config().from_yaml(filename, root_key='app'), repeat)
+
+
+@benchmark('config_from_yaml_nocache')
+def bench_config_from_yaml_nocache(data_dir, scale, repeat):
+    from pipeapp.lib.config import Config
+    filename = _make_config_file(data_dir)
+    return time_ms(lambda: Config().from_yaml(filename, root_key='app', cache=False), repeat)
+
+
+def _make_transfer_files(data_dir, scale):
+    src = os.path.join(data_dir, 'transfer_src')
+    if not os.path.exists(src):
+        os.makedirs(src)
+        block = os.urandom(TRANSFER_FILE_SIZE)
+        for i in range(max(1, int(TRANSFER_FILES * scale))):
+            with open(os.path.join(src, 'file_{:04d}.bin'.format(i)), 'wb') as fh:
+                fh.write(block)
+    return src
+
+
+@benchmark('copy_files')
+def bench_copy_files(data_dir, scale, repeat):
+    from pipeapp.lib.shell import copy_files, remove_dir, make_dir
+    src = _make_transfer_files(data_dir, scale)
+    dst = os.path.join(data_dir, 'transfer_dst')
+
+    def setup():
+        remove_dir(dst)
+        make_dir(dst)
+    return time_ms(lambda: copy_files(os.path.join(src, '*'), dst), repeat, setup=setup)
+
+
+@benchmark('move_files')
+def bench_move_files(data_dir, scale, repeat):
+    from pipeapp.lib.shell import copy_files, move_files, remove_dir, make_dir
+    src = _make_transfer_files(data_dir, scale)
+    moved_src = os.path.join(data_dir, 'move_src')
+    dst = os.path.join(data_dir, 'move_dst')
+
+    def setup():
+        for d in (moved_src, dst):
+            remove_dir(d)
+            make_dir(d)
+        copy_files(os.path.join(src, '*'), moved_src)
+    return time_ms(lambda: move_files(os.path.join(moved_src, '*'), dst), repeat, setup=setup)
+
+
+@benchmark('pipeline_app_workdir')
+def bench_pipeline_app_workdir(data_dir, scale, repeat):
+    from pipeapp.lib.app import PipelineApp
+    workdir = os.path.join(data_dir, 'workdir')
+    console = io.StringIO()
+
+    def setup_teardown():
+        # the old workdir (with some files in tmp) is removed when the app is created
+        with redirect_stdout(console):
+            app = PipelineApp(name='bench_app', workdir=workdir, no_conf_root_key=True, cleanup_mode='thread',
+                              wait_cleanup=True)
+            for i in range(100):
+                with open(os.path.join(app.dir_tmp, 'tmp_{}.txt'.format(i)), 'w') as fh:
+                    fh.write('x' * 1000)
+            app.post_exit()
+            app.flush_log()
+        console.seek(0)
+        console.truncate()
+    return time_ms(setup_teardown, repeat)
+
+
+@benchmark('example_app_cold_start')
+def bench_example_app_cold_start(data_dir, scale, repeat):
+    from statistics import median
+    from bench_startup import measure_startup_ms
+    return median(measure_startup_ms() for _ in range(repeat))
+
+
+def main():
+    arg_parser = ArgumentParser(prog='bench_hotpaths', description='benchmarks of pipeapp hot paths')
+    add_gate_args(arg_parser, default_baseline, default_threshold=25.0)
+    arg_parser.add_argument('-s', '--scale', type=float, default=1.0, help='data size, relative to the default')
+    arg_parser.add_argument('-k', '--select', action='append',
+                            help='run only benchmarks whose name contains this string (may be repeated)')
+    arg_parser.add_argument('-l', '--list', action='store_true', help='list benchmarks and exit')
+    arg_parser.add_argument('--data-dir', help='directory for synthetic data (a temporary directory by default)')
+    args = arg_parser.parse_args()
+    if args.list:
+        print('\n'.join(benchmarks))
+        return 0
+
+    # byte-compile first, so that compilation of stale sources is not measured
+    run([sys.executable, '-m', 'compileall', '-q', '-f', src_dir], check=True)
+    sys.path.insert(0, src_dir)
+    selected = [name for name in benchmarks if not args.select or any(s in name for s in args.select)]
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as data_dir:
+        # keep compiled configs of the benchmark apart from the user's cache
+        os.environ['PIPEAPP_CONFIG_CACHE_DIR'] = os.path.join(data_dir, 'config_cache')
+        results = OrderedDict()
+        for name in selected:
+            results[name] = benchmarks[name](data_dir, args.scale, args.repeat)
+            print('{:<32} {:>10.1f} ms'.format(name, results[name]), file=sys.stderr)
+    return gate(results, args)
+
+# endregion
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Benchmark of the vectorized sequence statistics (`pipeapp.lib.seqbatch`) against pure-Python loops.
+
+On synthetic proteins and DNA (`--scale` x 20K sequences of each), reports the throughput in residues per second of:
+    encode:             packing sequences into a `SequenceBatch`
+    residue_counts:     residue counts of each protein
+    gc_content:         GC fraction of each DNA sequence
+    kmer_counts:        histogram of DNA 6-mers
+    filter_length:      selecting proteins by length
+each with NumPy (`seqbatch_*`, needs NumPy) and with the pure-Python baseline (`python_*`).
+
+The times are compared to a JSON baseline; the benchmark fails (exit code 1) if any of them regressed by more than
+the threshold. Run with `--save-baseline` to (re)create the baseline on the current machine.
+"""
+
+# region: imports
+import os
+import sys
+import random
+from argparse import ArgumentParser
+from collections import Counter, OrderedDict
+from importlib.util import find_spec
+
+from benchlib import src_dir, baselines_dir, time_ms, add_gate_args, gate
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+default_baseline = os.path.join(baselines_dir, 'sequences.json')
+SEQUENCES = 20000
+PROTEIN = 'ACDEFGHIKLMNPQRSTVWY'
+DNA = 'ACGT'
+K = 6
+MIN_LENGTH, MAX_LENGTH = 100, 400
+# endregion
+
+
+# region: functions
+def make_sequences(scale, alphabet, min_length, max_length, seed=1):
+    rnd = random.Random(seed)
+    return [''.join(rnd.choices(alphabet, k=rnd.randrange(min_length, max_length)))
+            for _ in range(int(SEQUENCES * scale))]
+
+
+def python_residue_counts(sequences):
+    return [[counter[r] for r in PROTEIN] for counter in map(Counter, sequences)]
+
+
+def python_gc_content(sequences):
+    return [(s.count('G') + s.count('C')) / len(s) if s else 0.0 for s in sequences]
+
+
+def python_kmer_counts(sequences, k):
+    counts = Counter()
+    for s in sequences:
+        counts.update(s[i:i + k] for i in range(len(s) - k + 1))
+    return counts
+
+
+def python_filter_length(sequences):
+    return [s for s in sequences if MIN_LENGTH <= len(s) <= MAX_LENGTH]
+
+
+def run_benchmarks(scale, repeat):
+    """ Return (ms, residues) of each benchmark. """
+    proteins = make_sequences(scale, PROTEIN, 50, 800)
+    dna = make_sequences(scale, DNA, 200, 3000, seed=2)
+    protein_residues = sum(map(len, proteins))
+    dna_residues = sum(map(len, dna))
+    results = OrderedDict()
+    results['python_residue_counts'] = time_ms(lambda: python_residue_counts(proteins), repeat), protein_residues
+    results['python_gc_content'] = time_ms(lambda: python_gc_content(dna), repeat), dna_residues
+    results['python_kmer_counts'] = time_ms(lambda: python_kmer_counts(dna, K), repeat), dna_residues
+    results['python_filter_length'] = time_ms(lambda: python_filter_length(proteins), repeat), protein_residues
+    if find_spec('numpy') is None:
+        print('NumPy is not installed: only the pure-Python baselines are measured', file=sys.stderr)
+        return results
+
+    from pipeapp.lib.seqbatch import SequenceBatch
+    results['seqbatch_encode'] = time_ms(lambda: SequenceBatch.from_sequences(proteins), repeat), protein_residues
+    protein_batch = SequenceBatch.from_sequences(proteins)
+    dna_batch = SequenceBatch.from_sequences(dna)
+    results['seqbatch_residue_counts'] = time_ms(lambda: protein_batch.residue_counts(PROTEIN), repeat), \
+        protein_residues
+    results['seqbatch_gc_content'] = time_ms(dna_batch.gc_content, repeat), dna_residues
+    results['seqbatch_kmer_counts'] = time_ms(lambda: dna_batch.kmer_counts(K, DNA), repeat), dna_residues
+    results['seqbatch_filter_length'] = time_ms(lambda: protein_batch.filter_length(MIN_LENGTH, MAX_LENGTH),
+                                                repeat), protein_residues
+    return results
+
+
+def main():
+    arg_parser = ArgumentParser(prog='bench_sequences', description='benchmark of vectorized sequence statistics')
+    add_gate_args(arg_parser, default_baseline, default_threshold=25.0)
+    arg_parser.add_argument('-s', '--scale', type=float, default=1.0, help='data size, relative to the default')
+    args = arg_parser.parse_args()
+    sys.path.insert(0, src_dir)
+
+    results = run_benchmarks(args.scale, args.repeat)
+    for name, (ms, residues) in results.items():
+        line = '{:<32} {:>10.1f} ms {:>14.3g} residues/s'.format(name, ms, residues / ms * 1000)
+        python_name = name.replace('seqbatch_', 'python_')
+        if name.startswith('seqbatch_') and python_name in results:
+            line += '   x{:.1f} vs pure Python'.format(results[python_name][0] / ms)
+        print(line, file=sys.stderr)
+    return gate(OrderedDict((name, ms) for name, (ms, _) in results.items()), args)
+
+# endregion
+
+
+if __name__ == '__main__':
+    exit(main())
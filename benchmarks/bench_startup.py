@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of pipeapp entry points.
+
+Measures, for `example_app`:
+    import_ms:  cumulative import time of `pipeapp.apps.example_app` (from `python -X importtime`)
+    startup_ms: wall time from launching the interpreter to entering `ExampleApp.init()`
+
+Results are compared to a JSON baseline; the benchmark fails (exit code 1) if any of them regressed by more than
+the threshold. Run with `--save-baseline` to (re)create the baseline on the current machine.
+"""
+
+# region: imports
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from statistics import median
+from subprocess import run, PIPE
+
+from benchlib import src_dir, baselines_dir, env_with_src, add_gate_args, gate
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+default_baseline = os.path.join(baselines_dir, 'startup.json')
+
+# child process: run example_app's console entry point and report the time when init() is entered
+startup_driver = '''
+import os, sys, time
+from pipeapp.apps import example_app
+
+def init(self, **kwargs):
+    sys.stdout.write('INIT {!r}\\n'.format(time.time()))
+    sys.stdout.flush()
+    os._exit(0)
+
+example_app.ExampleApp.init = init
+sys.argv = ['example_app', '--workdir', sys.argv[1]]
+example_app.run_from_console()
+'''
+
+
+# endregion
+
+
+# region: functions
+def measure_import_ms(module='pipeapp.apps.example_app'):
+    """ Return cumulative import time of the module, in ms, and the slowest imported modules. """
+    proc = run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], stderr=PIPE, env=env_with_src(),
+               universal_newlines=True, check=True)
+    timings = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        timings.append((int(cumulative_us), name.strip()))
+    total = [us for us, name in timings if name == module][0]
+    return total / 1000, sorted(timings, reverse=True)[:10]
+
+
+def measure_startup_ms():
+    """ Return wall time from interpreter launch to `ExampleApp.init()`, in ms. """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.time()
+        proc = run([sys.executable, '-c', startup_driver, os.path.join(tmp_dir, 'workdir')], stdout=PIPE,
+                   env=env_with_src(), universal_newlines=True, cwd=tmp_dir, check=True)
+    init_time = [float(line.split()[1]) for line in proc.stdout.splitlines() if line.startswith('INIT ')][0]
+    return (init_time - start) * 1000
+
+
+def run_benchmark(repeat):
+    """ Return median of each metric over `repeat` runs. """
+    import_ms, slowest = [], None
+    for _ in range(repeat):
+        ms, slowest = measure_import_ms()
+        import_ms.append(ms)
+    startup_ms = [measure_startup_ms() for _ in range(repeat)]
+    return {'import_ms': median(import_ms), 'startup_ms': median(startup_ms)}, slowest
+
+
+def main():
+    arg_parser = ArgumentParser(prog='bench_startup', description='startup benchmark of pipeapp entry points')
+    add_gate_args(arg_parser, default_baseline)
+    args = arg_parser.parse_args()
+
+    # byte-compile first, so that compilation of stale sources is not measured
+    run([sys.executable, '-m', 'compileall', '-q', '-f', src_dir], check=True)
+    results, slowest = run_benchmark(args.repeat)
+    print('slowest imports (cumulative us):')
+    for us, name in slowest:
+        print('    {:>8}  {}'.format(us, name))
+
+    return gate(results, args)
+
+# endregion
+
+
+if __name__ == '__main__':
+    exit(main())
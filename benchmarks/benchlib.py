@@ -0,0 +1,99 @@
+"""
+Common code of the benchmarks: timing, JSON baselines and regression gates.
+"""
+
+# region: imports
+import json
+import os
+import sys
+from statistics import median
+from time import perf_counter
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_dir = os.path.join(base_dir, 'src')
+baselines_dir = os.path.join(base_dir, 'benchmarks', 'baselines')
+# endregion
+
+
+# region: functions
+def env_with_src():
+    """ Return environment for child processes, in which `pipeapp` is imported from the source tree. """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (src_dir, env.get('PYTHONPATH')) if p)
+    return env
+
+
+def time_ms(func, repeat, setup=None):
+    """
+    Return median wall time of `func()` over `repeat` runs, in ms.
+    :param func: function to time
+    :param repeat: number of runs
+    :param setup: function called before each run, not timed
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        timings.append((perf_counter() - start) * 1000)
+    return median(timings)
+
+
+def add_gate_args(arg_parser, default_baseline, default_threshold=20.0):
+    """ Add common command line arguments: repeat count, baseline file and regression threshold. """
+    arg_parser.add_argument('-n', '--repeat', type=int, default=7, help='number of runs (median is reported)')
+    arg_parser.add_argument('-t', '--threshold', type=float, default=default_threshold,
+                            help='allowed regression, in percent')
+    arg_parser.add_argument('-b', '--baseline', default=default_baseline, help='baseline JSON file')
+    arg_parser.add_argument('--save-baseline', action='store_true', help='save results as the new baseline')
+
+
+def compare(results, baseline, threshold):
+    """ Print results against the baseline; return list of metrics that regressed by more than `threshold` percent. """
+    regressions = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            print('{:<32} {:>10.1f} ms   (no baseline)'.format(name, value))
+            continue
+        change = (value - base) / base * 100
+        status = 'REGRESSION' if change > threshold else 'ok'
+        print('{:<32} {:>10.1f} ms   baseline {:>10.1f} ms   {:+6.1f}%   {}'.format(name, value, base, change, status))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def gate(results, args):
+    """
+    Save results as the baseline (if asked, or if there is no baseline yet), or compare them to the baseline.
+    :return: exit code: 1 if any metric regressed by more than the threshold, 0 otherwise
+    """
+    if args.save_baseline or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            # keep baselines of the metrics that were not run this time (e.g. filtered out)
+            with open(args.baseline) as fh:
+                baseline = json.load(fh)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print('baseline saved: {}'.format(args.baseline))
+        for name, value in sorted(results.items()):
+            print('{:<32} {:>10.1f} ms'.format(name, value))
+        return 0
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('regressed by more than {}%: {}'.format(args.threshold, ', '.join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+# endregion
@@ -1,3 +1,8 @@
 #!/usr/bin/env bash
+# start warm worker daemon, so that pipeline steps do not pay for interpreter start-up and imports
+export PIPEAPP_WORKER_SOCKET=${PIPEAPP_WORKER_SOCKET:-${TMPDIR:-/tmp}/pipeapp-worker-$$.sock}
+pipeapp_worker --socket ${PIPEAPP_WORKER_SOCKET} &
+worker_pid=$!
+trap 'kill ${worker_pid}; wait ${worker_pid}' EXIT
 snakemake -r -p -s .../pipeapp/etc/pipeline.snake --config species=${species}
 echo 'pipeline finished'
@@ -12,6 +12,10 @@ with open(path.join(base_dir, 'README.md'), encoding='utf-8') as f:
 
 required_packages = ['PyYAML']
 required_packages_test = ['pytest', 'pytest-cov']
+optional_packages = {
+    'numpy': ['numpy'],
+    'zstd': ['zstandard'],
+}
 
 
 setup(
@@ -24,17 +28,25 @@ setup(
     classifiers=[
         'Intended Audience :: Science/Research',
         'Topic :: Scientific / Engineering :: Bio - Informatics',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         ],
     keywords='bioinformatics pipeline',
+    python_requires='>=3.9',
     install_requires=required_packages,
     tests_require=required_packages_test,
+    extras_require=optional_packages,
     packages=find_packages(where='src'),
     package_dir={'': 'src'},
     entry_points={
         'console_scripts': [
-            'example_app = pipeapp.apps.example_app:run_from_console'
+            'example_app = pipeapp.apps.example_app:run_from_console',
+            'pipeapp_worker = pipeapp.lib.worker:serve_from_console',
+            'pipeapp_run = pipeapp.lib.worker:run_from_console',
         ]
     },
     scripts=[
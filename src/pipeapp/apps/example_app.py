@@ -28,11 +28,16 @@ class ExampleApp(PipelineApp):
     Example of using the pipeline app class
     """
 
-    def init(self, input=None, input_manifest=None, **kwargs):
+    def init(self, input=None, input_manifest=None, previous_manifest=None, **kwargs):
         self.log_info('# reading configuration, setting variables')
         self.input_manifest = input_manifest
         mft = ManifestFile(self.input_manifest, generator="align_fasta", action="read")
         fasta_files = mft.entries
+        if previous_manifest:
+            # process only the files that were added or changed since the previous run
+            delta = mft.diff(ManifestFile(previous_manifest, action="read"))
+            fasta_files = delta.added + delta.changed
+            self.log_info('# new/changed fasta files:', len(fasta_files), 'of', len(mft.entries))
         self.log_info(('# working with fasta files:', fasta_files))
 
     def run(self, input=None, input_manifest=None, **kwargs):
@@ -46,19 +51,25 @@ def run_from_console():
     # set up args
     arg_parser = ArgumentParser(prog='example_app',
                                 description='',
-                                usage='%(prog)s --input <inputdir> --workdir <workdir> [--conf <conffile> --debug]',
+                                usage='%(prog)s --input <inputdir> --workdir <workdir> '
+                                      '[--conf <conffile> --debug --resume]',
                                 add_help=True)
     arg_parser.add_argument('-i', '--input', help='directory of input fasta (*.faa) files')
+    arg_parser.add_argument('-m', '--input_manifest', help='manifest of input fasta files')
+    arg_parser.add_argument('-p', '--previous_manifest',
+                            help='manifest of the previous run; only new and changed input files are processed')
     arg_parser.add_argument('-d', '--workdir', required=True, help="task's work directory")
     arg_parser.add_argument('-c', '--conf', help='config file name')
     arg_parser.add_argument('-l', '--log', help='log file name')
     arg_parser.add_argument('--debug', action='store_true', help='run in debug mode')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='keep existing workdir and skip sub-steps that are already done')
     # initialize command line parameters
     args = arg_parser.parse_args()
     args_dict = vars(args)
     args_dict['name'] = arg_parser.prog
     args_dict['no_conf_root_key'] = True
-    ExampleApp.main(**args_dict)
+    return ExampleApp.main(**args_dict)
 
 
 if __name__ == '__main__':
@@ -6,14 +6,101 @@ Library with App class
 import sys
 from os import environ, getenv, path, getcwd
 import logging
+import atexit
+from copy import copy
+from queue import Queue
+from logging.handlers import QueueHandler, QueueListener
+from os import stat, replace as replace_file
 
 from .config import Config
-from .shell import full_path, make_dir, remove_dir
+from .metrics import PhaseMetrics, format_usage, metrics_file_name
+from .shell import full_path, make_dir, remove_dir, remove_dir_background, wait_for_cleanup, ftp_get_file
+from .shell import TabFileWriter, conf_threads
 
 
 # endregion
 
+# region: variables
+_log_handlers = {}  # app logger name -> _AppLogHandlers
+_exception_formatter = logging.Formatter()
+# endregion
+
+
 # region: classes
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format log record as a JSON object on one line.
+    """
+
+    def format(self, record):
+        import json
+        entry = {
+            'time': '{}.{:03d}'.format(self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class _LogQueueHandler(QueueHandler):
+    """
+    `logging.handlers.QueueHandler` that keeps the traceback of the record apart from the message,
+    for the JSON logfile.
+    """
+
+    def prepare(self, record):
+        record = copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        # the record is formatted in another thread: drop the args and the traceback object
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class _AppLogHandlers:
+    """
+    Handlers of an app logger: console handler, and the logfile handler fed by a queue from a background thread.
+    """
+
+    def __init__(self, logger, settings, console_h, logf_h=None):
+        self.logger = logger
+        self.settings = settings
+        self.console_h = console_h
+        self.logf_h = logf_h
+        self.queue = None
+        self.listener = None
+        levels = [console_h.level]
+        logger.addHandler(console_h)
+        if logf_h is not None:
+            self.queue = Queue()
+            self.queue_h = _LogQueueHandler(self.queue)
+            self.queue_h.setLevel(logf_h.level)
+            self.listener = QueueListener(self.queue, logf_h, respect_handler_level=True)
+            self.listener.start()
+            logger.addHandler(self.queue_h)
+            levels.append(logf_h.level)
+        logger.setLevel(min(levels))
+
+    def flush(self):
+        if self.queue is not None:
+            # the listener marks every record done after it is written
+            self.queue.join()
+
+    def remove(self):
+        self.logger.removeHandler(self.console_h)
+        if self.listener is not None:
+            self.logger.removeHandler(self.queue_h)
+            self.listener.stop()
+            self.logf_h.close()
+        _log_handlers.pop(self.logger.name, None)
+
+
 class BasicApp:
     @classmethod
     def main(cls, **kwargs):
@@ -25,26 +112,43 @@ class BasicApp:
         :return: return code of the application
         :rtype: int
         """
-        app = cls(**kwargs)
+        setup_metrics = PhaseMetrics()
+        with setup_metrics.phase('setup'):
+            app = cls(**kwargs)
+        app.metrics.phases[:0] = setup_metrics.phases
+        status = 'failed'
         try:
             app.log.info('# --- Initializing app --- #')
-            app.init(**kwargs)
+            with app.measure_phase('init'):
+                app.init(**kwargs)
             app.log.info('//\n')
             app.log.info('# --- Running main body --- #')
-            app.run(**kwargs)
+            with app.measure_phase('run'):
+                app.run(**kwargs)
             app.log.info('//\n')
             app.log.info('# --- Exiting --- #')
-            app.exit(**kwargs)
-            app.post_exit(**kwargs)
+            with app.measure_phase('exit'):
+                app.exit(**kwargs)
+            with app.measure_phase('post_exit'):
+                app.post_exit(**kwargs)
             app.log.info('//\n')
             app.log.info('---   FINISHED   ---\n\n')
+            status = 'ok'
             return 0
 
         except Exception as e:
             app.log.exception(str(e))
             return -1
 
-    def __init__(self, name=None, conf=None, log=None, debug=False, no_conf_root_key=False, **kwargs):
+        finally:
+            try:
+                app.save_metrics(status=status)
+            except OSError as e:
+                app.log.warning('Could not save metrics: {}'.format(e))
+            app.flush_log()
+
+    def __init__(self, name=None, conf=None, log=None, debug=False, no_conf_root_key=False, log_mode='w',
+                 log_format=None, log_file_level=None, **kwargs):
         """
         Initialize BasicApp instance.
 
@@ -54,11 +158,15 @@ class BasicApp:
         :param debug:   debug mode
         :param workdir: work directory path
         :param no_conf_root_key:    expect to have a root key with this app name in the config file
+        :param log_mode:    mode of writing to log file ('w' or 'a')
+        :param log_format:  log file format, 'text' or 'json' (JSON lines)
+        :param log_file_level:  level of log file records ('DEBUG' by default)
         """
         self.name = name or 'app'
         self.argv = sys.argv
         self.logfile = log
-        self.log = self._make_logger(logfile_name=self.logfile, debug=debug)
+        self.log = self._make_logger(logfile_name=self.logfile, file_mode=log_mode, debug=debug, log_format=log_format,
+                                     log_file_level=log_file_level)
         self.log.info('\n\n# ---   Starting app: {0}   --- #'.format(self.name))
         self.log.info('Command: {}'.format(' '.join(self.argv)))
         conf_root_key = None
@@ -67,6 +175,7 @@ class BasicApp:
         self.conf = self._make_config(conf_file=conf, root_key=conf_root_key)
         self.debug = debug
         self.conf.DEBUG = debug
+        self.metrics = PhaseMetrics()
 
     def init(self, **kw):
         """Virtual method to initialize app, must be overridden in the child class."""
@@ -91,9 +200,16 @@ class BasicApp:
         :param conf_file: file with configuration
         :return: configuration object
         """
-        conf = Config()
         var_prefix = self.name.upper() + '_'  # env vars must begin with APP_NAME_ to be added to config
 
+        # merged config snapshot saved by the parent process (see `snapshot_config()`): no parsing needed
+        conf_snapshot = getenv('{}CONFIG_SNAPSHOT'.format(var_prefix))
+        if conf_snapshot:
+            self.log.info('Reading config snapshot: {}'.format(conf_snapshot))
+            return Config.from_snapshot(conf_snapshot)
+
+        conf = Config()
+
         # read config file name from conf_file variable and read config from that file
         conf_file_yaml = None
         conf_file_env_var = '{}CONFIG_YAML'.format(var_prefix)
@@ -109,28 +225,109 @@ class BasicApp:
         # read env vars and update conf
         self.log.info('Reading environment variables')
         # self.log.info('var_prefix: ' + var_prefix)
-        for var in environ:
-            # self.log.info('@ var: ' + str(var))
-            if var.startswith(var_prefix):
-                # self.log.info('    add to config')
-                key = var[len(var_prefix):]
-                val = environ[var]
-                conf[key] = val
-                self.log.info('    env var: ${}={}'.format(key, val))
+        prefix_len = len(var_prefix)
+        for var, val in [item for item in environ.items() if item[0].startswith(var_prefix)]:
+            key = var[prefix_len:]
+            conf[key] = val
+            self.log.info('    env var: ${}={}'.format(key, val))
         return conf
 
-    def _make_logger(self, logfile_name, file_mode='w', debug=False):
+    @property
+    def metrics_dir(self):
+        """ Directory of the metrics file and profiler reports: directory of the logfile (None if there is none). """
+        return path.dirname(path.abspath(self.logfile)) if self.logfile else None
+
+    def _phase_listed(self, key, phase):
+        """ Check if the phase is listed in config value `key`: comma-separated phase names, 'all' or true. """
+        value = self.conf.get(key, self.conf.get(key.upper()))
+        if not value:
+            return False
+        if isinstance(value, str):
+            value = [v.strip() for v in value.split(',')]
+        elif not isinstance(value, (list, tuple)):
+            return _is_true(value)
+        return phase in value or 'all' in value or (len(value) == 1 and _is_true(value[0]))
+
+    def measure_phase(self, phase):
+        """
+        Context that records resource usage of the app phase (see `.metrics.PhaseMetrics`).
+        The phase is also profiled with cProfile and/or tracemalloc if it is listed in config value
+        `profile` and/or `trace_memory` (e.g. env var <APP_NAME>_PROFILE=init,run or `profile: all` in config file);
+        reports are saved in `metrics_dir` as <app name>.<phase>.prof(.txt) and <app name>.<phase>.tracemalloc.txt.
+
+        # example:
+        >>> with self.measure_phase('align'):
+        >>>   self.align(fasta)
+
+        :param phase: phase name
+        :type phase: str
+        """
+        profile = self._phase_listed('profile', phase)
+        trace_memory = self._phase_listed('trace_memory', phase)
+        dump_prefix = None
+        if profile or trace_memory:
+            if self.metrics_dir:
+                dump_prefix = path.join(self.metrics_dir, '{}.{}'.format(self.name, phase))
+            else:
+                self.log.warning('No log directory: profile of phase {} will not be saved'.format(phase))
+        return self.metrics.phase(phase, profile=profile, trace_memory=trace_memory, dump_prefix=dump_prefix)
+
+    def save_metrics(self, **info):
+        """
+        Append resource usage of the phases to the metrics file <app name>.metrics.json in `metrics_dir`
+        (one JSON object per run).
+
+        :param info: other fields of the JSON object
+        :return: metrics file name, or None if the app has no `metrics_dir`
+        """
+        for record in self.metrics.phases + [self.metrics.total()]:
+            self.log.debug('# resources: ' + format_usage(record))
+        if not self.metrics_dir:
+            return None
+        filename = metrics_file_name(self.metrics_dir, self.name)
+        self.metrics.save(filename, app=self.name, argv=self.argv, **info)
+        return filename
+
+    def snapshot_config(self, filename):
+        """
+        Save merged app config for child processes.
+        Returns env vars to pass to the child app, so that it loads the snapshot instead of parsing config again.
+
+        :param filename: snapshot file name
+        :return: env vars
+        :rtype: dict
+        """
+        self.conf.save_snapshot(filename)
+        return {'{}_CONFIG_SNAPSHOT'.format(self.name.upper()): filename}
+
+    def _make_logger(self, logfile_name, file_mode='w', debug=False, log_format=None, log_file_level=None):
         """
         Create logger object for the app with streams to console and logfile.
+        Handlers are installed once per app logger: creating the app again reuses them, or replaces them if the
+        logfile must be opened again. Logfile is written by a background thread, fed by a queue.
 
         :param logfile_name: logfile name
         :param file_mode: mode of writing to file; should be a valid file mode (e.g. 'w', 'a', etc)
         :param debug: should we use DEBUG mode?
+        :param log_format: logfile format: 'text' (default) or 'json' (JSON lines); env var <APP_NAME>_LOG_FORMAT
+        :param log_file_level: logfile level name (DEBUG by default); env var <APP_NAME>_LOG_FILE_LEVEL
         :return: logger object
         """
-        # create logger
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.DEBUG)
+        var_prefix = self.name.upper() + '_'
+        log_format = log_format or getenv(var_prefix + 'LOG_FORMAT') or 'text'
+        log_file_level = log_file_level or getenv(var_prefix + 'LOG_FILE_LEVEL') or 'DEBUG'
+        if log_format not in ('text', 'json'):
+            raise ValueError('Unknown log format: {}'.format(log_format))
+        logger = logging.getLogger(__name__).getChild(self.name)
+        settings = (logfile_name and path.abspath(logfile_name), debug, log_format, log_file_level.upper())
+        installed = _log_handlers.get(logger.name)
+        # a logfile opened for writing (or removed with an old workdir) must be opened again
+        if installed is not None and installed.settings == settings and \
+                (logfile_name is None or (not file_mode.startswith('w') and path.exists(logfile_name))):
+            return logger
+        if installed is not None:
+            installed.remove()
+
         # create console handler with default level INFO, unless function arg `debug` says it to be DEBUG
         console_h = logging.StreamHandler(stream=sys.stdout)
         if debug:
@@ -139,21 +336,36 @@ class BasicApp:
             console_h.setLevel(logging.INFO)
         console_fmt = logging.Formatter(fmt='%(message)s')
         console_h.setFormatter(console_fmt)
-        logger.addHandler(console_h)
-        # create logfile handler and set its level do DEBUG
+        # create logfile handler and set its level (DEBUG by default)
+        logf_h = None
         if logfile_name is not None:
             logf_h = logging.FileHandler(filename=logfile_name, mode=file_mode)
-            logf_h.setLevel(logging.DEBUG)
-            logf_fmt = logging.Formatter(fmt='%(asctime)s\t%(levelname)s:\t%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+            logf_h.setLevel(log_file_level.upper())
+            if log_format == 'json':
+                logf_fmt = JsonLinesFormatter()
+            else:
+                logf_fmt = logging.Formatter(fmt='%(asctime)s\t%(levelname)s:\t%(message)s',
+                                             datefmt='%Y-%m-%d %H:%M:%S')
             logf_h.setFormatter(logf_fmt)
-            logger.addHandler(logf_h)
+        _log_handlers[logger.name] = _AppLogHandlers(logger, settings, console_h, logf_h)
         return logger
 
+    def flush_log(self):
+        """ Wait until all the queued log records are written to the logfile. """
+        installed = _log_handlers.get(self.log.name)
+        if installed is not None:
+            installed.flush()
+
     def log_info(self, *args):
+        if not self.log.isEnabledFor(logging.INFO):
+            return
         text_out = ' '.join(str(a) for a in args)
         self.log.info(text_out)
 
     def log_debug(self, *args):
+        # skip formatting (which may be expensive for big objects) if nobody listens
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
         text_out = ' '.join(str(a) for a in args)
         self.log.debug(text_out.strip())
 
@@ -167,7 +379,32 @@ class BasicApp:
 
 
 class PipelineApp(BasicApp):
-    def __init__(self, workdir=None, **kwargs):
+    checkpoints_file_name = 'checkpoints.json'
+    # config keys whose values change the results of the sub-steps, so they are part of every step fingerprint
+    # (see `step_fingerprint()`); settings of a single sub-step should be passed as its `params` instead
+    fingerprint_conf_keys = ()
+    # config keys that only control how the app is run (many are set from env vars <APP_NAME>_<KEY>, e.g. by
+    # `.pipeline.Pipeline`); they never invalidate checkpoints, even if listed in `fingerprint_conf_keys`
+    run_control_conf_keys = ('DEBUG', 'RESUME', 'CLEANUP_MODE', 'WAIT_CLEANUP', 'LOG_FORMAT', 'LOG_FILE_LEVEL',
+                             'PROFILE', 'TRACE_MEMORY', 'THREADS', 'CONFIG_YAML', 'CONFIG_SNAPSHOT',
+                             'DOWNLOAD_CACHE_DIR', 'DOWNLOAD_CACHE_MAX_BYTES', 'TAB_CACHE_DIR')
+
+    def __init__(self, workdir=None, resume=False, cleanup_mode=None, wait_cleanup=False, **kwargs):
+        """
+        Initialize PipelineApp instance.
+
+        :param workdir: work directory path
+        :param resume:  keep existing workdir and skip sub-steps whose checkpoints are still valid (see `run_step()`);
+                        can also be set by env var <APP_NAME>_RESUME
+        :param cleanup_mode:    how old workdir and `tmp` are removed: 'process' (detached process, default),
+                                'thread' (background threads) or 'sync'; env var <APP_NAME>_CLEANUP_MODE
+        :param wait_cleanup:    wait until the background removal is done (useful in tests);
+                                env var <APP_NAME>_WAIT_CLEANUP
+        """
+        env_prefix = (kwargs.get('name') or 'app').upper() + '_'
+        self.resume = resume or _is_true(getenv(env_prefix + 'RESUME'))
+        self.cleanup_mode = cleanup_mode or getenv(env_prefix + 'CLEANUP_MODE') or 'process'
+        self.wait_cleanup = wait_cleanup or _is_true(getenv(env_prefix + 'WAIT_CLEANUP'))
 
         # workdir and subdir names
         if workdir:
@@ -182,8 +419,8 @@ class PipelineApp(BasicApp):
         # create directory structure, if init_dirs was provided
 
         # create workdir and all subdirs
-        if path.exists(self.workdir):
-            remove_dir(self.workdir)
+        if path.exists(self.workdir) and not self.resume:
+            self._remove_dir(self.workdir)
         make_dir(self.workdir)
         make_dir(self.dir_tmp)
         make_dir(self.dir_in)
@@ -193,22 +430,214 @@ class PipelineApp(BasicApp):
         if 'log' not in kwargs or kwargs.get('log') is None:
             log = path.join(self.dir_log, kwargs['name'] + ".log")
             kwargs['log'] = log
+        if self.resume:
+            kwargs['log_mode'] = 'a'
         super().__init__(**kwargs)
         self.log.info('Work directory: {}'.format(self.workdir))
+        self.checkpoints_file = path.join(self.workdir, self.checkpoints_file_name)
+        self.checkpoints = self._read_checkpoints() if self.resume else {}
+        if self.resume:
+            self.log.info('Resuming from checkpoints: {}'.format(', '.join(sorted(self.checkpoints)) or '-'))
         self.log.info('//\n')
 
+    @property
+    def metrics_dir(self):
+        """ Metrics and profiler reports are saved in `dir_log`. """
+        return self.dir_log
+
+    def _read_checkpoints(self):
+        import json
+        try:
+            with open(self.checkpoints_file) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_checkpoints(self):
+        import json
+        tmp_file = self.checkpoints_file + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.checkpoints, fh, indent=1, sort_keys=True)
+        replace_file(tmp_file, self.checkpoints_file)
+
+    def step_fingerprint(self, name, inputs=(), params=None):
+        """
+        Fingerprint of a sub-step: its name, size and mtime of its input files, its parameters and the values of
+        the config keys listed in `fingerprint_conf_keys`. The rest of the config (e.g. threads, resume and
+        cleanup settings) does not change the results, so it does not invalidate the checkpoints.
+
+        :param name: sub-step name
+        :param inputs: input file names
+        :param params: any JSON-serializable sub-step parameters
+        :return: hex digest
+        """
+        import json
+        import hashlib
+        run_control = {k.upper() for k in self.run_control_conf_keys}
+        state = {
+            'name': name,
+            'inputs': [_file_state(f) for f in inputs],
+            'params': params,
+            'conf': {k: self.conf.get(k, self.conf.get(k.upper())) for k in self.fingerprint_conf_keys
+                     if k.upper() not in run_control},
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def step_is_done(self, name, inputs=(), outputs=(), params=None):
+        """
+        Check if sub-step has a checkpoint with the same fingerprint and its outputs are unchanged since then.
+        """
+        checkpoint = self.checkpoints.get(name)
+        if checkpoint is None or checkpoint['fingerprint'] != self.step_fingerprint(name, inputs, params):
+            return False
+        return checkpoint['outputs'] == [_file_state(f) for f in outputs]
+
+    def mark_step_done(self, name, inputs=(), outputs=(), params=None):
+        """
+        Record checkpoint of a finished sub-step.
+        """
+        self.checkpoints[name] = {
+            'fingerprint': self.step_fingerprint(name, inputs, params),
+            'outputs': [_file_state(f) for f in outputs],
+        }
+        self._write_checkpoints()
+
+    def run_step(self, name, func, inputs=(), outputs=(), params=None):
+        """
+        Run sub-step `func()` unless, in resume mode, it has a valid checkpoint; record its checkpoint afterwards.
+
+        # example:
+        >>> self.run_step('align', lambda: self.align(fasta), inputs=[fasta], outputs=[aln], params={'k': 5})
+
+        :param name: sub-step name
+        :param func: function that runs the sub-step
+        :param inputs: input file names
+        :param outputs: output file names
+        :param params: any JSON-serializable sub-step parameters
+        :return: True if the sub-step was run, False if skipped
+        """
+        if self.resume and self.step_is_done(name, inputs, outputs, params):
+            self.log.info('# skipping step (checkpoint is valid): {}'.format(name))
+            return False
+        self.checkpoints.pop(name, None)
+        func()
+        self.mark_step_done(name, inputs, outputs, params)
+        return True
+
+    def download(self, url, fname=None):
+        """
+        Download remote file to `dir_in`.
+        If `download_cache_dir` is set in config, the file is taken from the node-local download cache
+        (see `.cache.DownloadCache`), whose total size is capped by `download_cache_max_bytes`.
+
+        :param url: remote file URL
+        :type url: str
+        :param fname: file name in `dir_in` (base name of the URL by default)
+        :type fname: str
+        :return: path to the downloaded file
+        :rtype: str
+        """
+        fout = path.join(self.dir_in, fname or path.basename(url))
+        cache_dir = self.conf.get('download_cache_dir', self.conf.get('DOWNLOAD_CACHE_DIR'))
+        if cache_dir:
+            from .cache import DownloadCache
+            max_bytes = self.conf.get('download_cache_max_bytes', self.conf.get('DOWNLOAD_CACHE_MAX_BYTES'))
+            cached = DownloadCache(cache_dir, max_bytes=max_bytes).get(url, fout)
+            self.log_debug('Download cache {}: {}'.format('hit' if cached else 'miss', url))
+        elif not ftp_get_file(url, fout):
+            raise IOError('Error downloading file: {}'.format(url))
+        return fout
+
+    def tab_file_writer(self, fname, fieldnames=None, headline=True, compress=None, level=6):
+        """
+        Open tab-delimited output file for writing (see `.shell.TabFileWriter`): the file is written in `dir_tmp`
+        and moved to `dir_out` when the writer is closed, so `dir_out` only holds complete files.
+        Gzipped (.gz) files are compressed on `threads` (config) threads.
+
+        :param fname: file name in `dir_out`
+        :type fname: str
+        :param fieldnames: field names
+        :type fieldnames: list
+        :param headline: write the headline?
+        :type headline: bool
+        :param compress: compress the file? (by default, if the file name ends with .gz)
+        :type compress: bool
+        :param level: compression level (1-9)
+        :type level: int
+        :rtype: TabFileWriter
+        """
+        return TabFileWriter(path.join(self.dir_out, fname), fieldnames=fieldnames, headline=headline,
+                             compress=compress, level=level, threads=conf_threads(self.conf), tmp_dir=self.dir_tmp)
+
+    def tab_columns(self, filename, columns=None, dtypes=None, headline=True, fieldnames=None):
+        """
+        Load columns of the tab-delimited file through the binary columnar cache (see `.tabcache.TabColumnCache`):
+        the file is parsed once, later loads memory-map its columns.
+        The cache is shared between runs if `tab_cache_dir` is set in config, otherwise it is kept in `dir_tmp`.
+
+        :param filename: tab-delimited file name (may be compressed)
+        :type filename: str
+        :param columns: names of the columns (all columns by default)
+        :type columns: list
+        :param dtypes: column name -> dtype; dtype is one of int, float, str or 'category' (str by default)
+        :type dtypes: dict
+        :param headline: should we use the first line as the headline (containing field names)?
+        :type headline: bool
+        :param fieldnames: field names, if file has no headline
+        :type fieldnames: list
+        :rtype: .tabcache.TabColumns
+        """
+        from .tabcache import tab_columns
+        cache_dir = self.conf.get('tab_cache_dir', self.conf.get('TAB_CACHE_DIR'))
+        return tab_columns(filename, cache_dir or path.join(self.dir_tmp, 'tab_cache'), columns=columns,
+                           dtypes=dtypes, headline=headline, fieldnames=fieldnames)
+
     def post_exit(self, **kwargs):
         """ Cleanup procedures after exit() """
         if not self.debug:
-            remove_dir(self.dir_tmp)
+            self._remove_dir(self.dir_tmp)
+
+    def _remove_dir(self, dirname):
+        """ Remove directory according to `cleanup_mode`; the tree is renamed aside next to the workdir. """
+        if self.cleanup_mode == 'sync':
+            remove_dir(dirname)
+            return
+        remove_dir_background(dirname, mode=self.cleanup_mode, trash_dir=path.dirname(self.workdir))
+        if self.wait_cleanup:
+            wait_for_cleanup()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """ Cleanup procedures after exit() """
         if not self.debug:
-            remove_dir(self.dir_tmp)
+            self._remove_dir(self.dir_tmp)
+
 
 # endregion
 
+
 # region: functions
+def _remove_log_handlers():
+    """ Write the queued log records and close the logfiles. """
+    for installed in list(_log_handlers.values()):
+        installed.remove()
+
+
+atexit.register(_remove_log_handlers)
+
+
+def _is_true(value):
+    """ Interpret config/env var value as boolean. """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def _file_state(filename):
+    """ Return [path, size, mtime] of the file, or [path, None, None] if it does not exist. """
+    try:
+        st = stat(filename)
+    except OSError:
+        return [filename, None, None]
+    return [filename, st.st_size, st.st_mtime_ns]
 
 # endregion
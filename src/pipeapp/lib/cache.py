@@ -0,0 +1,187 @@
+"""
+Node-local, content-addressed cache of downloaded files
+"""
+
+# region: imports
+import json
+import hashlib
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+from os import path, listdir, getpid, chmod, utime, stat, replace as replace_file
+
+from .shell import full_path, make_dir, remove_file, link_or_copy, file_checksum, ftp_get_file, ftp_stat
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+# endregion
+
+
+# region: classes
+class DownloadCache:
+    """
+    Cache of remote files shared by all the apps on the node.
+
+    A cached file is addressed by its URL plus the remote size and mtime, so it is downloaded again when the remote
+    file changes; a file whose remote size and mtime are both unknown is not cached, as its changes could not be
+    noticed. Its checksum is computed when it is stored. Before a cached file is used, its size and mtime are
+    compared with the stored ones (and its checksum, if `verify` is set). Cached files are read-only and are
+    hard-linked (or reflinked, or copied, if linking is not possible) to their destinations. The total size of
+    the cache is capped by evicting the least recently used files. Concurrent processes are synchronized with
+    file locks: one lock per file being downloaded, plus a cache-wide lock that is exclusive only while files are
+    stored or evicted.
+
+    # example:
+    >>> cache = DownloadCache('/scratch/download_cache', max_bytes=100 * 2 ** 30)
+    >>> cache.get('ftp://ftp.ncbi.nlm.nih.gov/genomes/.../protein.faa.gz', path.join(self.dir_in, 'protein.faa.gz'))
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, verify=False):
+        """
+        :param cache_dir: cache directory
+        :type cache_dir: str
+        :param max_bytes: max total size of cached files (unlimited, if None)
+        :type max_bytes: int
+        :param verify: re-compute checksum of a cached file before using it
+        :type verify: bool
+        """
+        self.cache_dir = full_path(cache_dir)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.verify = verify
+        self.dir_objects = path.join(self.cache_dir, 'objects')
+        self.dir_tmp = path.join(self.cache_dir, 'tmp')
+        self.dir_locks = path.join(self.cache_dir, 'locks')
+        for d in (self.dir_objects, self.dir_tmp, self.dir_locks):
+            make_dir(d)
+
+    @staticmethod
+    def key(url, size, mtime):
+        """ Cache key of the remote file. """
+        return hashlib.sha256('{}\0{}\0{}'.format(url, size, mtime).encode('utf-8')).hexdigest()
+
+    def _object_path(self, key):
+        return path.join(self.dir_objects, key)
+
+    def _meta_path(self, key):
+        return path.join(self.dir_objects, key + '.json')
+
+    @contextmanager
+    def _lock(self, name, exclusive=True):
+        with open(path.join(self.dir_locks, name + '.lock'), 'a') as fh:
+            flock(fh.fileno(), LOCK_EX if exclusive else LOCK_SH)
+            try:
+                yield
+            finally:
+                flock(fh.fileno(), LOCK_UN)
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _is_valid(self, key, size):
+        meta = self._read_meta(key)
+        obj = self._object_path(key)
+        if meta is None or not path.isfile(obj):
+            return False
+        st = stat(obj)
+        if st.st_size != meta['size'] or (size is not None and meta['size'] != size):
+            return False
+        # modified in place through one of its hard links (the size may be the same)
+        if st.st_mtime_ns != meta.get('object_mtime'):
+            return False
+        if self.verify and file_checksum(obj) != meta['sha256']:
+            return False
+        return True
+
+    def get(self, url, dst, fetch=None, stat_remote=None):
+        """
+        Put remote file to `dst`, downloading it only if it is not in the cache yet.
+        :param url: remote file URL
+        :type url: str
+        :param dst: destination file name
+        :type dst: str
+        :param fetch: function (url, filename) that downloads the file (`ftp_get_file` by default)
+        :type fetch: callable
+        :param stat_remote: function url -> (size, mtime) of the remote file (`ftp_stat` by default)
+        :type stat_remote: callable
+        :return: True if the file was taken from the cache, False if it was downloaded
+        :rtype: bool
+        """
+        fetch = fetch or ftp_get_file
+        size, mtime = (stat_remote or ftp_stat)(url)
+        if size is None and mtime is None:
+            # the key would be the URL alone, and a changed remote file would be served from the cache forever
+            if fetch(url, dst) is False or not path.isfile(dst):
+                raise IOError('Error downloading file: {}'.format(url))
+            return False
+        key = self.key(url, size, mtime)
+        obj = self._object_path(key)
+        # only one process downloads the file, the others wait for it and then take it from the cache
+        with self._lock(key):
+            with self._lock('cache', exclusive=False):
+                if self._is_valid(key, size):
+                    utime(self._meta_path(key))  # mark as recently used
+                    link_or_copy(obj, dst)
+                    return True
+
+            tmp = path.join(self.dir_tmp, '{}.{}'.format(key, getpid()))
+            try:
+                if fetch(url, tmp) is False or not path.isfile(tmp):
+                    raise IOError('Error downloading file: {}'.format(url))
+                tmp_size = stat(tmp).st_size
+                if size is not None and tmp_size != size:
+                    raise IOError('Downloaded file {} has size {}, expected {}'.format(url, tmp_size, size))
+                chmod(tmp, 0o444)  # hard links share the inode: nobody should modify the cached file through them
+                meta = {'url': url, 'size': tmp_size, 'mtime': mtime, 'sha256': file_checksum(tmp),
+                        'object_mtime': stat(tmp).st_mtime_ns}
+                with self._lock('cache'):
+                    replace_file(tmp, obj)
+                    with open(self._meta_path(key), 'w') as fh:
+                        json.dump(meta, fh)
+                    link_or_copy(obj, dst)
+                    self._evict()
+            finally:
+                remove_file(tmp)
+        return False
+
+    def entries(self):
+        """ Return list of (last use time, size, key) of the cached files, least recently used first. """
+        entries = []
+        for fname in listdir(self.dir_objects):
+            if not fname.endswith('.json'):
+                continue
+            key = fname[:-len('.json')]
+            try:
+                last_used = stat(self._meta_path(key)).st_mtime
+                size = stat(self._object_path(key)).st_size
+            except OSError:
+                continue
+            entries.append((last_used, size, key))
+        return sorted(entries)
+
+    def size(self):
+        """ Return total size of the cached files. """
+        return sum(size for _, size, _ in self.entries())
+
+    def _evict(self):
+        """ Remove least recently used files until the cache fits `max_bytes`; the cache lock must be held. """
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            remove_file(self._meta_path(key))
+            remove_file(self._object_path(key))
+            total -= size
+
+    def evict(self):
+        """ Remove least recently used files until the cache fits `max_bytes`. """
+        with self._lock('cache'):
+            self._evict()
+
+# endregion
@@ -0,0 +1,656 @@
+"""
+Compression codecs: detection by magic bytes and (multi-threaded) decompression; multi-threaded BGZF compression
+"""
+
+# region: imports
+import io
+import struct
+import zlib
+from os import cpu_count
+from collections import deque, OrderedDict
+# endregion
+
+# region: constants
+MAGIC_SIZE = 18  # enough bytes to recognize any registered codec, including the BGZF extra field
+BGZF_BLOCKS_PER_TASK = 16  # BGZF blocks are <= 64KB, so inflate several of them per thread pool task
+BGZF_TASKS_PER_THREAD = 4  # how many tasks per thread may be queued ahead of the reader
+GZIP_TOOLS = ('igzip', 'pigz')  # faster decompressors of plain (non-BGZF) gzip files, in order of preference
+GZIP_TOOL_ENV_VAR = 'PIPEAPP_GZIP_TOOL'  # external decompressor (e.g. 'pigz'), or 'auto' for the first of GZIP_TOOLS
+BGZF_BLOCK_DATA = 0xff00  # max. uncompressed data per BGZF block, so that even incompressible blocks fit in 64KB
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')  # empty end-of-file block
+# endregion
+
+# region: variables
+_codecs = OrderedDict()
+_gzip_tool = {}  # GZIP_TOOL_ENV_VAR value -> path of the tool found for it, or None
+
+
+# endregion
+
+
+# region: classes
+class Codec:
+    """
+    Compression codec, recognized by the magic bytes at the beginning of the file.
+    """
+
+    def __init__(self, name, magic, opener, extensions=(), available=True, stream_opener=None):
+        """
+        :param name: codec name
+        :type name: str
+        :param magic: magic bytes the compressed file starts with
+        :type magic: bytes
+        :param opener: function (filename, threads) -> binary file handle of decompressed data
+        :type opener: callable
+        :param extensions: usual file name extensions
+        :type extensions: tuple
+        :param available: False if the library needed by the codec is not installed
+        :type available: bool
+        :param stream_opener: function (binary file handle) -> binary file handle of decompressed data
+        :type stream_opener: callable
+        """
+        self.name = name
+        self.magic = magic
+        self.opener = opener
+        self.extensions = extensions
+        self.available = available
+        self.stream_opener = stream_opener
+
+    def matches(self, head):
+        return head.startswith(self.magic)
+
+    def open(self, filename, threads=None):
+        if not self.available:
+            raise ImportError('Codec {} is not available; install the library it requires'.format(self.name))
+        return self.opener(filename, threads)
+
+    def open_stream(self, fh):
+        if not self.available:
+            raise ImportError('Codec {} is not available; install the library it requires'.format(self.name))
+        if self.stream_opener is None:
+            raise NotImplementedError('Codec {} cannot decompress streams'.format(self.name))
+        return self.stream_opener(fh)
+
+    def __repr__(self):
+        return 'Codec({!r})'.format(self.name)
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Read-only raw stream over an iterator of bytes chunks.
+    """
+
+    def __init__(self, chunks, close_callback=None):
+        super().__init__()
+        self._chunks = chunks
+        self._chunk = b''
+        self._pos = 0
+        self._close_callback = close_callback
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            self._chunk = next(self._chunks, None)
+            self._pos = 0
+            if self._chunk is None:
+                self._chunk = b''
+                return 0
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+            if self._close_callback is not None:
+                self._close_callback()
+        super().close()
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Write-only raw stream compressing data to a BGZF file (blocked gzip, as written by `bgzip`).
+
+    Data is cut into groups of blocks, which are deflated on a thread pool and written in order.
+    A BGZF file is a valid multi-member gzip file, so it can be read by `gzip`, `zcat`, etc.
+    It is also decompressed in parallel by `open_compressed()`.
+
+    # example:
+    >>> with io.BufferedWriter(BgzfWriter('out.tsv.gz', threads=8), buffer_size=1 << 22) as fh:
+    >>>   fh.write(data)
+    """
+
+    def __init__(self, filename, level=6, threads=None):
+        """
+        :param filename: output file name
+        :type filename: str
+        :param level: compression level (1-9)
+        :type level: int
+        :param threads: number of compression threads (all CPUs by default)
+        :type threads: int
+        """
+        super().__init__()
+        self.level = level
+        self.threads = _threads(threads)
+        self._fh = open(filename, 'wb')
+        self._buffer = bytearray()
+        self._group_size = BGZF_BLOCK_DATA * BGZF_BLOCKS_PER_TASK
+        self._pending = deque()
+        self._executor = None
+        if self.threads > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        if len(self._buffer) >= self._group_size:
+            n = len(self._buffer) - len(self._buffer) % self._group_size
+            for start in range(0, n, self._group_size):
+                self._submit(bytes(self._buffer[start:start + self._group_size]))
+            del self._buffer[:n]
+        return len(b)
+
+    def _submit(self, data):
+        if self._executor is None:
+            self._fh.write(_bgzf_deflate(data, self.level))
+            return
+        self._pending.append(self._executor.submit(_bgzf_deflate, data, self.level))
+        while len(self._pending) > self.threads * BGZF_TASKS_PER_THREAD:
+            self._fh.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fh.write(self._pending.popleft().result())
+            self._fh.write(BGZF_EOF)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+            self._fh.close()
+            super().close()
+
+
+class BgzfRandomReader:
+    """
+    Random access to the uncompressed data of a BGZF file, through the index of its blocks.
+
+    The index is the `.gzi` file written by `bgzip -i` / `samtools faidx` (uint64 number of entries, then uint64
+    pairs of compressed and uncompressed offsets of the blocks, except the first one); it is built and saved
+    if it does not exist, is older than the file, or does not end where the file does (the file was appended to
+    or truncated). Only the blocks that hold the requested range are inflated; the most recently used blocks
+    are kept in memory.
+
+    # example:
+    >>> reader = BgzfRandomReader('genome.fa.gz')
+    >>> data = reader.read(1000000, 100)
+    """
+
+    def __init__(self, filename, index_filename=None, save_index=True, cache_blocks=64):
+        """
+        :param filename: BGZF file name
+        :type filename: str
+        :param index_filename: block index file name (`<filename>.gzi` by default)
+        :type index_filename: str
+        :param save_index: save the index, if it had to be built
+        :type save_index: bool
+        :param cache_blocks: number of inflated blocks to keep in memory
+        :type cache_blocks: int
+        """
+        from os import path
+        from mmap import mmap, ACCESS_READ
+        self.filename = filename
+        self.index_filename = index_filename or filename + '.gzi'
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+        if not path.getsize(filename):
+            raise ValueError('Empty file {} is not a BGZF file'.format(filename))
+        with open(filename, 'rb') as fh:
+            self._map = mmap(fh.fileno(), 0, access=ACCESS_READ)
+        self.coffsets = None
+        if path.exists(self.index_filename) and path.getmtime(self.index_filename) >= path.getmtime(filename):
+            self.coffsets, self.uoffsets = read_gzi(self.index_filename)
+            if not self._index_is_current():
+                self.coffsets = None
+        if self.coffsets is None:
+            self.coffsets, self.uoffsets = self._build_index()
+            if save_index:
+                try:
+                    write_gzi(self.index_filename, self.coffsets, self.uoffsets)
+                except OSError:
+                    pass
+        self.size = self._block_end(len(self.coffsets) - 1)[1]
+
+    def _build_index(self):
+        """ Read the header and the size field of every block; nothing is inflated. """
+        coffsets, uoffsets = [0], [0]
+        coffset, uoffset = 0, 0
+        m = self._map
+        while coffset < len(m):
+            block = _bgzf_block_size(m[coffset:coffset + 18])
+            if block is None:
+                raise IOError('Invalid BGZF block header at offset {} of {}'.format(coffset, self.filename))
+            coffset += block[0]
+            uoffset += struct.unpack('<I', m[coffset - 4:coffset])[0]
+            if coffset < len(m):
+                coffsets.append(coffset)
+                uoffsets.append(uoffset)
+        return coffsets, uoffsets
+
+    def _index_is_current(self):
+        """
+        Check that the index covers the whole file: the blocks after the last indexed one (the EOF marker block)
+        hold no data, and the last block ends at the end of the file.
+        """
+        coffset = self.coffsets[-1]
+        if coffset >= len(self._map):
+            return False
+        while coffset < len(self._map):
+            block = _bgzf_block_size(self._map[coffset:coffset + 18])
+            if block is None:
+                return False
+            end = coffset + block[0]
+            # ISIZE, the uncompressed size of the block
+            if coffset > self.coffsets[-1] and self._map[end - 4:end] != bytes(4):
+                return False
+            coffset = end
+        return coffset == len(self._map)
+
+    def _block_header(self, i):
+        """ Return (total block size, extra field length) of the i-th block. """
+        start = self.coffsets[i]
+        block = _bgzf_block_size(self._map[start:start + 18])
+        if block is None:
+            raise IOError('Invalid BGZF block header at offset {} of {}'.format(start, self.filename))
+        return block
+
+    def _block_end(self, i):
+        """ Return (compressed, uncompressed) end offsets of the i-th block. """
+        end = self.coffsets[i] + self._block_header(i)[0]
+        return end, self.uoffsets[i] + struct.unpack('<I', self._map[end - 4:end])[0]
+
+    def _block(self, i):
+        data = self._cache.get(i)
+        if data is not None:
+            self._cache.move_to_end(i)
+            return data
+        start = self.coffsets[i]
+        block_size, xlen = self._block_header(i)
+        data = self._map[start:start + block_size]
+        data = _bgzf_inflate([(data[12 + xlen:-8],) + struct.unpack('<II', data[-8:])])
+        self._cache[i] = data
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return data
+
+    def read(self, offset, size):
+        """
+        Read `size` bytes of the uncompressed data from `offset` (less at the end of the data).
+        :param offset: offset in the uncompressed data
+        :type offset: int
+        :param size: number of bytes
+        :type size: int
+        :rtype: bytes
+        """
+        from bisect import bisect_right
+        end = min(offset + size, self.size)
+        out = []
+        i = bisect_right(self.uoffsets, offset) - 1
+        while offset < end and i < len(self.uoffsets):
+            block = self._block(i)
+            start = offset - self.uoffsets[i]
+            chunk = block[start:start + end - offset]
+            out.append(chunk)
+            offset += len(chunk)
+            i += 1
+        return b''.join(out)
+
+    def close(self):
+        self._cache.clear()
+        self._map.close()
+
+
+# endregion
+
+
+# region: functions
+def register_codec(codec):
+    """
+    Add codec to the registry (or replace the registered codec with the same name).
+    :param codec: codec
+    :type codec: Codec
+    """
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    """ Return registered codec by its name. """
+    return _codecs[name]
+
+
+def list_codecs():
+    """ Return list of registered codecs. """
+    return list(_codecs.values())
+
+
+def detect_codec(filename):
+    """
+    Detect file compression from its first bytes.
+    :param filename: file name
+    :type filename: str
+    :return: codec or None, if the file is not compressed by any of the registered codecs
+    :rtype: Codec
+    """
+    with open(filename, 'rb') as fh:
+        head = fh.read(MAGIC_SIZE)
+    for codec in _codecs.values():
+        if codec.matches(head):
+            return codec
+    return None
+
+
+def is_bgzf(filename):
+    """ Check if the file is BGZF-compressed (blocked gzip, as written by `bgzip`). """
+    with open(filename, 'rb') as fh:
+        return _bgzf_block_size(fh.read(MAGIC_SIZE)) is not None
+
+
+def open_compressed(filename, mode='rt', encoding='utf-8', threads=None):
+    """
+    Open file for reading, decompressing it with the codec detected from its magic bytes.
+
+    :param filename: file name
+    :type filename: str
+    :param mode: 'rt' for text or 'rb' for binary file handle
+    :type mode: str
+    :param encoding: text encoding
+    :type encoding: str
+    :param threads: number of decompression threads (all CPUs by default); used by codecs that support it.
+        Only BGZF is decompressed in parallel; plain gzip is decompressed by an external tool if one is set with
+        `GZIP_TOOL_ENV_VAR` (see `_open_gzip()`), and threads=1 always uses the gzip module.
+    :type threads: int
+    :return: open file handle
+    """
+    if mode not in ('rt', 'rb', 'r'):
+        raise ValueError('open_compressed: unsupported mode: {}'.format(mode))
+    codec = detect_codec(filename)
+    if codec is None:
+        fh = open(filename, 'rb')
+    else:
+        fh = codec.open(filename, threads)
+    if mode == 'rb':
+        return fh
+    return io.TextIOWrapper(fh, encoding=encoding)
+
+
+def open_compressed_stream(fh, mode='rt', encoding='utf-8'):
+    """
+    Wrap readable binary stream (e.g. archive member), decompressing it with the codec detected from its magic bytes.
+
+    :param fh: binary file handle; it is closed with the returned handle
+    :param mode: 'rt' for text or 'rb' for binary file handle
+    :type mode: str
+    :param encoding: text encoding
+    :type encoding: str
+    :return: open file handle
+    """
+    if mode not in ('rt', 'rb', 'r'):
+        raise ValueError('open_compressed_stream: unsupported mode: {}'.format(mode))
+    if not hasattr(fh, 'peek'):
+        fh = io.BufferedReader(fh)
+    head = fh.peek(MAGIC_SIZE)[:MAGIC_SIZE]
+    for codec in _codecs.values():
+        if codec.matches(head):
+            fh = codec.open_stream(fh)
+            break
+    if mode == 'rb':
+        return fh
+    return io.TextIOWrapper(fh, encoding=encoding)
+
+
+def read_gzi(filename):
+    """ Read BGZF block index (.gzi); return lists of compressed and uncompressed offsets of the blocks. """
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+    n, = struct.unpack('<Q', data[:8])
+    offsets = struct.unpack('<{}Q'.format(2 * n), data[8:8 + 16 * n])
+    return [0] + list(offsets[0::2]), [0] + list(offsets[1::2])
+
+
+def write_gzi(filename, coffsets, uoffsets):
+    """ Write BGZF block index (.gzi), as `bgzip -i` does: the first block (at 0, 0) is implicit. """
+    from os import replace, getpid
+    tmp_filename = '{}.{}.tmp'.format(filename, getpid())
+    with open(tmp_filename, 'wb') as fh:
+        fh.write(struct.pack('<Q', len(coffsets) - 1))
+        for coffset, uoffset in zip(coffsets[1:], uoffsets[1:]):
+            fh.write(struct.pack('<QQ', coffset, uoffset))
+    replace(tmp_filename, filename)
+
+
+def _threads(threads):
+    return threads if threads else (cpu_count() or 1)
+
+
+def _open_gzip(filename, threads):
+    """
+    BGZF files are inflated in parallel blocks. Plain gzip files (including multi-member ones) can not be split,
+    so they are inflated serially: by the gzip module, or by `igzip` or `pigz` in a child process if it is enabled
+    with `GZIP_TOOL_ENV_VAR` (they are several times faster than the gzip module, and pigz reads, checks and writes
+    in their own threads). The tool reports a corrupt or truncated file by its exit code, which is checked at the end
+    of the data and when the file handle is closed.
+    """
+    if _threads(threads) > 1:
+        if is_bgzf(filename):
+            return _open_bgzf(filename, _threads(threads))
+        tool = _find_gzip_tool()
+        if tool is not None:
+            return _open_gzip_tool(tool, filename)
+    import gzip
+    return gzip.open(filename, 'rb')
+
+
+def _find_gzip_tool():
+    """
+    Return path of the external gzip decompressor set with `GZIP_TOOL_ENV_VAR`, or None if it is not set
+    (or set to 'none') or not installed; 'auto' selects the first installed tool of `GZIP_TOOLS`.
+    """
+    from os import environ
+    name = environ.get(GZIP_TOOL_ENV_VAR, '')
+    if name not in _gzip_tool:
+        from shutil import which
+        if name.lower() in ('', 'none'):
+            _gzip_tool[name] = None
+        else:
+            _gzip_tool[name] = next(filter(None, map(which, GZIP_TOOLS if name.lower() == 'auto' else [name])), None)
+    return _gzip_tool[name]
+
+
+def _open_gzip_tool(tool, filename):
+    """ Decompress gzip file with the external tool, reading its output through a pipe. """
+    from subprocess import Popen, PIPE
+
+    proc = Popen([tool, '-d', '-c', filename], stdout=PIPE, stderr=PIPE)
+    checked = []
+
+    def check():
+        if not checked:
+            checked.append(proc.wait())
+            if checked[0] != 0:
+                raise IOError('{} failed to decompress {}: {}'.format(
+                    tool, filename, proc.stderr.read().decode('utf-8', 'replace').strip()))
+
+    def chunks():
+        yield from iter(lambda: proc.stdout.read(1 << 20), b'')
+        check()
+
+    def close():
+        if proc.poll() is None:
+            # closed before the end of the data: the tool is stopped, its exit code means nothing
+            proc.kill()
+            checked.append(proc.wait())
+        try:
+            check()
+        finally:
+            proc.stdout.close()
+            proc.stderr.close()
+    return io.BufferedReader(_ChunkReader(chunks(), close_callback=close), buffer_size=1 << 20)
+
+
+def _open_gzip_stream(fh):
+    import gzip
+    return _closing_stream(gzip.GzipFile(fileobj=fh, mode='rb'), fh)
+
+
+def _open_bz2_stream(fh):
+    import bz2
+    return _closing_stream(bz2.BZ2File(fh, 'rb'), fh)
+
+
+def _open_xz_stream(fh):
+    import lzma
+    return _closing_stream(lzma.LZMAFile(fh, 'rb'), fh)
+
+
+def _open_zstd_stream(fh):
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+
+
+def _closing_stream(decompressed, fh):
+    """ Close the compressed stream `fh` together with the stream of its decompressed data. """
+    return io.BufferedReader(_ChunkReader(iter(lambda: decompressed.read(1 << 20), b''),
+                                          close_callback=lambda: (decompressed.close(), fh.close())),
+                             buffer_size=1 << 20)
+
+
+def _open_bz2(filename, threads):
+    import bz2
+    return bz2.open(filename, 'rb')
+
+
+def _open_xz(filename, threads):
+    import lzma
+    return lzma.open(filename, 'rb')
+
+
+def _open_zstd(filename, threads):
+    import zstandard
+    fh = open(filename, 'rb')
+    return zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+
+
+def _bgzf_block_size(header):
+    """
+    Return (total block size, extra field length) of the BGZF block starting with the `header`,
+    or None if it is not a BGZF block header.
+    """
+    if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04':
+        return None
+    xlen, = struct.unpack('<H', header[10:12])
+    # BGZF writes its 'BC' subfield first, so it is always in the fixed-size part of the header
+    if header[12:16] != b'BC\x02\x00':
+        return None
+    bsize, = struct.unpack('<H', header[16:18])
+    return bsize + 1, xlen
+
+
+def _bgzf_read_blocks(fh, blocks_per_task):
+    """
+    Split BGZF file into groups of raw deflate blocks without decompressing them.
+    """
+    group = []
+    while True:
+        header = fh.read(18)
+        if not header:
+            break
+        block = _bgzf_block_size(header)
+        if block is None:
+            raise IOError('Invalid BGZF block header at offset {}'.format(fh.tell() - len(header)))
+        block_size, xlen = block
+        rest = fh.read(block_size - 18)
+        if len(rest) != block_size - 18:
+            raise EOFError('Truncated BGZF block')
+        data = header + rest
+        cdata = data[12 + xlen:-8]
+        crc, isize = struct.unpack('<II', data[-8:])
+        group.append((cdata, crc, isize))
+        if len(group) >= blocks_per_task:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _bgzf_inflate(group):
+    """ Decompress and verify a group of BGZF blocks; zlib releases the GIL, so groups inflate in parallel. """
+    out = []
+    for cdata, crc, isize in group:
+        data = zlib.decompress(cdata, -zlib.MAX_WBITS)
+        if len(data) != isize or zlib.crc32(data) & 0xffffffff != crc:
+            raise IOError('BGZF block failed CRC/size check')
+        out.append(data)
+    return b''.join(out)
+
+
+def _bgzf_deflate(data, level):
+    """ Compress data into BGZF blocks; zlib releases the GIL, so groups deflate in parallel. """
+    out = []
+    for start in range(0, len(data), BGZF_BLOCK_DATA):
+        block = data[start:start + BGZF_BLOCK_DATA]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = compressor.compress(block) + compressor.flush()
+        # header with the 'BC' extra subfield holding the total block size - 1, deflate data, CRC32 and input size
+        out.append(struct.pack('<4sIBBH2sHH', b'\x1f\x8b\x08\x04', 0, 0, 255, 6, b'BC', 2, len(cdata) + 25))
+        out.append(cdata)
+        out.append(struct.pack('<II', zlib.crc32(block) & 0xffffffff, len(block)))
+    return b''.join(out)
+
+
+def _bgzf_chunks(fh, threads):
+    """ Yield decompressed BGZF data in file order, inflating block groups ahead on a thread pool. """
+    from concurrent.futures import ThreadPoolExecutor
+    max_pending = threads * BGZF_TASKS_PER_THREAD
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for group in _bgzf_read_blocks(fh, BGZF_BLOCKS_PER_TASK):
+            pending.append(executor.submit(_bgzf_inflate, group))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _open_bgzf(filename, threads):
+    fh = open(filename, 'rb')
+    raw = _ChunkReader(_bgzf_chunks(fh, threads), close_callback=fh.close)
+    return io.BufferedReader(raw, buffer_size=1 << 20)
+
+
+def _module_available(name):
+    """ Check if optional module is installed, without importing it. """
+    from importlib.util import find_spec
+    return find_spec(name) is not None
+
+
+# endregion
+
+# region: registry
+register_codec(Codec('gzip', b'\x1f\x8b', _open_gzip, extensions=('.gz', '.bgz'), stream_opener=_open_gzip_stream))
+register_codec(Codec('bz2', b'BZh', _open_bz2, extensions=('.bz2',), stream_opener=_open_bz2_stream))
+register_codec(Codec('xz', b'\xfd7zXZ\x00', _open_xz, extensions=('.xz',), stream_opener=_open_xz_stream))
+register_codec(Codec('zstd', b'\x28\xb5\x2f\xfd', _open_zstd, extensions=('.zst',),
+                     available=_module_available('zstandard'), stream_opener=_open_zstd_stream))
+# endregion
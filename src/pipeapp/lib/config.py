@@ -3,11 +3,12 @@ Common classes and functions
 """
 
 # region: imports
-from os import environ, path
-from yaml import load as load_yaml
+from os import environ, path, stat, getpid, replace as replace_file
 import errno
+from zlib import crc32
 
-from .shell import full_path
+from .shell import full_path, make_dir
+# yaml and pickle are imported only when a config file is actually read, to keep the startup time of apps low
 # endregion
 
 # region: constants
@@ -15,6 +16,9 @@ default_config = {
     'DEBUG': False,
     'TESTING': False
 }
+# compiled config cache directory; set this env var to an empty string to disable the cache
+cache_dir_env_var = 'PIPEAPP_CONFIG_CACHE_DIR'
+default_cache_dir = path.join('~', '.cache', 'pipeapp', 'config')
 
 
 # endregion
@@ -24,6 +28,30 @@ class Config(dict):
     def __init__(self, defaults=None):
         dict.__init__(self, defaults or default_config)
 
+    def freeze(self):
+        """
+        Return immutable snapshot of the merged configuration.
+        :rtype: FrozenConfig
+        """
+        return FrozenConfig(self)
+
+    def save_snapshot(self, filename):
+        """
+        Save merged configuration, so that child processes can load it with `from_snapshot()` without
+        parsing config files and env vars again.
+        :param filename: snapshot file name
+        :return: snapshot file name
+        """
+        _dump_pickle(dict(self), filename)
+        return filename
+
+    @classmethod
+    def from_snapshot(cls, filename):
+        """ Load configuration saved with `save_snapshot()`. """
+        import pickle
+        with open(filename, 'rb') as fh:
+            return cls(pickle.load(fh))
+
     def from_envvar(self, var_name, root_key=None, silent=False):
         """
         Loads a configuration from an environment variable pointing to a configuration file.
@@ -45,12 +73,14 @@ class Config(dict):
                                'point to a configuration file'.format(var_name))
         return self.from_yaml(filename=rv, root_key=root_key, silent=silent)
 
-    def from_yaml(self, filename, root_key=None, silent=False):
+    def from_yaml(self, filename, root_key=None, silent=False, cache=True):
         """
         Updates the values in the config from a YAML file.
+        Parsed configs are cached (see `load_yaml_cached()`), unless `cache` is False.
         :param filename: the filename of the config; either absolute or relative
         :param root_key: dict key that should be used as a root to update config
         :param silent: set to `True` if you want silent failure for missing files
+        :param cache: use compiled config cache
         """
         if not filename:
             return False
@@ -58,26 +88,111 @@ class Config(dict):
         try:
             conf_full_path = full_path(filename)
             if path.exists(conf_full_path):
-                with open(conf_full_path) as yaml_fh:
-                    yaml = load_yaml(yaml_fh.read())
+                yaml = load_yaml_cached(conf_full_path, root_key=root_key, cache=cache)
             else:
                 raise IOError('File not found: {}', conf_full_path)
+        except KeyError:
+            print('Root Key {} is not in config file: {}'.format(root_key, filename))
+            return False
         except IOError as e:
             if silent and e.errno in (errno.ENOENT, errno.EISDIR):
                 return False
             e.strerror = 'Unable to load configuration file. ({})'.format(e.strerror)
             raise
-        if root_key is not None:
-            if root_key not in yaml:
-                print('Root Key {} is not in config file: {}'.format(root_key, filename))
-                return False
-            yaml = yaml[root_key]
         self.update(yaml)
         return True
 
+
+class FrozenConfig(dict):
+    """
+    Immutable configuration snapshot; picklable, so it can be passed to child processes as is.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenConfig is immutable')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+    def __hash__(self):
+        return hash(tuple(sorted((k, repr(v)) for k, v in self.items())))
+
+    def thaw(self):
+        """ Return mutable copy. """
+        return Config(self)
+
+
 # endregion
 
+
 # region: functions
+def _dump_pickle(obj, filename):
+    import pickle
+    tmp_filename = '{}.{}.tmp'.format(filename, getpid())
+    with open(tmp_filename, 'wb') as fh:
+        pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    replace_file(tmp_filename, filename)
+
+
+def _load_yaml(filename):
+    """ Parse YAML file with libyaml-based loader, if available (much faster than the pure-Python one). """
+    from yaml import load as load_yaml
+    try:
+        from yaml import CSafeLoader as YamlLoader
+    except ImportError:
+        from yaml import SafeLoader as YamlLoader
+    with open(filename, 'rb') as yaml_fh:
+        return load_yaml(yaml_fh, Loader=YamlLoader)
 
 
+def config_cache_dir():
+    """ Return compiled config cache directory, or None if the cache is disabled. """
+    cache_dir = environ.get(cache_dir_env_var, default_cache_dir)
+    return full_path(cache_dir) if cache_dir else None
+
+
+def load_yaml_cached(filename, root_key=None, cache=True):
+    """
+    Parse YAML file with the fastest available loader, caching the parsed data as a pickle blob
+    keyed by file path, mtime, size and root key; the cached blob is used while the file is unchanged.
+    Only the part of the data under `root_key` is cached and returned; KeyError is raised if there is no such key.
+
+    :param filename: full path of YAML file
+    :type filename: str
+    :param root_key: config root key
+    :type root_key: str
+    :param cache: use the cache
+    :type cache: bool
+    :return: parsed YAML (under the root key)
+    """
+    import pickle
+    cache_dir = config_cache_dir() if cache else None
+    cache_file = None
+    if cache_dir:
+        st = stat(filename)
+        key = '{}\0{}\0{}\0{}'.format(filename, st.st_mtime_ns, st.st_size, root_key)
+        # a short checksum is enough for the file name: the full key is stored in the blob and checked on load
+        cache_file = path.join(cache_dir, '{:08x}.pickle'.format(crc32(key.encode('utf-8'))))
+        try:
+            with open(cache_file, 'rb') as fh:
+                cached_key, yaml = pickle.load(fh)
+            if cached_key == key:
+                return yaml
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+            pass
+    yaml = _load_yaml(filename)
+    if root_key is not None:
+        if not isinstance(yaml, dict) or root_key not in yaml:
+            raise KeyError(root_key)
+        yaml = yaml[root_key]
+    if cache_file:
+        try:
+            make_dir(cache_dir)
+            _dump_pickle((key, yaml), cache_file)
+        except OSError:
+            pass  # cache is an optimization only
+    return yaml
+
 # endregion
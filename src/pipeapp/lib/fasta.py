@@ -0,0 +1,317 @@
+"""
+Indexed FASTA files: samtools-compatible .fai index, random access to memory-mapped or BGZF-compressed sequences
+"""
+
+# region: imports
+from os import path, getpid, replace as replace_file
+from collections import namedtuple, OrderedDict
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+INDEX_CHUNK_SIZE = 1 << 24  # bytes of the (uncompressed) file scanned at once when the index is built
+MAX_TRAILER_SIZE = 1024  # bytes (line breaks) allowed after the last sequence of an up-to-date index
+FaiEntry = namedtuple('FaiEntry', ['name', 'length', 'offset', 'line_bases', 'line_width'])
+FastaRecord = namedtuple('FastaRecord', ['name', 'sequence'])
+# endregion
+
+
+# region: classes
+class _FaiBuilder:
+    """
+    Build .fai entries from the data of a FASTA file fed in blocks of whole lines.
+    Like `samtools faidx`, it requires all the sequence lines of a record, except the last one, to be equally long.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = []
+        self._record = None  # [name, length, offset, line_bases, line_width, ended]: `ended` after a shorter line
+
+    def feed(self, block, base):
+        """
+        :param block: data of whole lines (the last line of the file may have no newline)
+        :type block: bytes
+        :param base: offset of the block in the (uncompressed) file
+        :type base: int
+        """
+        pos = 0  # always at the start of a line
+        while pos < len(block):
+            if block.startswith(b'>', pos):
+                header = pos
+            else:
+                header = block.find(b'\n>', pos)
+                header = -1 if header == -1 else header + 1
+            seq_end = len(block) if header == -1 else header
+            if seq_end > pos:
+                self._add_sequence(block, pos, seq_end)
+            if header == -1:
+                break
+            line_end = block.find(b'\n', header)
+            line_end = len(block) if line_end == -1 else line_end
+            name = block[header + 1:line_end].split(None, 1)
+            self._finish_record()
+            self._record = [name[0].decode('utf-8') if name else '', 0, base + line_end + 1, 0, 0, False]
+            pos = line_end + 1
+
+    def _add_sequence(self, block, start, end):
+        record = self._record
+        if record is None:
+            if block[start:end].strip():
+                raise ValueError('FASTA file {} does not start with a header'.format(self.filename))
+            return
+        if record[5]:
+            if block[start:end].strip():
+                raise ValueError('Different line length in sequence {} of {}'.format(record[0], self.filename))
+            return
+        if not record[4]:
+            first_end = block.find(b'\n', start, end)
+            line = block[start:end if first_end == -1 else first_end + 1]
+            record[3] = len(line.rstrip(b'\r\n'))
+            # the last line of the file may have no newline
+            record[4] = len(line) if first_end != -1 else record[3] + 1
+        line_width = record[4]
+        # all the lines but the last one have the same width: their newlines are exactly `line_width` apart
+        full = (end - start) // line_width * line_width
+        newlines = block[start + line_width - 1:start + full:line_width]
+        if newlines.count(b'\n') != len(newlines):
+            raise ValueError('Different line length in sequence {} of {}'.format(record[0], self.filename))
+        record[1] += full // line_width * record[3]
+        if full < end - start:
+            # shorter (last) line, or the last line of the file without newline
+            record[1] += len(block[start + full:end].rstrip(b'\r\n'))
+            record[5] = True
+
+    def _finish_record(self):
+        if self._record is not None:
+            name, length, offset, line_bases, line_width, _ = self._record
+            self.entries.append(FaiEntry(name, length, offset, line_bases, line_width))
+            self._record = None
+
+    def close(self):
+        self._finish_record()
+        return self.entries
+
+
+class IndexedFasta:
+    """
+    FASTA file with random access to its sequences through a samtools-compatible .fai index.
+
+    The index is read from `<filename>.fai` if it is up to date (not older than the file, and the last sequence
+    it lists ends where the file does), otherwise it is built and saved.
+    Plain files are memory-mapped; BGZF-compressed files (`bgzip`, `samtools faidx`) are read through
+    their block index (`<filename>.gzi`, see `.codec.BgzfRandomReader`). Fetching a sequence or a subsequence
+    reads only its bytes, and iteration builds one string per record (not per line).
+
+    # example:
+    >>> with IndexedFasta('proteins.faa') as fasta:
+    >>>   print(len(fasta), fasta.length('WP_000001.1'), fasta.fetch('WP_000001.1', 0, 10))
+    >>>   for record in fasta:
+    >>>     print(record.name, len(record.sequence))
+    """
+
+    def __init__(self, filename, index_filename=None, save_index=True):
+        """
+        :param filename: FASTA file name (plain or BGZF-compressed)
+        :type filename: str
+        :param index_filename: index file name (`<filename>.fai` by default)
+        :type index_filename: str
+        :param save_index: save the index, if it had to be built
+        :type save_index: bool
+        """
+        from .codec import detect_codec, is_bgzf
+        self.filename = filename
+        self.index_filename = index_filename or filename + '.fai'
+        self._map = None
+        self._bgzf = None
+        codec = detect_codec(filename)
+        if codec is not None:
+            if codec.name != 'gzip' or not is_bgzf(filename):
+                raise ValueError('Compressed FASTA file {} is not BGZF: recompress it with `bgzip`'.format(filename))
+            from .codec import BgzfRandomReader
+            self._bgzf = BgzfRandomReader(filename, save_index=save_index)
+        elif path.getsize(filename):
+            from mmap import mmap, ACCESS_READ
+            with open(filename, 'rb') as fh:
+                self._map = mmap(fh.fileno(), 0, access=ACCESS_READ)
+        self.save_index = save_index
+        self._index = None
+
+    @property
+    def index(self):
+        """ Sequence ID -> `FaiEntry`; the index is loaded (or built) when it is first needed. """
+        if self._index is None:
+            entries = None
+            if path.exists(self.index_filename) and path.getmtime(self.index_filename) >= path.getmtime(self.filename):
+                entries = read_fai(self.index_filename)
+                if not self._index_is_current(entries):
+                    entries = None
+            if entries is None:
+                entries = self._build_index()
+                if self.save_index:
+                    try:
+                        write_fai(self.index_filename, entries)
+                    except OSError:
+                        pass
+            self._index = OrderedDict((entry.name, entry) for entry in entries)
+        return self._index
+
+    def _build_index(self):
+        builder = _FaiBuilder(self.filename)
+        base, rest = 0, b''
+        for chunk in self._chunks():
+            data = rest + chunk
+            end = data.rfind(b'\n') + 1
+            if end:
+                builder.feed(data[:end], base)
+            base += end
+            rest = data[end:]
+        if rest:
+            builder.feed(rest, base)
+        return builder.close()
+
+    def _index_is_current(self, entries):
+        """
+        Check that the index covers the whole file: the .fai index does not record the file size, but its last entry
+        implies it, as only line breaks may follow the last sequence.
+        """
+        size = self._bgzf.size if self._bgzf is not None else len(self._map) if self._map is not None else 0
+        end = 0
+        if entries:
+            last = entries[-1]
+            end = self._position(last, last.length - 1) + 1 if last.length else last.offset
+        if end > size or size - end > MAX_TRAILER_SIZE:
+            return False
+        return end == size or not self._read(end, size - end).strip(b'\r\n')
+
+    def _chunks(self):
+        if self._bgzf is not None:
+            from .codec import open_compressed
+            with open_compressed(self.filename, mode='rb') as fh:
+                yield from iter(lambda: fh.read(INDEX_CHUNK_SIZE), b'')
+        elif self._map is not None:
+            for start in range(0, len(self._map), INDEX_CHUNK_SIZE):
+                yield self._map[start:start + INDEX_CHUNK_SIZE]
+
+    def _read(self, offset, size):
+        if self._bgzf is not None:
+            return self._bgzf.read(offset, size)
+        return self._map[offset:offset + size]
+
+    @staticmethod
+    def _position(entry, i):
+        """ Offset of the i-th residue of the sequence in the file. """
+        return entry.offset + i // entry.line_bases * entry.line_width + i % entry.line_bases
+
+    def fetch(self, name, start=None, end=None):
+        """
+        Return sequence or subsequence.
+        :param name: sequence ID
+        :type name: str
+        :param start: 0-based start of the subsequence
+        :type start: int
+        :param end: 0-based end of the subsequence (exclusive)
+        :type end: int
+        :rtype: str
+        """
+        entry = self.index[name]
+        start = 0 if start is None else max(0, start)
+        end = entry.length if end is None else min(end, entry.length)
+        if start >= end:
+            return ''
+        first = self._position(entry, start)
+        data = self._read(first, self._position(entry, end - 1) + 1 - first)
+        return data.translate(None, b'\r\n').decode('ascii')
+
+    def length(self, name):
+        """ Return length of the sequence. """
+        return self.index[name].length
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, name):
+        return self.fetch(name)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        """ Iterate over records (name, sequence) in the file order. """
+        if self._map is not None and self._index is None and self._map[:1] == b'>':
+            # plain file: records are found in the memory map directly, the index is not needed
+            yield from self._scan_records()
+            return
+        # same as `fetch()` of every record, without the per-call overhead
+        read, make_record = self._read, FastaRecord._make
+        for name, length, offset, line_bases, line_width in self.index.values():
+            if not length:
+                yield make_record((name, ''))
+                continue
+            last = length - 1
+            size = last // line_bases * line_width + last % line_bases + 1
+            yield make_record((name, read(offset, size).translate(None, b'\r\n').decode('ascii')))
+
+    def _scan_records(self):
+        m, make_record = self._map, FastaRecord._make
+        pos, size = 0, len(m)
+        while pos < size:
+            header_end = m.find(b'\n', pos)
+            header_end = size if header_end == -1 else header_end
+            next_header = m.find(b'\n>', header_end)
+            next_header = size if next_header == -1 else next_header + 1
+            name = m[pos + 1:header_end].split(None, 1)
+            yield make_record((name[0].decode('utf-8') if name else '',
+                               m[header_end + 1:next_header].translate(None, b'\r\n').decode('ascii')))
+            pos = next_header
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._bgzf is not None:
+            self._bgzf.close()
+            self._bgzf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# endregion
+
+
+# region: functions
+def read_fai(filename):
+    """ Read .fai index; return list of entries. """
+    entries = []
+    make_entry = FaiEntry._make
+    with open(filename) as fh:
+        for line in fh:
+            name, length, offset, line_bases, line_width = line.split('\t', 5)[:5]
+            entries.append(make_entry((name, int(length), int(offset), int(line_bases), int(line_width))))
+    return entries
+
+
+def write_fai(filename, entries):
+    """ Write .fai index (tab-delimited: name, length, offset, line bases, line width), as `samtools faidx` does. """
+    tmp_filename = '{}.{}.tmp'.format(filename, getpid())
+    with open(tmp_filename, 'w') as fh:
+        for entry in entries:
+            fh.write('{}\t{}\t{}\t{}\t{}\n'.format(*entry))
+    replace_file(tmp_filename, filename)
+
+
+def fasta_reader(filename, index_filename=None, save_index=True):
+    """
+    Open indexed FASTA file; see `IndexedFasta` for parameters.
+    :rtype: IndexedFasta
+    """
+    return IndexedFasta(filename, index_filename=index_filename, save_index=save_index)
+
+# endregion
@@ -7,7 +7,9 @@ Manifest File manipulations
 # region imports
 from datetime import datetime
 from os import path
-from .shell import full_path
+from time import monotonic
+from collections import namedtuple
+from .shell import PathNormalizer, FileHashCache, hash_files
 # endregion
 
 # region: constants
@@ -15,47 +17,266 @@ __author__ = 'David Managadze'
 # endregion
 
 # region: variables
-
+ManifestEntry = namedtuple('ManifestEntry', ['path', 'size', 'mtime', 'hash'])
+ManifestDiff = namedtuple('ManifestDiff', ['added', 'removed', 'changed'])
 # endregion
 
 
 class ManifestFile:
-    def __init__(self, filename, entries=None, generator='pipeapp', action=None):
+    """
+    Manifest file: list of file paths, one per line, with a commented header.
+
+    Actions:
+        'read':     read all entries into `entries`
+        'write':    write `entries` to the file
+        'iter':     do not read the file now; iterate over the manifest to stream entries lazily
+        'append':   open the file for appending entries with `append()`/`extend()` while the app runs;
+                    the header is written if the file is new; call `close()` (or use `with`) when done
+
+    With `metadata=True`, each line also stores size, mtime (ns) and a fast content hash of the file, tab-delimited;
+    hashes are computed in parallel and cached by device, inode, size and mtime in `hash_cache`. If `hash_cache` is
+    a file name, the cache is persisted there (e.g. in the app's cache directory), so the next run does not hash
+    the unchanged files again; by default, it is kept in memory only.
+    Metadata of the entries read from a file is available in `metadata`; `diff()` uses it to find the changed files.
+    """
+    actions = ('read', 'write', 'iter', 'append')
+    write_buffer_size = 1 << 20
+    metadata_fields = ('path', 'size', 'mtime', 'hash')
+
+    def __init__(self, filename, entries=None, generator='pipeapp', action=None, metadata=False, hash_cache=None,
+                 threads=None):
+        """
+        :param filename: manifest file name
+        :param entries: entries to write
+        :param generator: name of the program that writes the manifest, stored in the header
+        :param action: one of `actions`
+        :param metadata: write size, mtime and hash of the files
+        :param hash_cache: file hash cache (`.shell.FileHashCache`), or name of the file to load it from and save
+                           it to (one per manifest: `write()` drops the hashes of the files that are not in it);
+                           by default, an in-memory cache is used
+        :param threads: number of hashing threads
+        """
         self.filename = path.expanduser(filename)
         self.generator = generator
         self._entries = entries or list()
+        self._loaded = entries is not None
         self._fh = None
+        self._normalizer = PathNormalizer()
+        self._index = None
+        self.with_metadata = metadata
+        self.metadata = {}
+        self.hash_cache = FileHashCache(hash_cache) if isinstance(hash_cache, str) else hash_cache
+        self.threads = threads
+        self.write_stats = None
+        if action not in self.actions:
+            raise Exception('ManifestFile: no such action: {}'.format(action))
         if action == 'read':
             self.read()
         elif action == 'write':
             self.write()
-        else:
-            raise Exception('ManifestFile: no such action: {}'.format(action))
+        elif action == 'append':
+            self.open_append()
 
-    def read(self):
-        if self._fh is not None and self._fh.mode == 'w':
-            raise Exception('file is already opened in write mode')
-        with open(self.filename) as self._fh:
-            for line in self._fh:
+    def iter_entries(self, metadata=False):
+        """
+        Stream entries from the file, without keeping them in memory.
+        :param metadata: yield `ManifestEntry` tuples instead of paths (size, mtime and hash are None if not stored)
+        """
+        with open(self.filename) as fh:
+            for line in fh:
                 line = line.strip()
                 if line.startswith('#') or line == '':
                     continue
-                self._entries.append(line)
-
-    def write(self):
-        if self._fh is not None and self._fh.mode == 'r':
-            raise Exception('file is already opened in read mode')
-        with open(self.filename, 'w') as self._fh:
-            ctime = datetime.now().strftime('%Y-%m-%d %H:%M')
-            self._fh.write('# content: manifest file\n')
-            self._fh.write('# generator: {}\n'.format(self.generator))
-            self._fh.write('# date: {}\n'.format(ctime))
-            self._fh.write('#\n')
-            for e in self._entries:
-                self._fh.write('{}\n'.format(full_path(e)))
+                if '\t' in line:
+                    fields = line.split('\t')
+                    if not metadata:
+                        yield fields[0]
+                        continue
+                    yield ManifestEntry(fields[0], int(fields[1]), int(fields[2]), fields[3] or None)
+                elif metadata:
+                    yield ManifestEntry(line, None, None, None)
+                else:
+                    yield line
+
+    def __iter__(self):
+        if self._loaded:
+            return iter(self._entries)
+        return self.iter_entries()
+
+    def read(self):
+        if self._fh is not None:
+            raise Exception('file is already opened in append mode')
+        self._entries = []
+        self.metadata = {}
+        for e in self.iter_entries(metadata=True):
+            self._entries.append(e.path)
+            if e.size is not None:
+                self.metadata[e.path] = e
+        self._loaded = True
+        self._index = None
+
+    def _write_header(self, fh):
+        ctime = datetime.now().strftime('%Y-%m-%d %H:%M')
+        fh.write('# content: manifest file\n')
+        fh.write('# generator: {}\n'.format(self.generator))
+        fh.write('# date: {}\n'.format(ctime))
+        if self.with_metadata:
+            fh.write('# fields: {}\n'.format('\t'.join(self.metadata_fields)))
+        fh.write('#\n')
+
+    def _write_entries(self, fh, entries):
+        """ Write normalized entries; return number of entries written. """
+        n = 0
+        normalize = self._normalizer
+        batch = []
+        for e in entries:
+            batch.append(normalize(e))
+            if len(batch) >= 10000:
+                n += self._write_batch(fh, batch)
+                batch = []
+        if batch:
+            n += self._write_batch(fh, batch)
+        return n
+
+    def _write_batch(self, fh, batch):
+        if self.with_metadata:
+            self._add_metadata(batch)
+            batch = ['{}\t{}\t{}\t{}'.format(*self.metadata[e]) for e in batch]
+        fh.write('\n'.join(batch) + '\n')
+        return len(batch)
+
+    def _add_metadata(self, paths):
+        if self.hash_cache is None:
+            self.hash_cache = FileHashCache()
+        for p, (size, mtime, digest) in hash_files(paths, threads=self.threads, cache=self.hash_cache).items():
+            self.metadata[p] = ManifestEntry(p, size, mtime, digest)
+
+    def _save_hash_cache(self, used_only=False):
+        if self.hash_cache is None:
+            return
+        try:
+            self.hash_cache.save(used_only=used_only)
+        except OSError:
+            # read-only location: the hashes are computed again next time
+            pass
+
+    def compute_metadata(self):
+        """ Compute size, mtime and hash of all the entries (keyed by their normalized paths) into `metadata`. """
+        self._add_metadata(self._normalizer.normalize_many(self.entries))
+        self._save_hash_cache()
+        return self.metadata
+
+    def write(self, entries=None):
+        """
+        Write the manifest file.
+        :param entries: iterable of entries to write instead of `entries` (e.g. a generator)
+        :return: number of entries written
+        """
+        if self._fh is not None:
+            raise Exception('file is already opened in append mode')
+        start = monotonic()
+        with open(self.filename, 'w', buffering=self.write_buffer_size) as fh:
+            self._write_header(fh)
+            n = self._write_entries(fh, self._entries if entries is None else entries)
+        # the manifest was rewritten: hashes of the files that are not in it any more are dropped
+        self._save_hash_cache(used_only=True)
+        self._set_write_stats(n, monotonic() - start)
+        return n
+
+    def _set_write_stats(self, n, seconds):
+        self.write_stats = {
+            'entries': n,
+            'seconds': seconds,
+            'entries_per_sec': n / seconds if seconds > 0 else float('inf'),
+        }
+
+    def open_append(self):
+        """ Open the file for appending entries; write the header if the file is new. """
+        if self._fh is not None:
+            return
+        is_new = not path.exists(self.filename) or path.getsize(self.filename) == 0
+        self._fh = open(self.filename, 'a', buffering=self.write_buffer_size)
+        self._n_appended = 0
+        self._append_time = 0.0
+        if is_new:
+            self._write_header(self._fh)
+
+    def append(self, entry):
+        """ Append one entry to the file opened with `open_append()`. """
+        self.extend((entry,))
+
+    def extend(self, entries):
+        """ Append entries to the file opened with `open_append()`. """
+        if self._fh is None:
+            raise Exception('file is not opened in append mode')
+        start = monotonic()
+        self._n_appended += self._write_entries(self._fh, entries)
+        self._append_time += monotonic() - start
+        self._set_write_stats(self._n_appended, self._append_time)
+
+    def flush(self):
+        if self._fh is not None:
+            self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            self._save_hash_cache()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, entry):
+        """ O(1) membership check; `entry` is matched as is or normalized. """
+        if self._index is None:
+            self._index = set(self.entries)
+            self._index.update(self._normalizer.normalize_many(self.entries))
+        return entry in self._index or self._normalizer(entry) in self._index
+
+    def _entries_metadata(self):
+        """ Return dict normalized path -> ManifestEntry (with None fields, if metadata is unknown). """
+        result = {}
+        for e in self.entries:
+            p = e if e in self.metadata else self._normalizer(e)
+            result[p] = self.metadata.get(p) or ManifestEntry(p, None, None, None)
+        return result
+
+    def diff(self, other):
+        """
+        Compare this manifest to `other` (e.g. manifest of the previous run).
+
+        An entry has changed if its hash differs; if any of the manifests has no hash for the entry,
+        its size and mtime are compared; if either has no metadata at all, the entry is considered unchanged.
+
+        :param other: other manifest
+        :type other: ManifestFile
+        :return: lists of entries added in this manifest, removed from it, and changed
+        :rtype: ManifestDiff
+        """
+        new = self._entries_metadata()
+        old = other._entries_metadata()
+        added = [p for p in new if p not in old]
+        removed = [p for p in old if p not in new]
+        changed = []
+        for p, e in new.items():
+            o = old.get(p)
+            if o is None:
+                continue
+            if e.hash is not None and o.hash is not None:
+                if e.hash != o.hash:
+                    changed.append(p)
+            elif e.size is not None and o.size is not None and (e.size, e.mtime) != (o.size, o.mtime):
+                changed.append(p)
+        return ManifestDiff(added, removed, changed)
 
     @property
     def entries(self):
+        if not self._loaded:
+            self.read()
         return self._entries
 
     @entries.setter
@@ -63,3 +284,5 @@ class ManifestFile:
         if not isinstance(e, list):
             raise Exception('entries should be a list')
         self._entries = e
+        self._loaded = True
+        self._index = None
@@ -0,0 +1,188 @@
+"""
+Resource usage of app phases: wall and CPU time, peak memory, disk I/O; optional profiling
+"""
+
+# region: imports
+import resource
+from os import path
+from time import monotonic, time
+from contextlib import contextmanager
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+PROC_IO_FILE = '/proc/self/io'
+PROC_IO_FIELDS = ('rchar', 'wchar', 'read_bytes', 'write_bytes')  # see proc(5)
+PROFILE_TOP = 40  # number of functions / allocation sites in the text reports
+# endregion
+
+
+# region: classes
+class PhaseMetrics:
+    """
+    Resource usage of the phases of an app (e.g. init, run, exit).
+
+    For each phase it records wall time, CPU time of the process and of its finished child processes,
+    peak RSS so far, and bytes read and written (from /proc/self/io, where available).
+    A phase can also be profiled with cProfile and/or tracemalloc; the reports are saved as
+    `<dump_prefix>.prof` (pstats) and `<dump_prefix>.prof.txt`, and `<dump_prefix>.tracemalloc.txt`.
+
+    # example:
+    >>> metrics = PhaseMetrics()
+    >>> with metrics.phase('run', profile=True, dump_prefix='log/app.run'):
+    >>>   app.run()
+    >>> metrics.save('log/app.metrics.json', app='app')
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, profile=False, trace_memory=False, dump_prefix=None):
+        """
+        Measure the phase run in the context.
+
+        :param name: phase name
+        :type name: str
+        :param profile: profile the phase with cProfile
+        :type profile: bool
+        :param trace_memory: trace memory allocations of the phase with tracemalloc
+        :type trace_memory: bool
+        :param dump_prefix: path prefix of the profiler reports (they are not saved if None)
+        :type dump_prefix: str
+        """
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        start = resource_usage()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            end = resource_usage()
+            record = usage_delta(start, end)
+            record['phase'] = name
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                record['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                if dump_prefix:
+                    _save_tracemalloc_report(snapshot, record['traced_peak_bytes'], dump_prefix + '.tracemalloc.txt')
+            if profiler is not None and dump_prefix:
+                _save_profile(profiler, dump_prefix + '.prof')
+            self.phases.append(record)
+
+    def total(self):
+        """ Return usage summed over all the phases (peak values are the max). """
+        total = {'phase': 'total', 'wall_s': 0, 'cpu_s': 0, 'children_cpu_s': 0, 'max_rss_kb': 0,
+                 'children_max_rss_kb': 0}
+        for record in self.phases:
+            for key, value in record.items():
+                if key == 'phase' or value is None:
+                    continue
+                if key.endswith('max_rss_kb') or key == 'traced_peak_bytes':
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = round(total.get(key, 0) + value, 6)
+        return total
+
+    def save(self, filename, **info):
+        """
+        Append metrics of this run to the file, as one JSON object per line.
+
+        :param filename: metrics file name
+        :type filename: str
+        :param info: other fields of the JSON object (e.g. app name, status)
+        """
+        import json
+        entry = dict(info)
+        entry['time'] = time()
+        entry['phases'] = self.phases
+        entry['total'] = self.total()
+        with open(filename, 'a') as fh:
+            fh.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+# endregion
+
+
+# region: functions
+def read_proc_io():
+    """ Return I/O counters of the process from /proc/self/io, or None if it is not available. """
+    try:
+        with open(PROC_IO_FILE) as fh:
+            counters = dict(line.split(': ') for line in fh.read().splitlines())
+    except (OSError, ValueError):
+        return None
+    return {k: int(counters[k]) for k in PROC_IO_FIELDS if k in counters}
+
+
+def resource_usage():
+    """ Return current resource usage of the process. """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'wall': monotonic(),
+        'cpu': own.ru_utime + own.ru_stime,
+        'children_cpu': children.ru_utime + children.ru_stime,
+        'max_rss_kb': own.ru_maxrss,
+        'children_max_rss_kb': children.ru_maxrss,
+        'io': read_proc_io(),
+    }
+
+
+def usage_delta(start, end):
+    """ Return resource usage between two `resource_usage()` calls. """
+    record = {
+        'wall_s': round(end['wall'] - start['wall'], 6),
+        'cpu_s': round(end['cpu'] - start['cpu'], 6),
+        'children_cpu_s': round(end['children_cpu'] - start['children_cpu'], 6),
+        'max_rss_kb': end['max_rss_kb'],
+        'children_max_rss_kb': end['children_max_rss_kb'],
+    }
+    for key in PROC_IO_FIELDS:
+        if start['io'] is not None and end['io'] is not None and key in end['io']:
+            record[key] = end['io'][key] - start['io'][key]
+        else:
+            record[key] = None
+    return record
+
+
+def format_usage(record):
+    """ Format usage record for the log. """
+    text = '{}: {:.2f}s wall, {:.2f}s CPU ({:.2f}s in child processes), {:.0f} MB max RSS'.format(
+        record['phase'], record['wall_s'], record['cpu_s'], record['children_cpu_s'], record['max_rss_kb'] / 1024)
+    if record.get('read_bytes') is not None:
+        text += ', {:.1f} MB read, {:.1f} MB written'.format(record['read_bytes'] / 2 ** 20,
+                                                             record['write_bytes'] / 2 ** 20)
+    return text
+
+
+def _save_profile(profiler, filename):
+    import pstats
+    profiler.dump_stats(filename)
+    with open(filename + '.txt', 'w') as fh:
+        pstats.Stats(profiler, stream=fh).sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+
+def _save_tracemalloc_report(snapshot, peak, filename):
+    with open(filename, 'w') as fh:
+        fh.write('# peak traced memory: {} bytes\n'.format(peak))
+        fh.write('# top {} allocation sites of the memory still allocated at the end of the phase\n'.format(
+            PROFILE_TOP))
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+            fh.write('{}\n'.format(stat))
+
+
+def metrics_file_name(dirname, app_name):
+    """ Return name of the metrics file of the app. """
+    return path.join(dirname, '{}.metrics.json'.format(app_name))
+
+# endregion
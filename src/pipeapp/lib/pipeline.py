@@ -0,0 +1,442 @@
+"""
+Pipeline runner: runs PipelineApp steps in dependency order, independent steps in parallel
+"""
+
+# region: imports
+import os
+import logging
+from os import path, getcwd, replace as replace_file
+from collections import OrderedDict
+
+from .shell import full_path, remove_dir
+from .worker import load_app, default_apps
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+STATUS_DONE = 'done'
+STATUS_UP_TO_DATE = 'up-to-date'
+STATUS_FAILED = 'failed'
+STATUS_NOT_RUN = 'not run'  # a dependency failed
+# endregion
+
+# region: variables
+_log = logging.getLogger(__name__)
+# endregion
+
+
+# region: classes
+class PipelineStep:
+    """
+    Step of a pipeline: run of a PipelineApp subclass, with declared input and output paths.
+
+    As in the Snakefile rules (see etc/pipeline.snake), by default the app runs in `<first output>.tmp`
+    as its workdir, which is renamed to the first output when the app succeeds; so the output either
+    does not exist or is complete. Give `workdir` to let the app write its outputs by itself instead.
+    """
+
+    def __init__(self, name, app, inputs=(), outputs=(), kwargs=None, workdir=None, cpus=1, mem_mb=0, after=(),
+                 command=None):
+        """
+        :param name: step name, unique in the pipeline; also the app name (for its log file and env vars)
+        :type name: str
+        :param app: PipelineApp subclass or 'module:Class'
+        :param inputs: input files/directories; the step depends on the steps that output them
+        :type inputs: list
+        :param outputs: output files/directories
+        :type outputs: list
+        :param kwargs: arguments of `app.main()`, besides `name` and `workdir` (must be picklable)
+        :type kwargs: dict
+        :param workdir: workdir of the app (by default, `<first output>.tmp`, renamed to the first output)
+        :type workdir: str
+        :param cpus: number of CPUs the step uses; the app gets it as config value THREADS (see `shell.conf_threads`)
+        :type cpus: int
+        :param mem_mb: memory the step uses, in MB
+        :type mem_mb: int
+        :param after: names of the steps this step must run after, besides the ones inferred from inputs
+        :type after: list
+        :param command: console command of the app, for `Pipeline.to_snakefile()` (found in the worker's apps
+                        or `python -m <app module>` by default)
+        :type command: str
+        """
+        if not outputs and workdir is None:
+            raise ValueError('Step {} must have outputs or a workdir'.format(name))
+        self.name = name
+        self.app = app
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kwargs = dict(kwargs or {})
+        self.workdir = workdir
+        self.cpus = cpus
+        self.mem_mb = mem_mb
+        self.after = list(after)
+        self.command = command
+
+    @property
+    def app_spec(self):
+        """ 'module:Class' of the app. """
+        if isinstance(self.app, str):
+            return self.app
+        return '{}:{}'.format(self.app.__module__, self.app.__qualname__)
+
+    def __repr__(self):
+        return 'PipelineStep({!r})'.format(self.name)
+
+
+class Pipeline:
+    """
+    DAG of pipeline steps, run in this process: steps whose dependencies are done are run on a process pool,
+    as long as their CPUs and memory fit into the free slots. Steps that are up to date are skipped:
+        'mtime':        all outputs exist and are newer than all inputs (as Snakemake does)
+        'fingerprint':  inputs (path, size, mtime), app and its arguments are the same as in the last successful
+                        run, and the outputs were not changed since then; recorded in `state_file`
+    A step is also run if any of the steps it depends on is run.
+
+    # example:
+    >>> pipeline = Pipeline([
+    >>>     PipelineStep('step_1', ExampleApp, inputs=['/inputs'], outputs=['step_1'], kwargs={'input': '/inputs'}),
+    >>>     PipelineStep('step_2', ExampleApp, inputs=['step_1'], outputs=['step_2'], cpus=4),
+    >>> ], base_dir='/outputs', cpus=16)
+    >>> status = pipeline.run()
+    """
+    checks = ('mtime', 'fingerprint')
+    state_file_name = '.pipeline_state.json'
+
+    def __init__(self, steps, base_dir=None, cpus=None, mem_mb=None, check='mtime', state_file=None):
+        """
+        :param steps: pipeline steps
+        :type steps: list
+        :param base_dir: directory of the relative input/output paths (current directory by default)
+        :type base_dir: str
+        :param cpus: number of CPU slots (all CPUs by default)
+        :type cpus: int
+        :param mem_mb: memory slots, in MB (physical memory by default)
+        :type mem_mb: int
+        :param check: how up-to-date steps are found: 'mtime' or 'fingerprint'
+        :type check: str
+        :param state_file: file with fingerprints of the finished steps (`.pipeline_state.json` in base_dir)
+        :type state_file: str
+        """
+        if check not in self.checks:
+            raise ValueError('Pipeline: no such check: {}'.format(check))
+        self.base_dir = full_path(base_dir or getcwd())
+        self.cpus = cpus or os.cpu_count() or 1
+        self.mem_mb = mem_mb or _physical_memory_mb()
+        self.check = check
+        self.state_file = state_file or path.join(self.base_dir, self.state_file_name)
+        self.steps = OrderedDict()
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError('Duplicate step name: {}'.format(step.name))
+            self.steps[step.name] = step
+        self.dependencies = self._find_dependencies()
+        self.order = self._topological_order()
+        self.status = {}
+
+    def _path(self, p):
+        return p if path.isabs(p) else path.join(self.base_dir, p)
+
+    def _find_dependencies(self):
+        """ Return step name -> set of names of the steps it depends on. """
+        producers = {}
+        for step in self.steps.values():
+            for output in step.outputs:
+                output = self._path(output)
+                if output in producers:
+                    raise ValueError('Output {} of step {} is also output of step {}'.format(
+                        output, step.name, producers[output]))
+                producers[output] = step.name
+        dependencies = {}
+        for step in self.steps.values():
+            deps = {producers[self._path(i)] for i in step.inputs if self._path(i) in producers}
+            for name in step.after:
+                if name not in self.steps:
+                    raise ValueError('Step {} runs after unknown step {}'.format(step.name, name))
+                deps.add(name)
+            dependencies[step.name] = deps
+        return dependencies
+
+    def _topological_order(self):
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError('Dependency cycle through step: {}'.format(name))
+            visiting.add(name)
+            for dep in sorted(self.dependencies[name]):
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def _required(self, targets):
+        """ Return names of the target steps and all the steps they depend on. """
+        required, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.steps:
+                raise KeyError('No such step: {}'.format(name))
+            if name not in required:
+                required.add(name)
+                stack.extend(self.dependencies[name])
+        return required
+
+    def _read_state(self):
+        import json
+        try:
+            with open(self.state_file) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        import json
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            json.dump(state, fh, indent=1, sort_keys=True)
+        replace_file(tmp_file, self.state_file)
+
+    def fingerprint(self, step):
+        """ Return fingerprint of the step: its app, arguments and the state of its inputs. """
+        import json
+        import hashlib
+        from .app import _file_state
+        state = {
+            'app': step.app_spec,
+            'kwargs': step.kwargs,
+            'workdir': step.workdir,
+            'inputs': [_file_state(self._path(f)) for f in step.inputs],
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, step, state=None):
+        """ Check if outputs of the step are up to date (not looking at the steps it depends on). """
+        outputs = [self._path(f) for f in step.outputs]
+        if not outputs or not all(path.exists(f) for f in outputs):
+            return False
+        if self.check == 'fingerprint':
+            from .app import _file_state
+            recorded = (state if state is not None else self._read_state()).get(step.name)
+            return recorded is not None and recorded['fingerprint'] == self.fingerprint(step) and \
+                recorded['outputs'] == [_file_state(f) for f in outputs]
+        inputs = [self._path(f) for f in step.inputs]
+        if not all(path.exists(f) for f in inputs):
+            return False
+        if not inputs:
+            return True
+        return max(os.stat(f).st_mtime_ns for f in inputs) <= min(os.stat(f).st_mtime_ns for f in outputs)
+
+    def plan(self, targets=None, force=False):
+        """
+        Return names of the steps that must run, in dependency order.
+        :param targets: names of the steps to bring up to date (all steps by default)
+        :param force: run the steps even if they are up to date
+        """
+        required = self._required(targets or list(self.steps))
+        state = self._read_state() if self.check == 'fingerprint' else None
+        to_run = set()
+        for name in self.order:
+            if name not in required:
+                continue
+            if force or self.dependencies[name] & to_run or not self.is_up_to_date(self.steps[name], state):
+                to_run.add(name)
+        return [name for name in self.order if name in to_run]
+
+    def run(self, targets=None, force=False, keep_going=False, dry_run=False):
+        """
+        Run the steps that are not up to date.
+
+        :param targets: names of the steps to bring up to date (all steps by default)
+        :type targets: list
+        :param force: run the steps even if they are up to date
+        :type force: bool
+        :param keep_going: after a step fails, go on with the steps that do not depend on it
+        :type keep_going: bool
+        :param dry_run: only log which steps would run
+        :type dry_run: bool
+        :return: step name -> status ('done', 'up-to-date', 'failed' or 'not run')
+        :rtype: dict
+        """
+        to_run = self.plan(targets, force)
+        self.status = {name: STATUS_UP_TO_DATE for name in self._required(targets or list(self.steps))
+                       if name not in to_run}
+        _log.info('Steps to run: {}'.format(', '.join(to_run) or '-'))
+        if dry_run or not to_run:
+            return self.status
+
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        state = self._read_state() if self.check == 'fingerprint' else {}
+        waiting = list(to_run)
+        running = {}  # future -> step
+        free_cpus, free_mem = self.cpus, self.mem_mb
+        stop = False
+        with ProcessPoolExecutor(max_workers=self.cpus) as executor:
+            while waiting or running:
+                for name in list(waiting):
+                    step = self.steps[name]
+                    deps_status = [self.status.get(dep) for dep in self.dependencies[name]]
+                    if any(s in (STATUS_FAILED, STATUS_NOT_RUN) for s in deps_status):
+                        self.status[name] = STATUS_NOT_RUN
+                        waiting.remove(name)
+                        continue
+                    if stop or not all(s in (STATUS_DONE, STATUS_UP_TO_DATE) for s in deps_status):
+                        continue
+                    cpus, mem_mb = self._slots(step)
+                    if cpus > free_cpus or mem_mb > free_mem:
+                        continue
+                    free_cpus -= cpus
+                    free_mem -= mem_mb
+                    waiting.remove(name)
+                    _log.info('Starting step: {}'.format(name))
+                    running[executor.submit(_run_step, step.app, self._step_kwargs(step), cpus)] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    cpus, mem_mb = self._slots(step)
+                    free_cpus += cpus
+                    free_mem += mem_mb
+                    if self._finish_step(step, future, state):
+                        continue
+                    stop = stop or not keep_going
+        for name in waiting:
+            self.status.setdefault(name, STATUS_NOT_RUN)
+        return self.status
+
+    def _slots(self, step):
+        # a step bigger than the whole pipeline still runs, alone
+        return min(step.cpus, self.cpus), min(step.mem_mb, self.mem_mb)
+
+    def _step_kwargs(self, step):
+        kwargs = dict(step.kwargs)
+        kwargs['name'] = step.name
+        kwargs['workdir'] = self._path(step.workdir) if step.workdir else self._path(step.outputs[0]) + '.tmp'
+        return kwargs
+
+    def _finish_step(self, step, future, state):
+        """ Record result of the finished step; return True if it succeeded. """
+        try:
+            returncode = future.result()
+        except Exception as e:
+            _log.error('Step {} failed: {}'.format(step.name, e))
+            returncode = None
+        if returncode != 0:
+            if returncode is not None:
+                _log.error('Step {} failed with return code {}'.format(step.name, returncode))
+            self.status[step.name] = STATUS_FAILED
+            return False
+        if not step.workdir:
+            # the workdir is complete: put it in place of the first output
+            output = self._path(step.outputs[0])
+            if path.exists(output):
+                remove_dir(output)
+            replace_file(self._step_kwargs(step)['workdir'], output)
+        missing = [f for f in step.outputs if not path.exists(self._path(f))]
+        if missing:
+            _log.error('Step {} did not create its outputs: {}'.format(step.name, ', '.join(missing)))
+            self.status[step.name] = STATUS_FAILED
+            return False
+        if self.check == 'fingerprint':
+            from .app import _file_state
+            state[step.name] = {
+                'fingerprint': self.fingerprint(step),
+                'outputs': [_file_state(self._path(f)) for f in step.outputs],
+            }
+            self._write_state(state)
+        _log.info('Step done: {}'.format(step.name))
+        self.status[step.name] = STATUS_DONE
+        return True
+
+    def to_snakefile(self, filename=None, runner='pipeapp_run'):
+        """
+        Export the pipeline as an equivalent Snakefile: one rule per step, and rule `all` with the final outputs.
+        Arguments of the apps are passed as command line options (`--key value`; `--key` for True).
+
+        :param filename: file to write the Snakefile to
+        :type filename: str
+        :param runner: command that runs the apps known to the worker (see `.worker.run_from_console()`)
+        :type runner: str
+        :return: Snakefile text
+        :rtype: str
+        """
+        consumed = {self._path(i) for step in self.steps.values() for i in step.inputs}
+        final = [self._path(o) for name in self.order for o in self.steps[name].outputs
+                 if self._path(o) not in consumed]
+        lines = [
+            '######################################################',
+            '# Pipeline exported by pipeapp.lib.pipeline',
+            '######################################################',
+            'workdir: {!r}'.format(self.base_dir),
+            '',
+            '# region: rules',
+            '',
+            'rule all:',
+            '    input:',
+        ]
+        lines += ['        {!r},'.format(f) for f in final]
+        for name in self.order:
+            step = self.steps[name]
+            lines += ['', '', 'rule {}:'.format(name)]
+            if step.inputs:
+                lines += ['    input:'] + ['        {!r},'.format(self._path(f)) for f in step.inputs]
+            outputs = ['{!r}'.format(self._path(f)) for f in step.outputs]
+            if not step.workdir and outputs:
+                outputs[0] = 'directory({})'.format(outputs[0])
+            if outputs:
+                lines += ['    output:'] + ['        {},'.format(f) for f in outputs]
+            lines += ['    threads: {}'.format(step.cpus)]
+            if step.mem_mb:
+                lines += ['    resources:', '        mem_mb={}'.format(step.mem_mb)]
+            lines += ['    shell:'] + ['        {!r}'.format(part) for part in self._shell_command(step, runner)]
+        lines += ['', '# endregion', '']
+        text = '\n'.join(lines)
+        if filename:
+            with open(filename, 'w') as fh:
+                fh.write(text)
+        return text
+
+    def _shell_command(self, step, runner):
+        import shlex
+        command = step.command
+        if command is None:
+            names = [name for name, spec in default_apps.items() if spec == step.app_spec]
+            command = '{} {}'.format(runner, names[0]) if names else 'python -m {}'.format(step.app_spec.split(':')[0])
+        args = []
+        for key, value in sorted(step.kwargs.items()):
+            if value is None or value is False:
+                continue
+            args.append('--{}'.format(key))
+            if value is not True:
+                args.append(shlex.quote(str(value)).replace('{', '{{').replace('}', '}}'))
+        if step.workdir:
+            return ['{} --workdir {} {}'.format(command, shlex.quote(self._path(step.workdir)), ' '.join(args))]
+        return ['{} --workdir {{output[0]}}.tmp {}'.format(command, ' '.join(args)).rstrip(),
+                ' && mv {output[0]}.tmp {output[0]}']
+
+
+# endregion
+
+
+# region: functions
+def _run_step(app, kwargs, cpus):
+    """ Run the app of a step in a pool process; return its return code. """
+    name = kwargs['name']
+    # config value THREADS of the app (see `BasicApp._make_config()`)
+    os.environ['{}_THREADS'.format(name.upper())] = str(cpus)
+    return load_app(app).main(**kwargs)
+
+
+def _physical_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 20
+    except (ValueError, OSError):
+        return 2 ** 40
+
+# endregion
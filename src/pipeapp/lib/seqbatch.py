@@ -0,0 +1,313 @@
+"""
+Batches of sequences packed in one NumPy buffer: vectorized residue counts, composition, k-mers and length stats
+"""
+
+# region: imports
+from .shell import _import_numpy
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+DNA = 'ACGT'
+PROTEIN = 'ACDEFGHIKLMNPQRSTVWY'
+CHUNK_RESIDUES = 1 << 24  # residues processed at once, which bounds the memory of the temporary index arrays
+RUN_COPY_RESIDUES = 1024  # `take()` copies runs of sequences one by one if there is a run per this many residues
+MAX_KMER_BINS = 1 << 28  # largest k-mer histogram (alphabet size ** k)
+# endregion
+
+
+# region: classes
+class SequenceBatch:
+    """
+    Batch of sequences packed in one contiguous `uint8` buffer (`data`), sequence i being
+    `data[offsets[i]:offsets[i + 1]]`. Sequences are not kept as Python strings, and all the statistics are
+    computed on the whole buffer with NumPy, in chunks of `CHUNK_RESIDUES` residues.
+
+    # example:
+    >>> batch = SequenceBatch.from_fasta('proteins.faa')
+    >>> batch = batch.filter_length(min_length=50)
+    >>> counts = batch.residue_counts(PROTEIN)  # sequences x residues
+    >>> gc = SequenceBatch.from_fasta('genome.fna').gc_content()
+    """
+
+    def __init__(self, data, offsets, names=None):
+        """
+        :param data: residues of all the sequences (uint8 array)
+        :param offsets: start offsets of the sequences in `data`, and the end of the last one (int64 array)
+        :param names: sequence names
+        :type names: list
+        """
+        self.data = data
+        self.offsets = offsets
+        self.names = names
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Pack sequences.
+        :param records: iterable of (name, sequence) pairs, e.g. `.fasta.IndexedFasta`; sequence is str or bytes
+        :rtype: SequenceBatch
+        """
+        numpy = _import_numpy()
+        from array import array
+        data = bytearray()
+        lengths = array('q')
+        names = []
+        for name, sequence in records:
+            if isinstance(sequence, str):
+                sequence = sequence.encode('ascii')
+            data += sequence
+            lengths.append(len(sequence))
+            names.append(name)
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.frombuffer(lengths, dtype=numpy.int64), out=offsets[1:])
+        return cls(numpy.frombuffer(data, dtype=numpy.uint8), offsets, names)
+
+    @classmethod
+    def from_sequences(cls, sequences, names=None):
+        """
+        Pack sequences.
+        :param sequences: iterable of sequences (str or bytes)
+        :param names: sequence names (their indices by default)
+        :type names: list
+        :rtype: SequenceBatch
+        """
+        sequences = list(sequences)
+        return cls.from_records(zip(names if names is not None else range(len(sequences)), sequences))
+
+    @classmethod
+    def from_fasta(cls, filename):
+        """
+        Pack all the sequences of the FASTA file (plain or BGZF-compressed).
+        :param filename: FASTA file name
+        :type filename: str
+        :rtype: SequenceBatch
+        """
+        from .fasta import IndexedFasta
+        with IndexedFasta(filename) as fasta:
+            return cls.from_records(fasta)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """ Lengths of the sequences (int64 array). """
+        numpy = _import_numpy()
+        return numpy.diff(self.offsets)
+
+    @property
+    def total_length(self):
+        return int(self.offsets[-1])
+
+    def sequence(self, i):
+        """ Return i-th sequence as a string. """
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('ascii')
+
+    def __getitem__(self, item):
+        """ Return sequence by its index, or a batch of the sequences selected by slice, indices or boolean mask. """
+        if isinstance(item, slice) or hasattr(item, '__len__'):
+            return self.take(item)
+        return self.sequence(item)
+
+    def take(self, indices):
+        """
+        Return batch of the selected sequences.
+        A contiguous range of sequences (e.g. a slice) shares the buffer of this batch. Otherwise the runs of
+        consecutive sequences are copied as blocks, or, if the runs are short, the residues are gathered at once.
+        :param indices: slice, array of indices or boolean mask
+        :rtype: SequenceBatch
+        """
+        numpy = _import_numpy()
+        # also checks the indices and the length of the mask
+        selected = numpy.arange(len(self))[indices]
+        lengths = self.lengths[selected]
+        offsets = numpy.zeros(len(selected) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        names = [self.names[i] for i in selected.tolist()] if self.names is not None else None
+        if not len(selected):
+            return SequenceBatch(self.data[:0], offsets, names)
+        # runs of consecutive sequences
+        breaks = numpy.flatnonzero(numpy.diff(selected) != 1) + 1
+        starts = self.offsets[selected[numpy.concatenate(([0], breaks))]]
+        ends = self.offsets[selected[numpy.concatenate((breaks, [len(selected)])) - 1] + 1]
+        if len(starts) == 1:
+            data = self.data[starts[0]:ends[0]]
+        elif len(starts) * RUN_COPY_RESIDUES <= len(self.data):
+            data = numpy.concatenate([self.data[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+        elif (numpy.diff(selected) > 0).all():
+            # in order and without repeats: one mask of all the residues
+            mask = numpy.zeros(len(self), dtype=bool)
+            mask[selected] = True
+            data = self.data[numpy.repeat(mask, self.lengths)]
+        else:
+            # position of every residue of the selected sequences in the old buffer
+            positions = numpy.repeat(self.offsets[:-1][selected] - offsets[:-1], lengths) + numpy.arange(offsets[-1])
+            data = self.data[positions]
+        return SequenceBatch(data, offsets, names)
+
+    def filter_length(self, min_length=None, max_length=None):
+        """
+        Return batch of the sequences not shorter than `min_length` and not longer than `max_length`.
+        :rtype: SequenceBatch
+        """
+        numpy = _import_numpy()
+        lengths = self.lengths
+        mask = numpy.ones(len(lengths), dtype=bool)
+        if min_length is not None:
+            mask &= lengths >= min_length
+        if max_length is not None:
+            mask &= lengths <= max_length
+        return self.take(mask)
+
+    def length_stats(self):
+        """ Return number of sequences, total, min, max, mean and median length, and N50. """
+        numpy = _import_numpy()
+        lengths = self.lengths
+        if not len(lengths):
+            return {'count': 0, 'total': 0, 'min': 0, 'max': 0, 'mean': 0.0, 'median': 0.0, 'n50': 0}
+        ordered = numpy.sort(lengths)[::-1]
+        cumulative = numpy.cumsum(ordered)
+        n50 = ordered[numpy.searchsorted(cumulative, cumulative[-1] / 2)]
+        return {'count': len(lengths), 'total': int(cumulative[-1]), 'min': int(ordered[-1]), 'max': int(ordered[0]),
+                'mean': float(lengths.mean()), 'median': float(numpy.median(lengths)), 'n50': int(n50)}
+
+    def _chunks(self):
+        """ Split sequences into ranges [first, last) of up to `CHUNK_RESIDUES` residues (or one longer sequence). """
+        numpy = _import_numpy()
+        first = 0
+        while first < len(self):
+            last = int(numpy.searchsorted(self.offsets, self.offsets[first] + CHUNK_RESIDUES, side='right')) - 1
+            last = min(max(last, first + 1), len(self))
+            yield first, last
+            first = last
+
+    def residue_counts(self, alphabet=PROTEIN, ignore_case=True):
+        """
+        Count residues of each sequence.
+        :param alphabet: residues to count; other residues are not counted
+        :type alphabet: str
+        :param ignore_case: count lowercase residues as uppercase ones (and vice versa)
+        :type ignore_case: bool
+        :return: counts, int64 array of shape (number of sequences, len(alphabet))
+        """
+        numpy = _import_numpy()
+        size = len(alphabet) + 1  # the last column counts the other residues
+        table = _lookup_table(alphabet, ignore_case)
+        lengths = self.lengths
+        counts = numpy.zeros((len(self), size), dtype=numpy.int64)
+        for first, last in self._chunks():
+            codes = table[self.data[self.offsets[first]:self.offsets[last]]].astype(numpy.int64)
+            codes += numpy.repeat(numpy.arange(last - first, dtype=numpy.int64) * size, lengths[first:last])
+            counts[first:last] = numpy.bincount(codes, minlength=(last - first) * size).reshape(-1, size)
+        return counts[:, :-1]
+
+    def composition(self, alphabet=PROTEIN, ignore_case=True):
+        """
+        Return fraction of each residue in each sequence (0 for empty sequences).
+        :return: float64 array of shape (number of sequences, len(alphabet))
+        """
+        numpy = _import_numpy()
+        counts = self.residue_counts(alphabet, ignore_case)
+        lengths = self.lengths[:, None]
+        return numpy.divide(counts, lengths, out=numpy.zeros(counts.shape), where=lengths > 0)
+
+    def count_residues(self, residues):
+        """
+        Count residues of any of the given kinds in each sequence, e.g. 'GCgc'.
+        :param residues: residues (case-sensitive)
+        :type residues: str
+        :return: int64 array of counts
+        """
+        numpy = _import_numpy()
+        counts = numpy.zeros(len(self), dtype=numpy.int64)
+        lengths = self.lengths
+        for first, last in self._chunks():
+            start = self.offsets[first]
+            data = self.data[start:self.offsets[last]]
+            # comparisons are much faster than a lookup table for a few kinds of residues
+            matches = numpy.zeros(len(data), dtype=bool)
+            for code in set(residues.encode('ascii')):
+                matches |= data == code
+            # sums over the non-empty sequences: `reduceat` would return one value for an empty sequence
+            non_empty = lengths[first:last] > 0
+            if non_empty.any():
+                counts[first:last][non_empty] = numpy.add.reduceat(
+                    matches, self.offsets[first:last][non_empty] - start, dtype=numpy.int64)
+        return counts
+
+    def gc_content(self):
+        """ Return fraction of G and C (either case) in each sequence (0 for empty sequences); float64 array. """
+        numpy = _import_numpy()
+        lengths = self.lengths
+        return numpy.divide(self.count_residues('GCgc'), lengths, out=numpy.zeros(len(lengths)), where=lengths > 0)
+
+    def kmer_counts(self, k, alphabet=DNA, ignore_case=True):
+        """
+        Count k-mers of all the sequences; k-mers with residues not in the alphabet are skipped.
+        :param k: k-mer length
+        :type k: int
+        :param alphabet: residues
+        :type alphabet: str
+        :param ignore_case: count lowercase residues as uppercase ones
+        :type ignore_case: bool
+        :return: int64 array of len(alphabet) ** k counts, in the order of `kmer_labels(k, alphabet)`
+        """
+        numpy = _import_numpy()
+        size = len(alphabet)
+        if k < 1:
+            raise ValueError('kmer_counts: k should be positive')
+        if size ** k > MAX_KMER_BINS:
+            raise ValueError('kmer_counts: too many k-mers: {} ** {}'.format(size, k))
+        table = _lookup_table(alphabet, ignore_case)
+        hist = numpy.zeros(size ** k, dtype=numpy.int64)
+        for first, last in self._chunks():
+            start = self.offsets[first]
+            codes = table[self.data[start:self.offsets[last]]]
+            windows = len(codes) - k + 1
+            if windows < 1:
+                continue
+            kmers = numpy.zeros(windows, dtype=numpy.int64)
+            for j in range(k):
+                kmers *= size
+                kmers += codes[j:j + windows]
+            # skip windows with other residues and windows across the start of the next sequence
+            other = numpy.concatenate(([0], numpy.cumsum(codes == size)))
+            starts = numpy.zeros(len(codes) + 2, dtype=numpy.int64)
+            starts[self.offsets[first + 1:last] - start + 1] = 1
+            starts = numpy.cumsum(starts)
+            valid = (other[k:] == other[:-k]) & (starts[k:k + windows] == starts[1:windows + 1])
+            hist += numpy.bincount(kmers[valid], minlength=size ** k)
+        return hist
+
+
+# endregion
+
+
+# region: functions
+def _lookup_table(alphabet, ignore_case):
+    """ Return table: byte -> index of the residue in the alphabet, or len(alphabet) for other residues. """
+    numpy = _import_numpy()
+    table = numpy.full(256, len(alphabet), dtype=numpy.uint8)
+    if ignore_case:
+        for i, residue in enumerate(alphabet):
+            table[ord(residue.upper())] = table[ord(residue.lower())] = i
+    for i, residue in enumerate(alphabet):
+        table[ord(residue)] = i
+    return table
+
+
+def kmer_labels(k, alphabet=DNA):
+    """ Return k-mers in the order of `SequenceBatch.kmer_counts()`. """
+    from itertools import product
+    return [''.join(kmer) for kmer in product(alphabet, repeat=k)]
+
+
+def encode_sequences(sequences, names=None):
+    """
+    Pack sequences into a batch; see `SequenceBatch.from_sequences()`.
+    :rtype: SequenceBatch
+    """
+    return SequenceBatch.from_sequences(sequences, names=names)
+
+# endregion
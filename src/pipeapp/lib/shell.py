@@ -2,20 +2,866 @@
 Shell functions e.g. copy/move files/dirs, run commands, ftp, etc
 """
 
-import ftplib
+import os
 from os.path import expanduser, expandvars, realpath, isfile, getsize
-from os import makedirs, walk, path, rename as rename_file, remove
-from shutil import Error as shutil_Error, rmtree, copytree, copy2, move
-from shlex import split as shlex_split
+from os import makedirs, walk, path, rename as rename_file, remove, getpid, stat, replace as replace_file, cpu_count
+from os import getcwd, link as hardlink, wait4, waitstatus_to_exitcode, killpg, waitid, P_PID, WEXITED, WNOWAIT
 from glob import glob
-from subprocess import Popen, PIPE, call
 import errno
-from gzip import open as gz_open
-from codecs import open as codecs_open
-from zipfile import ZipFile
+from collections import namedtuple, deque, defaultdict
+from operator import itemgetter
+from itertools import islice
+from threading import Thread, Timer, Lock, BoundedSemaphore
+from contextlib import contextmanager
+from time import monotonic
+from stat import S_ISLNK
+import struct
+# rarely used or heavy modules (ftplib, zipfile, subprocess, shutil, concurrent.futures, hashlib, ...) are imported
+# in the functions that use them, to keep the startup time of apps low
+
+from .codec import open_compressed, detect_codec
+
+
+# region: variables
+_ftp_pool = None
+_ftp_pool_lock = Lock()
+_background_cleanups = []
+_background_cleanups_lock = Lock()
+# endregion
 
 
 # region: classes
+class TabBatchReader:
+    """
+    Read tab-delimited file in fixed-size batches, keeping only the requested columns converted to declared dtypes.
+
+    Unlike `tab_file_reader()`, no dict is built per line: each batch is either a list of compact record tuples
+    (namedtuples, which have empty `__slots__`), a dict of column lists, or a dict of NumPy arrays.
+    Categorical columns are returned as integer codes; code labels are kept in `categories`,
+    which grows while the file is read and is shared by all the batches.
+
+    # example:
+    >>> reader = TabBatchReader('genes.tsv', columns=['id', 'len'], dtypes={'len': int}, output='numpy')
+    >>> for batch in reader:
+    >>>   print(batch['len'].sum())
+    """
+    dtype_converters = {
+        'str': str,
+        'int': int,
+        'float': float,
+        'category': None,
+    }
+    numpy_dtypes = {
+        'int': 'int64',
+        'float': 'float64',
+        'category': 'int32',
+    }
+    outputs = ('records', 'columns', 'numpy')
+
+    def __init__(self, filename, columns=None, dtypes=None, batch_size=65536, headline=True, fieldnames=None,
+                 gzip=False, output='records', threads=None):
+        """
+        :param filename: input file name
+        :type filename: str
+        :param columns: names of the columns to read (all columns by default)
+        :type columns: list
+        :param dtypes: column name -> dtype; dtype is one of int, float, str or 'category' (str by default)
+        :type dtypes: dict
+        :param batch_size: number of lines in one batch
+        :type batch_size: int
+        :param headline: should we use the first line as the headline (containing field names)?
+        :type headline: bool
+        :param fieldnames: field names, if file has no headline
+        :type fieldnames: list
+        :param gzip: is file gzipped? (kept for compatibility: compression is detected from the file content)
+        :type gzip: bool
+        :param output: type of the batches: 'records', 'columns' or 'numpy'
+        :type output: str
+        :param threads: number of decompression threads
+        :type threads: int
+        """
+        if output not in self.outputs:
+            raise ValueError('TabBatchReader: no such output: {}'.format(output))
+        if batch_size < 1:
+            raise ValueError('TabBatchReader: batch_size should be positive')
+        if not headline and not fieldnames:
+            raise ValueError('TabBatchReader: fieldnames are required when there is no headline')
+        self.filename = filename
+        self.columns = list(columns) if columns else None
+        self.dtypes = {col: self._dtype_name(dt) for col, dt in (dtypes or {}).items()}
+        self.batch_size = batch_size
+        self.headline = headline
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.gzip = gzip
+        self.output = output
+        self.threads = threads
+        self.categories = {}
+
+    @classmethod
+    def _dtype_name(cls, dtype):
+        name = dtype if isinstance(dtype, str) else getattr(dtype, '__name__', None)
+        if name not in cls.dtype_converters:
+            raise ValueError('TabBatchReader: unsupported dtype: {}'.format(dtype))
+        return name
+
+    def _open(self):
+        return open_file(self.filename, threads=self.threads)
+
+    def __iter__(self):
+        fh = self._open()
+        try:
+            fieldnames = self.fieldnames
+            if self.headline:
+                fieldnames = next(fh).replace('#', '').strip().split('\t')
+            columns = self.columns or fieldnames
+            missing = [col for col in columns if col not in fieldnames]
+            if missing:
+                raise KeyError('TabBatchReader: no such columns in {}: {}'.format(self.filename, missing))
+            dtypes = [self.dtypes.get(col, 'str') for col in columns]
+            for col, dt in zip(columns, dtypes):
+                if dt == 'category':
+                    self.categories[col] = []
+            getter = itemgetter(*[fieldnames.index(col) for col in columns])
+            if len(columns) == 1:
+                # itemgetter with a single index returns the field itself, not a tuple
+                single_getter = getter
+
+                def getter(fields):
+                    return single_getter(fields),
+            if self.output == 'records':
+                record_class = namedtuple('TabRecord', columns, rename=True)
+            if self.output == 'numpy':
+                numpy = _import_numpy()
+            lookups = {col: {} for col in self.categories}
+
+            while True:
+                lines = list(islice(fh, self.batch_size))
+                if not lines:
+                    break
+                try:
+                    # blank lines (e.g. at the end of the file) are skipped, as `tab_file_reader()` tolerates them
+                    rows = [getter(line.rstrip('\r\n').split('\t')) for line in lines if not line.isspace()]
+                except IndexError:
+                    raise ValueError('TabBatchReader: line with missing fields in {}'.format(self.filename))
+                if not rows:
+                    continue
+                batch_columns = []
+                for col, dt, values in zip(columns, dtypes, zip(*rows)):
+                    if dt == 'category':
+                        values = self._encode_categories(values, lookups[col], self.categories[col])
+                    elif dt != 'str':
+                        values = list(map(self.dtype_converters[dt], values))
+                    batch_columns.append(values)
+
+                if self.output == 'records':
+                    yield list(map(record_class._make, zip(*batch_columns)))
+                elif self.output == 'columns':
+                    yield {col: list(values) for col, values in zip(columns, batch_columns)}
+                else:
+                    yield {col: numpy.array(values, dtype=self.numpy_dtypes.get(dt))
+                           for col, dt, values in zip(columns, dtypes, batch_columns)}
+        finally:
+            fh.close()
+
+    @staticmethod
+    def _encode_categories(values, lookup, labels):
+        codes = []
+        for v in values:
+            code = lookup.get(v)
+            if code is None:
+                code = lookup[v] = len(labels)
+                labels.append(v)
+            codes.append(code)
+        return codes
+
+
+class TabFileWriter:
+    """
+    Write tab-delimited file, the counterpart of `tab_file_reader()` and `TabBatchReader`.
+
+    Rows may be written as dicts (keyed by `fieldnames`), as tuples, or as column batches (dicts or lists of
+    columns, e.g. the batches of `TabBatchReader` with output 'columns' or 'numpy'). Rows are formatted into large
+    blocks before they are written; gzipped output is written as BGZF (see `.codec.BgzfWriter`), compressed on
+    `threads` threads, which standard gzip tools can read.
+    The file is written under a temporary name (in `tmp_dir`, if given) and renamed to `filename` on `close()`,
+    so `filename` is never left half-written; if the writer is closed by an exception, the file is discarded.
+
+    # example:
+    >>> with TabFileWriter(path.join(self.dir_out, 'genes.tsv.gz'), ['id', 'len'], tmp_dir=self.dir_tmp) as writer:
+    >>>   writer.write({'id': 'g1', 'len': 100})
+    >>>   writer.write_columns({'id': ['g2', 'g3'], 'len': [200, 300]})
+    """
+
+    def __init__(self, filename, fieldnames=None, headline=True, compress=None, level=6, threads=None,
+                 tmp_dir=None, buffer_size=1 << 22):
+        """
+        :param filename: output file name
+        :type filename: str
+        :param fieldnames: field names (required to write dicts and the headline)
+        :type fieldnames: list
+        :param headline: write the headline (`#` and the field names)?
+        :type headline: bool
+        :param compress: compress the file as BGZF? (by default, if the file name ends with .gz or .bgz)
+        :type compress: bool
+        :param level: compression level (1-9)
+        :type level: int
+        :param threads: number of compression threads (all CPUs by default)
+        :type threads: int
+        :param tmp_dir: directory to write the file to before it is renamed (the directory of `filename` by default)
+        :type tmp_dir: str
+        :param buffer_size: size of the blocks of formatted rows, in bytes
+        :type buffer_size: int
+        """
+        if headline and not fieldnames:
+            raise ValueError('TabFileWriter: fieldnames are required to write the headline')
+        if compress is None:
+            compress = filename.endswith(('.gz', '.bgz'))
+        self.filename = filename
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.buffer_size = buffer_size
+        self.nrows = 0
+        from tempfile import mkstemp
+        fd, self.tmp_filename = mkstemp(dir=tmp_dir or path.dirname(path.abspath(filename)),
+                                        prefix='.{}.'.format(path.basename(filename)), suffix='.tmp')
+        os.close(fd)
+        os.chmod(self.tmp_filename, _new_file_mode())  # mkstemp creates the file readable by the owner only
+        if compress:
+            from .codec import BgzfWriter
+            self._fh = BgzfWriter(self.tmp_filename, level=level, threads=threads)
+        else:
+            self._fh = open(self.tmp_filename, 'wb')
+        self._lines = []
+        self._size = 0
+        self._getter = None
+        if self.fieldnames:
+            self._getter = itemgetter(*self.fieldnames) if len(self.fieldnames) > 1 else (
+                lambda record, name=self.fieldnames[0]: (record[name],))
+        if headline:
+            self._add_lines(['#' + '\t'.join(self.fieldnames)])
+
+    def _add_lines(self, lines):
+        self._lines.extend(lines)
+        self._size += sum(map(len, lines))
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered rows to the file. """
+        if self._lines:
+            self._lines.append('')
+            self._fh.write('\n'.join(self._lines).encode('utf-8'))
+            self._lines = []
+            self._size = 0
+
+    @staticmethod
+    def _format(values):
+        return '\t'.join(['' if v is None else str(v) for v in values])
+
+    def write(self, row):
+        """
+        Write one row.
+        :param row: dict (missing fields are written empty) or sequence of values in the order of the fields
+        """
+        if isinstance(row, dict):
+            if self._getter is None:
+                raise ValueError('TabFileWriter: fieldnames are required to write dicts')
+            row = [row.get(name) for name in self.fieldnames]
+        self._add_lines([self._format(row)])
+        self.nrows += 1
+
+    def write_rows(self, rows):
+        """
+        Write rows: dicts (all with all the fields), or sequences of values.
+        :param rows: iterable of rows
+        """
+        rows = iter(rows)
+        while True:
+            block = list(islice(rows, 8192))
+            if not block:
+                break
+            if isinstance(block[0], dict):
+                if self._getter is None:
+                    raise ValueError('TabFileWriter: fieldnames are required to write dicts')
+                block = map(self._getter, block)
+            lines = list(map(self._format, block))
+            self._add_lines(lines)
+            self.nrows += len(lines)
+
+    def write_columns(self, columns):
+        """
+        Write a batch of columns of the same length.
+        :param columns: dict field name -> column (all the fields), or list of columns in the order of the fields;
+            a column is a sequence of values or a NumPy array
+        """
+        if isinstance(columns, dict):
+            if self.fieldnames is None:
+                raise ValueError('TabFileWriter: fieldnames are required to write dicts')
+            columns = [columns[name] for name in self.fieldnames]
+        # NumPy arrays are converted to lists of Python values at once, which is much faster than per value
+        columns = [col.tolist() if hasattr(col, 'tolist') else col for col in columns]
+        self.write_rows(zip(*columns))
+
+    def close(self, discard=False):
+        """
+        Write the buffered rows and move the file in place.
+        :param discard: remove the file instead
+        :type discard: bool
+        """
+        if self._fh is None:
+            return
+        try:
+            if not discard:
+                self.flush()
+        finally:
+            self._fh.close()
+            self._fh = None
+        if discard:
+            remove_file(self.tmp_filename)
+            return
+        # renamed, or copied next to `filename` and renamed if `tmp_dir` is on another file system
+        transfer_file(self.tmp_filename, self.filename, move=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(discard=exc_type is not None)
+
+
+class IndexedLineFile:
+    """
+    Random access to lines of an uncompressed text file through a memory map and a line-offset index.
+
+    The index (an `array('Q')` of line start offsets) is built on the first read and saved next to the file
+    as `<filename>.lidx`; it is rebuilt automatically when the size or mtime of the file changes.
+    After that, `len()`, `reader[i]` and slicing never re-scan the file.
+
+    # example:
+    >>> with IndexedLineFile('proteins.list') as lines:
+    >>>   print(len(lines), lines[-1], lines[10:20])
+    """
+    index_suffix = '.lidx'
+    index_magic = b'PAPLIDX1'
+    index_header = struct.Struct('<8sQQQ')  # magic, file size, file mtime (ns), number of offsets
+
+    def __init__(self, filename, index_filename=None, save_index=True, encoding='utf-8'):
+        """
+        :param filename: input file name
+        :type filename: str
+        :param index_filename: index file name (`<filename>.lidx` by default)
+        :type index_filename: str
+        :param save_index: save newly built index to the index file
+        :type save_index: bool
+        :param encoding: text encoding
+        :type encoding: str
+        """
+        from mmap import mmap, ACCESS_READ
+        self.filename = filename
+        self.index_filename = index_filename or filename + self.index_suffix
+        self.encoding = encoding
+        if detect_codec(filename) is not None:
+            raise ValueError('IndexedLineFile: compressed files are not supported: {}'.format(filename))
+        self._fh = open(filename, 'rb')
+        st = stat(self._fh.fileno())
+        self._size = st.st_size
+        self._mtime = st.st_mtime_ns
+        self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ) if self._size else b''
+        self._offsets = self._load_index()
+        if self._offsets is None:
+            self._offsets = self._build_index()
+            if save_index:
+                self._save_index()
+        self._first = 0
+
+    def _load_index(self):
+        from array import array
+        try:
+            with open(self.index_filename, 'rb') as fh:
+                magic, size, mtime, n = self.index_header.unpack(fh.read(self.index_header.size))
+                if magic != self.index_magic or size != self._size or mtime != self._mtime:
+                    return None
+                offsets = array('Q')
+                offsets.fromfile(fh, n)
+        except (OSError, EOFError, struct.error):
+            return None
+        return offsets
+
+    def _build_index(self):
+        from array import array
+        offsets = array('Q', [0])
+        find = self._mm.find
+        pos = find(b'\n') + 1
+        while pos:
+            offsets.append(pos)
+            pos = find(b'\n', pos) + 1
+        if offsets[-1] != self._size:
+            offsets.append(self._size)
+        return offsets
+
+    def _save_index(self):
+        tmp_filename = '{}.{}.tmp'.format(self.index_filename, getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(self.index_header.pack(self.index_magic, self._size, self._mtime, len(self._offsets)))
+                self._offsets.tofile(fh)
+            replace_file(tmp_filename, self.index_filename)
+        except OSError:
+            # read-only location: keep the index in memory only
+            remove_file(tmp_filename)
+
+    def line(self, i):
+        """ Return line `i` (0-based, not counting skipped lines) without the line break. """
+        i += self._first
+        return self._mm[self._offsets[i]:self._offsets[i + 1]].rstrip(b'\r\n').decode(self.encoding)
+
+    def _parse(self, line):
+        return line
+
+    def __len__(self):
+        return len(self._offsets) - 1 - self._first
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._parse(self.line(i)) for i in range(*item.indices(len(self)))]
+        n = len(self)
+        if item < 0:
+            item += n
+        if not 0 <= item < n:
+            raise IndexError('{}: line index out of range'.format(type(self).__name__))
+        return self._parse(self.line(item))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._parse(self.line(i))
+
+    def close(self):
+        if self._size and not self._mm.closed:
+            self._mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class IndexedTabFile(IndexedLineFile):
+    """
+    Random access to records of a tab-delimited file; records are dicts, as from `tab_file_reader()`.
+    """
+
+    def __init__(self, filename, headline=True, fieldnames=None, **kwargs):
+        """
+        :param filename: input file name
+        :type filename: str
+        :param headline: should we use the first line as the headline (containing field names)?
+            An empty file has no records, and `fieldnames` are left as given (None by default).
+        :type headline: bool
+        :param fieldnames: field names, if file has no headline
+        :type fieldnames: list
+        :param kwargs: see `IndexedLineFile`
+        """
+        super().__init__(filename, **kwargs)
+        self.fieldnames = fieldnames
+        if headline and len(self):
+            self.fieldnames = self.line(0).replace('#', '').strip().split('\t')
+            self._first = 1
+
+    def _parse(self, line):
+        return dict(zip(self.fieldnames, line.strip().split('\t')))
+
+
+class ShellPipeline:
+    """
+    Streaming pipeline of shell commands (`cmd1 | cmd2 | ...`) run without a shell.
+
+    Stdout lines of the last command are yielded as they arrive, while stderr of every stage is drained
+    concurrently on background threads, so no stage can block on a full stderr buffer. Upstream stdout handles are
+    closed in the parent, so a stage that exits early makes the upstream ones get SIGPIPE. `stdin` may be a file
+    handle or any iterable (e.g. output of `tab_file_reader()`), which is fed to the first command from a thread:
+    str/bytes items are written as lines, dicts and tuples as tab-delimited lines.
+
+    # example:
+    >>> with ShellPipeline('sort -k2,2 | uniq -c', stdin=tab_file_reader('genes.tsv')) as pipe:
+    >>>   for line in pipe:
+    >>>     print(line, end='')
+    >>> print(pipe.returncodes, pipe.stderr)
+    """
+
+    def __init__(self, cmd, stdin=None, encoding='utf-8', cwd=None, env=None):
+        """
+        :param cmd: piped command, or list of commands, each being a list of arguments
+        :type cmd: str | list
+        :param stdin: file handle or iterable fed to stdin of the first command
+        :param encoding: encoding of stdin/stdout/stderr
+        :type encoding: str
+        :param cwd: working directory of the commands
+        :type cwd: str
+        :param env: environment of the commands
+        :type env: dict
+        """
+        self.commands = split_shell_pipe(cmd) if isinstance(cmd, str) else [list(c) for c in cmd]
+        self.stdin = stdin
+        self.encoding = encoding
+        self.cwd = cwd
+        self.env = env
+        self.procs = []
+        self.returncodes = None
+        self._stderr = []
+        self._threads = []
+        self._feeder = None
+        self._feeder_error = None
+
+    def start(self, drain_stderr=True):
+        """
+        Start all the commands of the pipeline.
+        :param drain_stderr: drain stderr of every stage; if False, stderr of the last stage is left to the caller
+        :type drain_stderr: bool
+        :return: self
+        """
+        from subprocess import Popen, PIPE
+        feed = self.stdin is not None and not hasattr(self.stdin, 'fileno')
+        for n, argv in enumerate(self.commands):
+            if n == 0:
+                stdin = PIPE if feed else self.stdin
+            else:
+                stdin = self.procs[n - 1].stdout
+            proc = Popen(argv, stdin=stdin, stdout=PIPE, stderr=PIPE, cwd=self.cwd, env=self.env)
+            if n > 0:
+                self.procs[n - 1].stdout.close()
+            self.procs.append(proc)
+        for n, proc in enumerate(self.procs):
+            self._stderr.append([])
+            if drain_stderr or n < len(self.procs) - 1:
+                t = Thread(target=self._drain, args=(proc.stderr, self._stderr[n]), daemon=True)
+                t.start()
+                self._threads.append(t)
+        if feed:
+            self._feeder = Thread(target=self._feed, args=(self.procs[0].stdin, self.stdin), daemon=True)
+            self._feeder.start()
+        return self
+
+    @staticmethod
+    def _drain(fh, chunks):
+        for chunk in iter(lambda: fh.read(65536), b''):
+            chunks.append(chunk)
+        fh.close()
+
+    def _feed(self, fh, items):
+        encoding = self.encoding
+        try:
+            for item in items:
+                if isinstance(item, dict):
+                    item = '\t'.join(str(v) for v in item.values())
+                elif isinstance(item, (tuple, list)):
+                    item = '\t'.join(str(v) for v in item)
+                if isinstance(item, str):
+                    item = item.encode(encoding)
+                fh.write(item if item.endswith(b'\n') else item + b'\n')
+        except BrokenPipeError:
+            pass  # the first command exited without reading all of its input
+        except Exception as e:
+            self._feeder_error = e
+        finally:
+            try:
+                fh.close()
+            except BrokenPipeError:
+                pass
+
+    def __iter__(self):
+        """ Yield decoded stdout lines of the last command, as they arrive. """
+        if not self.procs:
+            self.start()
+        encoding = self.encoding
+        for line in self.procs[-1].stdout:
+            yield line.decode(encoding)
+
+    @property
+    def stderr(self):
+        """ List of decoded stderr outputs, one per stage. """
+        return [b''.join(chunks).decode(self.encoding, 'replace') for chunks in self._stderr]
+
+    def wait(self, timeout=None):
+        """
+        Wait for all the commands to finish; any unread stdout of the last command is discarded.
+        :param timeout: timeout for each command, in seconds
+        :type timeout: float
+        :return: exit codes of all the stages
+        :rtype: list
+        """
+        stdout = self.procs[-1].stdout
+        if not stdout.closed:
+            for _ in iter(lambda: stdout.read(65536), b''):
+                pass
+            stdout.close()
+        self.returncodes = [proc.wait(timeout=timeout) for proc in self.procs]
+        if self._feeder is not None:
+            self._feeder.join()
+        for t in self._threads:
+            t.join()
+        if self._feeder_error is not None:
+            raise self._feeder_error
+        return self.returncodes
+
+    def kill(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def __enter__(self):
+        if not self.procs:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.kill()
+        self.wait()
+
+
+class ShellJob:
+    """
+    One external command for `run_shell_jobs()`.
+    """
+
+    def __init__(self, cmd, name=None, timeout=None, retries=None, stdout=None, stderr=None, cwd=None, env=None):
+        """
+        :param cmd: shell command
+        :type cmd: str
+        :param name: job name (also used for output file names)
+        :type name: str
+        :param timeout: time limit of one attempt, in seconds
+        :type timeout: float
+        :param retries: how many times to re-run the failed job
+        :type retries: int
+        :param stdout: file name to write stdout to
+        :type stdout: str
+        :param stderr: file name to write stderr to
+        :type stderr: str
+        :param cwd: working directory
+        :type cwd: str
+        :param env: environment
+        :type env: dict
+        """
+        self.cmd = cmd
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.stdout = stdout
+        self.stderr = stderr
+        self.cwd = cwd
+        self.env = env
+
+
+TransferSummary = namedtuple('TransferSummary', ['files', 'bytes', 'methods', 'seconds'])
+ShellJobResult = namedtuple('ShellJobResult', ['name', 'cmd', 'returncode', 'wall_time', 'cpu_time', 'attempts',
+                                               'timed_out', 'stdout', 'stderr'])
+
+
+class FTPConnectionPool:
+    """
+    Pool of logged-in FTP connections, keyed by host.
+
+    Connections are reused between calls instead of connecting and logging in for every file; at most
+    `max_connections` connections per host are open at the same time. A connection is dropped from the pool if
+    an error happens while it is in use.
+    """
+
+    def __init__(self, max_connections=4, factory=None, timeout=60):
+        """
+        :param max_connections: max number of connections per host
+        :type max_connections: int
+        :param factory: function host -> logged-in `ftplib.FTP`-like object (anonymous login by default)
+        :type factory: callable
+        :param timeout: connection timeout, in seconds
+        :type timeout: float
+        """
+        self.max_connections = max_connections
+        self.factory = factory or self._anonymous_login
+        self.timeout = timeout
+        self._idle = defaultdict(list)
+        self._slots = {}
+        self._lock = Lock()
+
+    def _anonymous_login(self, host):
+        import ftplib
+        ftp = ftplib.FTP(host, timeout=self.timeout)
+        ftp.login()
+        return ftp
+
+    def _slot(self, host):
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = BoundedSemaphore(self.max_connections)
+            return self._slots[host]
+
+    def _get_idle(self, host):
+        import ftplib
+        while True:
+            with self._lock:
+                if not self._idle[host]:
+                    return None
+                ftp = self._idle[host].pop()
+            try:
+                ftp.voidcmd('NOOP')  # server may have closed the idle connection
+                return ftp
+            except ftplib.all_errors:
+                self._discard(ftp)
+
+    @staticmethod
+    def _discard(ftp):
+        import ftplib
+        try:
+            ftp.close()
+        except ftplib.all_errors:
+            pass
+
+    @contextmanager
+    def connection(self, host):
+        """
+        Context manager that takes connection to `host` from the pool and returns it back.
+        :param host: FTP host name
+        :type host: str
+        """
+        slot = self._slot(host)
+        slot.acquire()
+        try:
+            ftp = self._get_idle(host) or self.factory(host)
+            try:
+                yield ftp
+            except BaseException:
+                self._discard(ftp)
+                raise
+            with self._lock:
+                self._idle[host].append(ftp)
+        finally:
+            slot.release()
+
+    def close(self):
+        """ Close all the idle connections. """
+        import ftplib
+        with self._lock:
+            idle = [ftp for conns in self._idle.values() for ftp in conns]
+            self._idle.clear()
+        for ftp in idle:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                self._discard(ftp)
+
+
+class PathNormalizer:
+    """
+    Batch version of `full_path()` that remembers the directories it has already resolved.
+
+    Each directory is resolved with `realpath` and listed (one `scandir`) only once, so a path of a regular file
+    is normalized without any syscalls; symlinked files are still resolved completely, and files that appeared after
+    their directory was listed cost one `lstat`. Relative paths are resolved against the working directory
+    at the time the normalizer was created.
+    """
+
+    def __init__(self):
+        self.cwd = os.getcwd()
+        self._dirs = {}
+
+    def _resolve_dir(self, dirname):
+        real_dir = realpath(dirname)
+        try:
+            with os.scandir(real_dir) as it:
+                links = {e.name: e.is_symlink() for e in it}
+        except OSError:
+            links = {}
+        self._dirs[dirname] = real_dir, links
+        return real_dir, links
+
+    def __call__(self, pathname):
+        if not pathname:
+            return None
+        if pathname[0] == '~':
+            pathname = expanduser(pathname)
+        if '$' in pathname:
+            pathname = expandvars(pathname)
+        if pathname[0] != '/':
+            pathname = path.join(self.cwd, pathname)
+        dirname, basename = path.split(pathname)
+        if basename in ('', '.', '..'):
+            return realpath(pathname)
+        real_dir, links = self._dirs.get(dirname) or self._resolve_dir(dirname)
+        full = path.join(real_dir, basename)
+        is_link = links.get(basename)
+        if is_link is None:
+            try:
+                is_link = S_ISLNK(os.lstat(full).st_mode)
+            except OSError:
+                is_link = False
+        return realpath(full) if is_link else full
+
+    def normalize_many(self, pathnames):
+        """ Normalize list of paths. """
+        return [self(p) for p in pathnames]
+
+
+class FileHashCache:
+    """
+    Cache of file content hashes keyed by device, inode, size and mtime, optionally persisted to a pickle file,
+    so that unchanged files are not hashed again.
+    """
+
+    def __init__(self, filename=None):
+        """
+        :param filename: file to load the cache from and to save it to (in-memory only, if None)
+        :type filename: str
+        """
+        import pickle
+        self.filename = filename
+        self._hashes = {}
+        self._used = set()
+        self._changed = False
+        if filename and path.isfile(filename):
+            try:
+                with open(filename, 'rb') as fh:
+                    self._hashes = pickle.load(fh)
+            except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+                self._hashes = {}
+            if not isinstance(self._hashes, dict):
+                self._hashes = {}
+
+    @staticmethod
+    def key(st):
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, st):
+        key = self.key(st)
+        self._used.add(key)
+        return self._hashes.get(key)
+
+    def set(self, st, digest):
+        key = self.key(st)
+        self._used.add(key)
+        self._hashes[key] = digest
+        self._changed = True
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def save(self, used_only=False):
+        """
+        Save the cache to `filename`, if it has changed since it was loaded.
+        :param used_only: drop the hashes of the files that were not looked up (e.g. deleted or changed files)
+        :type used_only: bool
+        """
+        import pickle
+        if used_only and len(self._used) < len(self._hashes):
+            self._hashes = {k: v for k, v in self._hashes.items() if k in self._used}
+            self._changed = True
+        if not self.filename or not self._changed:
+            return
+        tmp_filename = '{}.{}.tmp'.format(self.filename, getpid())
+        with open(tmp_filename, 'wb') as fh:
+            pickle.dump(self._hashes, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        replace_file(tmp_filename, self.filename)
+        self._changed = False
 
 # endregion
 
@@ -27,28 +873,55 @@ def full_path(pathname):
         return realpath(expandvars(expanduser(pathname)))
 
 
-def gzip_filehandle(fname):
+def gzip_filehandle(fname, threads=None):
     """
     Return file handle for the gzip file opened in read-text mode.
+    BGZF files are decompressed on `threads` threads; see `open_file()`.
     """
-    fh = gz_open(filename=fname, mode='rt', encoding='utf-8')
-    return fh
+    return open_file(fname, threads=threads)
 
 
-def unzip(zip_path, extract_dir=None, remove_zip=False):
+def unzip(zip_path, extract_dir=None, remove_zip=False, members=None, threads=None):
     """
-    Extract all members from a zip archive.
+    Extract members from a zip archive, in parallel: each thread extracts its share of the members
+    through its own handle of the archive.
 
     :param zip_path: file path to zip archive
-    :param out_dir: directory to extract to (current working directory by default)
+    :param extract_dir: directory to extract to (current working directory by default)
     :param remove_zip: if True, delete the zip file after extracting it
+    :param members: glob pattern (or list of patterns) of the member names to extract (all members by default)
+    :param threads: number of threads
     :type zip_path: str
-    :type out_dir: str
+    :type extract_dir: str
     :type remove_zip: bool
+    :type members: str or list
+    :type threads: int
+    :return: names of the extracted members
+    :rtype: list
     """
+    from zipfile import ZipFile
+    from concurrent.futures import ThreadPoolExecutor
+    extract_dir = extract_dir or getcwd()
     with ZipFile(zip_path) as zf:
-        archive_members = zf.namelist()
-        zf.extractall(extract_dir)
+        archive_members = filter_names(zf.namelist(), members)
+    threads = min(threads or _transfer_threads(), len(archive_members))
+    # create the directories beforehand: ZipFile.extract() is not safe from concurrent creation of the same directory
+    for dirname in sorted({path.dirname(name) for name in archive_members}):
+        parts = [part for part in dirname.split('/') if part not in ('', '.', '..')]
+        if parts:
+            makedirs(path.join(extract_dir, *parts), exist_ok=True)
+
+    def extract(names):
+        with ZipFile(zip_path) as zf:
+            for name in names:
+                zf.extract(name, extract_dir)
+
+    if threads > 1:
+        # interleaved shares, so that big and small members are spread over the threads
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(extract, [archive_members[i::threads] for i in range(threads)]))
+    else:
+        extract(archive_members)
 
     if remove_zip:
         remove_file(zip_path)
@@ -56,31 +929,123 @@ def unzip(zip_path, extract_dir=None, remove_zip=False):
     return archive_members
 
 
-def open_file(filename):
-    """ Open text file, wether gzipped or not. Return open file handle. """
-    if filename.endswith('.gz'):
-        fh = gz_open(filename=filename, mode='rt', encoding='utf-8')
+def filter_names(names, patterns=None):
+    """
+    Return names that match any of the glob patterns.
+    :param names: names, e.g. archive member names
+    :type names: list
+    :param patterns: glob pattern or list of patterns (all names match if None)
+    :type patterns: str or list
+    :rtype: list
+    """
+    if patterns is None:
+        return list(names)
+    from fnmatch import fnmatchcase
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return [name for name in names if any(fnmatchcase(name, pattern) for pattern in patterns)]
+
+
+def list_archive(archive, members=None):
+    """
+    List member files of a zip or tar (optionally compressed) archive.
+    :param archive: archive file name
+    :type archive: str
+    :param members: glob pattern (or list of patterns) of the member names
+    :type members: str or list
+    :rtype: list
+    """
+    import zipfile
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
     else:
-        fh = codecs_open(filename, 'r', 'utf-8')
-    return fh
+        import tarfile
+        with tarfile.open(archive, 'r:*') as tf:
+            names = [info.name for info in tf if info.isfile()]
+    return filter_names(names, members)
 
 
-def tab_file_reader(filename, headline=True, fieldnames=None, gzip=False):
+def open_archive_member(archive, member, mode='rt', encoding='utf-8'):
+    """
+    Open member of a zip or tar (optionally compressed) archive for reading, without extracting it.
+    The member is decompressed as it is read, and so is its content if it is compressed itself (e.g. `x.tsv.gz`).
+
+    :param archive: archive file name
+    :type archive: str
+    :param member: member name
+    :type member: str
+    :param mode: 'rt' for text or 'rb' for binary file handle
+    :type mode: str
+    :param encoding: text encoding
+    :type encoding: str
+    :return: open file handle; closing it closes the archive
+    """
+    import zipfile
+    from .codec import open_compressed_stream
+    if zipfile.is_zipfile(archive):
+        # the archive file stays open until the member handle is closed
+        with zipfile.ZipFile(archive) as zf:
+            fh = zf.open(member)
+        return open_compressed_stream(fh, mode=mode, encoding=encoding)
+
+    import io
+    import tarfile
+    from .codec import _ChunkReader
+    tf = tarfile.open(archive, 'r:*')
+    try:
+        # members are read one by one up to the requested one, instead of indexing the whole archive first
+        for info in tf:
+            if info.name == member:
+                break
+        else:
+            raise KeyError('There is no member named {} in the archive {}'.format(member, archive))
+        member_fh = tf.extractfile(info)
+        if member_fh is None:
+            raise KeyError('Member {} of the archive {} is not a file'.format(member, archive))
+    except BaseException:
+        tf.close()
+        raise
+    raw = _ChunkReader(iter(lambda: member_fh.read(1 << 20), b''), close_callback=tf.close)
+    return open_compressed_stream(io.BufferedReader(raw, buffer_size=1 << 20), mode=mode, encoding=encoding)
+
+
+def open_file(filename, threads=None, member=None):
+    """
+    Open text file, whether compressed or not. Return open file handle.
+    Compression (gzip/BGZF, bz2, xz, zstd) is detected from the magic bytes of the file, not from its extension;
+    codecs are registered in `.codec`. BGZF files are decompressed in parallel blocks on a thread pool;
+    plain gzip files are decompressed serially, by `igzip` or `pigz` if enabled (see `.codec.GZIP_TOOL_ENV_VAR`).
+    :param filename: file name
+    :type filename: str
+    :param threads: number of decompression threads (all CPUs by default)
+    :type threads: int
+    :param member: name of the member to read, if the file is a zip or tar archive (see `open_archive_member()`)
+    :type member: str
+    :return: file handle opened in read-text mode
+    """
+    if member is not None:
+        return open_archive_member(filename, member)
+    return open_compressed(filename, mode='rt', encoding='utf-8', threads=threads)
+
+
+def tab_file_reader(filename, headline=True, fieldnames=None, gzip=False, threads=None, member=None):
     """
     Read tab-delimited file; create generator of dict dictionaries.
     :param filename: input file name
     :type filename: str
     :param headline: should we use the first line as the headline (containing field names)?
     :type headline: bool
-    :param gzip: is file gzipped?
+    :param gzip: is file gzipped? (kept for compatibility: compression is detected from the file content)
     :type gzip: bool
+    :param threads: number of decompression threads
+    :type threads: int
+    :param member: name of the member to read, if the file is a zip or tar archive
+    :type member: str
     :return: generator of dictionaries
     :rtype: generator
     """
-    if gzip:
-        fh = gzip_filehandle(filename)
-    else:
-        fh = codecs_open(filename, 'r', 'utf-8')
+    fh = open_file(filename, threads=threads, member=member)
     if headline:
         headline = next(fh)
         # fieldnames = headline.replace('#','').replace('-', '_').strip().split('\t')
@@ -92,28 +1057,139 @@ def tab_file_reader(filename, headline=True, fieldnames=None, gzip=False):
     fh.close()
 
 
-def run_shell_cmd(cmd):
+def tab_batch_reader(filename, columns=None, dtypes=None, batch_size=65536, headline=True, fieldnames=None,
+                     gzip=False, output='records', threads=None):
+    """
+    Read tab-delimited file in batches of projected, typed columns; see `TabBatchReader` for parameters.
+    :return: generator of batches
+    :rtype: generator
     """
-    Run piped commands in shell, return stdout and stderr of the last command in pipe
+    return iter(TabBatchReader(filename, columns=columns, dtypes=dtypes, batch_size=batch_size, headline=headline,
+                               fieldnames=fieldnames, gzip=gzip, output=output, threads=threads))
+
+
+def tab_file_writer(filename, fieldnames=None, headline=True, compress=None, level=6, threads=None, tmp_dir=None,
+                    buffer_size=1 << 22):
+    """
+    Open tab-delimited file for writing, see `TabFileWriter` for parameters.
+    :return: writer, to be closed (or used as a context manager)
+    :rtype: TabFileWriter
+    """
+    return TabFileWriter(filename, fieldnames=fieldnames, headline=headline, compress=compress, level=level,
+                         threads=threads, tmp_dir=tmp_dir, buffer_size=buffer_size)
+
+
+def tab_file_ranges(filename, chunk_size=1 << 24, headline=True):
+    """
+    Split uncompressed tab-delimited file into byte ranges aligned to line boundaries.
+    :param filename: input file name
+    :type filename: str
+    :param chunk_size: approximate size of one range in bytes
+    :type chunk_size: int
+    :param headline: does the first line contain field names? (if so, it is not included in any range)
+    :type headline: bool
+    :return: tuple (headline or None, list of (start, end) byte offsets)
+    :rtype: tuple
+    """
+    if detect_codec(filename) is not None:
+        raise ValueError('tab_file_ranges: compressed files can not be split: {}'.format(filename))
+    size = getsize(filename)
+    ranges = []
+    with open(filename, 'rb') as fh:
+        header = fh.readline().decode('utf-8') if headline else None
+        start = fh.tell()
+        while start < size:
+            fh.seek(min(start + chunk_size, size) - 1)
+            fh.readline()  # move to the end of the line containing the boundary
+            end = fh.tell()
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def _map_tab_range(filename, start, end, fieldnames, func):
+    """ Parse byte range of a tab-delimited file and apply `func` to each record; runs in a worker process. """
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        lines = fh.read(end - start).decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return [func(dict(zip(fieldnames, line.strip().split('\t')))) for line in lines]
+
+
+def parallel_map_tab(filename, func, workers=None, chunk_size=1 << 24, ordered=True, headline=True, fieldnames=None):
+    """
+    Apply `func` to every record of a tab-delimited file on a pool of worker processes.
+
+    The file is split into byte ranges aligned to line boundaries (see `tab_file_ranges()`); each worker reads and
+    parses its own range, so only the results travel between processes. Records are dicts, as from
+    `tab_file_reader()`. `func` must be picklable, i.e. defined at module level.
 
     # example:
-    >>> c = 'ls -al | cut -f1 | sed "s/|//"'
-    >>> sout, serror = run_shell_cmd(c)
-    >>> for line in sout:
-    >>>   print line,
+    >>> for length in parallel_map_tab('genes.tsv', gene_length, workers=32):
+    >>>   print(length)
+
+    :param filename: input file name (uncompressed)
+    :type filename: str
+    :param func: function applied to each record
+    :type func: callable
+    :param workers: number of worker processes (all CPUs by default)
+    :type workers: int
+    :param chunk_size: approximate size of one range in bytes
+    :type chunk_size: int
+    :param ordered: yield results in input order; otherwise, yield each range's results as soon as they are ready
+    :type ordered: bool
+    :param headline: should we use the first line as the headline (containing field names)?
+    :type headline: bool
+    :param fieldnames: field names, if file has no headline
+    :type fieldnames: list
+    :return: generator of `func` results
+    :rtype: generator
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    header, ranges = tab_file_ranges(filename, chunk_size=chunk_size, headline=headline)
+    if headline:
+        fieldnames = header.replace('#', '').strip().split('\t')
+    workers = workers or cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            # keep a bounded window of ranges in flight, so results do not pile up in memory
+            pending = deque()
+            for start, end in ranges:
+                pending.append(executor.submit(_map_tab_range, filename, start, end, fieldnames, func))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        else:
+            futures = [executor.submit(_map_tab_range, filename, start, end, fieldnames, func)
+                       for start, end in ranges]
+            for future in as_completed(futures):
+                yield from future.result()
+
+
+def _import_numpy():
+    """ Import NumPy, which is an optional dependency. """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('NumPy is required for this operation; install it with `pip install numpy`')
+    return numpy
+
 
+def split_shell_pipe(cmd):
+    """
+    Split piped command into the list of commands, each being a list of arguments.
     :param cmd: command
     :type cmd: str
-    :return:
-    :rtype:
+    :return: list of commands
+    :rtype: list
     """
+    from shlex import split as shlex_split
     tokens = shlex_split(cmd)
     length = len(tokens)
     start = 0
-    stop = 1000000
     l_cmds = []
-
-    # split list to the list of commands
     for _ in range(length):
         try:
             stop = tokens.index('|', start)
@@ -124,17 +1200,33 @@ def run_shell_cmd(cmd):
         start = stop + 1
         if stop == length:
             break
-    # run commands
-    n_cmd = len(l_cmds)  # number of commands in pipe
-    l_proc = []
-    for n in range(n_cmd):
-        if n == 0:  # first command
-            l_proc.append(Popen(l_cmds[n], stdout=PIPE, stderr=PIPE))
-        else:  # non-first (or last) command
-            l_proc.append(Popen(l_cmds[n], stdin=l_proc[n - 1].stdout, stdout=PIPE, stderr=PIPE))
+    return l_cmds
+
+
+def run_shell_cmd(cmd):
+    """
+    Run piped commands in shell, return stdout and stderr of the last command in pipe.
+    Stderr of the other commands is drained in background, but the two returned pipes are not: the caller must
+    read them concurrently (or read stdout to the end first, which blocks if the last command writes more than
+    a pipe buffer to stderr), and nothing waits for the commands to exit. Kept for compatibility; new code should
+    use `ShellPipeline`, which streams stdout lines, drains stderr, feeds stdin from a generator and returns exit
+    codes of all the commands.
+
+    # example:
+    >>> c = 'ls -al | cut -f1 | sed "s/|//"'
+    >>> sout, serror = run_shell_cmd(c)
+    >>> for line in sout:
+    >>>   print line,
+
+    :param cmd: command
+    :type cmd: str
+    :return:
+    :rtype:
+    """
+    pipe = ShellPipeline(cmd).start(drain_stderr=False)
     # get outputs
-    pipe_stdout = l_proc[n_cmd - 1].stdout
-    pipe_stderr = l_proc[n_cmd - 1].stderr
+    pipe_stdout = pipe.procs[-1].stdout
+    pipe_stderr = pipe.procs[-1].stderr
     return pipe_stdout, pipe_stderr
 
 
@@ -147,7 +1239,135 @@ def call_shell_cmd(cmd):
     :return: exit code
     :rtype: int
     """
-    call(cmd, shell=True)
+    from subprocess import call
+    return call(cmd, shell=True)
+
+
+def _open_job_output(filename):
+    from subprocess import DEVNULL
+    return open(filename, 'wb') if filename else DEVNULL
+
+
+def _kill_job(proc, timed_out):
+    from signal import SIGKILL
+    timed_out.append(True)
+    try:
+        killpg(proc.pid, SIGKILL)
+    except ProcessLookupError:
+        # the whole group has already exited
+        pass
+
+
+def _run_shell_job_once(job):
+    """ Run job once; return exit code, wall time, CPU time (user + system, with child processes), timeout flag. """
+    from subprocess import Popen, DEVNULL, STDOUT
+    stdout = _open_job_output(job.stdout)
+    if job.stderr and job.stdout and path.abspath(job.stderr) == path.abspath(job.stdout):
+        # one file for both streams: two handles would overwrite each other's output
+        stderr = STDOUT
+    else:
+        stderr = _open_job_output(job.stderr)
+    try:
+        start = monotonic()
+        # own process group, so that a timeout kills the whole command, not only the shell
+        proc = Popen(job.cmd, shell=True, stdin=DEVNULL, stdout=stdout, stderr=stderr, cwd=job.cwd, env=job.env,
+                     start_new_session=True)
+        timed_out = []
+        if job.timeout:
+            timer = Timer(job.timeout, _kill_job, (proc, timed_out))
+            timer.start()
+            # wait for the exit without reaping: until it is reaped, the pid (and the process group) can not be
+            # reused, so the timer can not kill an unrelated group; it is stopped before the process is reaped
+            waitid(P_PID, proc.pid, WEXITED | WNOWAIT)
+            timer.cancel()
+            timer.join()
+        _, status, rusage = wait4(proc.pid, 0)
+        proc.returncode = waitstatus_to_exitcode(status)
+        wall_time = monotonic() - start
+    finally:
+        for fh in (stdout, stderr):
+            if fh not in (DEVNULL, STDOUT):
+                fh.close()
+    return proc.returncode, wall_time, rusage.ru_utime + rusage.ru_stime, bool(timed_out)
+
+
+def run_shell_job(job):
+    """
+    Run shell job, re-running it up to `job.retries` times while it fails.
+    :param job: job
+    :type job: ShellJob
+    :return: result of the last attempt; wall and CPU times are summed over all attempts
+    :rtype: ShellJobResult
+    """
+    wall_time = cpu_time = 0.0
+    attempts = 0
+    while True:
+        attempts += 1
+        returncode, wall, cpu, timed_out = _run_shell_job_once(job)
+        wall_time += wall
+        cpu_time += cpu
+        if returncode == 0 or attempts > (job.retries or 0):
+            break
+    return ShellJobResult(job.name, job.cmd, returncode, wall_time, cpu_time, attempts, timed_out,
+                          job.stdout, job.stderr)
+
+
+def conf_threads(conf, default=None):
+    """
+    Return number of threads from the `threads` (or `THREADS`, if set from env var) config key.
+    :param conf: app configuration
+    :type conf: dict
+    :param default: default number of threads (all CPUs, if None)
+    :type default: int
+    :return: number of threads
+    :rtype: int
+    """
+    threads = None
+    if conf:
+        threads = conf.get('threads', conf.get('THREADS'))
+    if threads:
+        return int(threads)
+    return default or cpu_count() or 1
+
+
+def run_shell_jobs(jobs, threads=None, conf=None, timeout=None, retries=0, output_dir=None):
+    """
+    Run many independent shell commands, at most `threads` at a time.
+
+    # example:
+    >>> cmds = ['blastp -query {} -out {}.out'.format(f, f) for f in fasta_files]
+    >>> results = run_shell_jobs(cmds, conf=self.conf, timeout=3600, retries=1, output_dir=self.dir_log)
+    >>> failed = [r for r in results if r.returncode != 0]
+
+    :param jobs: commands (str) or `ShellJob` objects
+    :type jobs: list
+    :param threads: number of job slots; by default, the `threads` setting of `conf` or the number of CPUs
+    :type threads: int
+    :param conf: app configuration
+    :type conf: dict
+    :param timeout: default time limit of one job attempt, in seconds
+    :type timeout: float
+    :param retries: default number of re-runs of a failed job
+    :type retries: int
+    :param output_dir: if set, stdout/stderr of jobs are written to `<output_dir>/<name>.out|.err` by default
+    :type output_dir: str
+    :return: job results in the order of `jobs`
+    :rtype: list
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    jobs = [job if isinstance(job, ShellJob) else ShellJob(job) for job in jobs]
+    for n, job in enumerate(jobs):
+        job.name = job.name or 'job_{}'.format(n)
+        if job.timeout is None:
+            job.timeout = timeout
+        if job.retries is None:
+            job.retries = retries
+        if output_dir is not None:
+            job.stdout = job.stdout or path.join(output_dir, job.name + '.out')
+            job.stderr = job.stderr or path.join(output_dir, job.name + '.err')
+    threads = threads or conf_threads(conf)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(run_shell_job, jobs))
 
 
 def file_name_no_ext(f):
@@ -179,9 +1399,113 @@ def remove_dir(dirname):
     :param dirname: dir dirname
     :type dirname: str
     """
+    from shutil import rmtree
     rmtree(dirname, ignore_errors=True)
 
 
+def _remove_tree_parallel(dirname, threads=None):
+    """ Remove directory tree, removing its top-level subtrees in parallel. """
+    from concurrent.futures import ThreadPoolExecutor
+    entries = []
+    try:
+        entries = [path.join(dirname, e) for e in os.listdir(dirname)]
+    except OSError:
+        pass
+    dirs = [e for e in entries if path.isdir(e) and not path.islink(e)]
+    for e in entries:
+        if e not in dirs:
+            remove_file(e)
+    if dirs:
+        with ThreadPoolExecutor(max_workers=threads or _transfer_threads()) as executor:
+            list(executor.map(remove_dir, dirs))
+    remove_dir(dirname)
+
+
+def remove_dir_background(dirname, mode='process', trash_dir=None, threads=None):
+    """
+    Remove directory tree in background.
+
+    The directory is first renamed aside (to a hidden name in `trash_dir`), so its path is free immediately;
+    the renamed tree is then deleted either by a detached `rm -rf` process that outlives the caller (mode 'process'),
+    or by a thread removing subtrees in parallel (mode 'thread'; the interpreter waits for it on exit).
+    Use `wait_for_cleanup()` to wait until all background removals are done.
+
+    :param dirname: directory to remove
+    :type dirname: str
+    :param mode: 'process' or 'thread'
+    :type mode: str
+    :param trash_dir: directory to rename the tree to, on the same filesystem (parent of `dirname` by default)
+    :type trash_dir: str
+    :param threads: number of threads in 'thread' mode
+    :type threads: int
+    :return: True if the directory was renamed aside and is being removed
+    :rtype: bool
+    """
+    from subprocess import Popen, DEVNULL
+    if mode not in ('process', 'thread'):
+        raise ValueError('remove_dir_background: no such mode: {}'.format(mode))
+    # reap the removals that are already done, so that their `rm` processes do not stay zombies
+    _reap_cleanups()
+    dirname = path.abspath(dirname)
+    trash_dir = trash_dir or path.dirname(dirname)
+    trash = path.join(trash_dir, '.{}.trash.{}.{}'.format(path.basename(dirname), getpid(), int(monotonic() * 1e6)))
+    try:
+        rename_file(dirname, trash)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # e.g. trash_dir is on another filesystem: remove in place
+        remove_dir(dirname)
+        return False
+    if mode == 'process':
+        worker = Popen(['rm', '-rf', trash], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+    else:
+        worker = Thread(target=_remove_tree_parallel, args=(trash, threads))
+        worker.start()
+    with _background_cleanups_lock:
+        _background_cleanups.append(worker)
+    return True
+
+
+def wait_for_cleanup(timeout=None):
+    """
+    Wait until all the background removals started by `remove_dir_background()` are done.
+    :param timeout: timeout for each removal, in seconds; removals still running after it are waited for later
+    :type timeout: float
+    """
+    _reap_cleanups(timeout)
+
+
+def _cleanup_done(worker, timeout):
+    """
+    Wait up to `timeout` seconds (until done, if None) for the background removal; return True if it is done.
+    A finished `rm` process is reaped, and its nonzero exit code is logged.
+    """
+    from subprocess import TimeoutExpired
+    if isinstance(worker, Thread):
+        worker.join(timeout)
+        return not worker.is_alive()
+    try:
+        returncode = worker.wait(timeout)
+    except TimeoutExpired:
+        return False
+    if returncode != 0:
+        import logging
+        logging.getLogger(__name__).warning('Background removal of {} failed with exit code {}'.format(
+            worker.args[-1], returncode))
+    return True
+
+
+def _reap_cleanups(timeout=0):
+    """ Forget the finished background removals (see `_cleanup_done()`); keep the handles of the running ones. """
+    with _background_cleanups_lock:
+        workers = list(_background_cleanups)
+        del _background_cleanups[:]
+    running = [worker for worker in workers if not _cleanup_done(worker, timeout)]
+    with _background_cleanups_lock:
+        _background_cleanups[:0] = running
+
+
 def remove_file(filename):
     """
     Delete one file.
@@ -194,36 +1518,214 @@ def remove_file(filename):
         pass
 
 
-def move_files(src_files_path, dst):
+def _copy_file_data(src, dst):
+    """
+    Copy file content with the cheapest method available: reflink, `copy_file_range`, `sendfile`, plain copy.
+    :return: method used
+    :rtype: str
+    """
+    from shutil import copyfileobj
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fd_in, fd_out = fsrc.fileno(), fdst.fileno()
+        try:
+            _reflink_fd(fd_in, fd_out)
+            return 'reflink'
+        except OSError:
+            pass
+        size = stat(fd_in).st_size
+        for method, copy_range in (('copy_file_range', getattr(os, 'copy_file_range', None)),
+                                   ('sendfile', getattr(os, 'sendfile', None))):
+            if copy_range is None:
+                continue
+            copied = 0
+            try:
+                while copied < size:
+                    if method == 'sendfile':
+                        n = copy_range(fd_out, fd_in, copied, size - copied)
+                    else:
+                        n = copy_range(fd_in, fd_out, size - copied, copied, copied)
+                    if n == 0:
+                        break
+                    copied += n
+                return method
+            except OSError:
+                if copied:
+                    raise
+        copyfileobj(fsrc, fdst, 1 << 20)
+        return 'copy'
+
+
+def transfer_file(src, dst, move=False, link=False):
+    """
+    Copy or move one file using the cheapest method available: rename (move only), hard link (if `link` is True),
+    reflink, `copy_file_range`, `sendfile`, and, finally, plain copy. Copies are written to a temporary file next to
+    `dst`, which is renamed to `dst` when it is complete. Directories are moved/copied with `shutil`.
+    :param src: source file name
+    :type src: str
+    :param dst: destination file name
+    :type dst: str
+    :param move: remove the source file
+    :type move: bool
+    :param link: allow hard-linking the copy to the source (they will share the content)
+    :type link: bool
+    :return: tuple (method used, number of bytes)
+    :rtype: tuple
+    """
+    from shutil import copystat
+    from tempfile import mkstemp
+    if path.isdir(src):
+        size = _tree_size(src)
+        if move:
+            move_dir(src, dst)
+            return 'move', size
+        copy_dir(src, dst)
+        return 'copy', size
+    size = getsize(src)
+    if move:
+        try:
+            rename_file(src, dst)
+            return 'rename', size
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    elif link:
+        try:
+            remove_file(dst)
+            hardlink(src, dst)
+            return 'link', size
+        except OSError:
+            pass
+    # a crash or an error in the middle of the copy must not leave a partial file under the final name
+    fd, partial = mkstemp(dir=path.dirname(path.abspath(dst)), prefix='.{}.'.format(path.basename(dst)), suffix='.tmp')
+    os.close(fd)
+    try:
+        method = _copy_file_data(src, partial)
+        copystat(src, partial)
+        replace_file(partial, dst)
+    except BaseException:
+        remove_file(partial)
+        raise
+    if move:
+        remove(src)
+    return method, size
+
+
+def _new_file_mode():
+    """ Return permissions of a new file under the umask of the process. """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def fsync_paths(filenames, threads=None):
+    """
+    Flush files and their directories to disk, each directory only once; directories in `filenames` are flushed
+    together with their parent directories.
+    :param filenames: file names
+    :type filenames: list
+    :param threads: number of threads
+    :type threads: int
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fsync_path(fname):
+        fd = os.open(fname, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    files = [f for f in filenames if not path.isdir(f)]
+    dirs = set(path.dirname(path.abspath(f)) for f in filenames)
+    dirs.update(path.abspath(f) for f in filenames if path.isdir(f))
+    dirs = sorted(dirs)
+    with ThreadPoolExecutor(max_workers=threads or _transfer_threads()) as executor:
+        list(executor.map(fsync_path, files))
+    for d in dirs:
+        fsync_path(d)
+
+
+def _tree_size(dirname):
+    """ Return total size of the files in the directory tree. """
+    return sum(os.lstat(path.join(root, fname)).st_size for root, _, files in walk(dirname) for fname in files)
+
+
+def _transfer_threads():
+    return min(8, cpu_count() or 1)
+
+
+def _transfer_files(src_files_path, dst, move, link=False, threads=None, fsync=False, skip_existing=False):
+    from shutil import Error as shutil_Error
+    from concurrent.futures import ThreadPoolExecutor
+    start = monotonic()
+    src_files = glob(src_files_path)
+    dst_is_dir = path.isdir(dst)
+    pairs = []
+    for fsrc in src_files:
+        fdst = path.join(dst, path.basename(fsrc)) if dst_is_dir else dst
+        if skip_existing and dst_is_dir and path.exists(fdst):
+            continue
+        pairs.append((fsrc, fdst))
+
+    def transfer(pair):
+        try:
+            return transfer_file(pair[0], pair[1], move=move, link=link)
+        except (shutil_Error, OSError) as e:
+            raise shutil_Error('Error {} file {} to {}: {}'.format('moving' if move else 'copying',
+                                                                   pair[0], pair[1], e))
+
+    threads = threads or _transfer_threads()
+    # several files to one destination file: the last one wins, so they are transferred in order
+    if threads > 1 and len(pairs) > 1 and dst_is_dir:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(transfer, pairs))
+    else:
+        results = [transfer(pair) for pair in pairs]
+    if fsync and pairs:
+        fsync_paths([fdst for _, fdst in pairs], threads=threads)
+    methods = defaultdict(int)
+    for method, _ in results:
+        methods[method] += 1
+    return TransferSummary(len(results), sum(size for _, size in results), dict(methods), monotonic() - start)
+
+
+def move_files(src_files_path, dst, threads=None, fsync=False):
     """
     move source file(s) to the destination
+    Files are renamed when possible; across filesystems, they are copied with the cheapest method available
+    (see `transfer_file()`) on `threads` threads. Files that already exist in the destination directory are skipped.
     :param src_files_path: source path (with wildcard)
     :type src_files_path: str
     :param dst: destination path
     :type dst: str
+    :param threads: number of threads
+    :type threads: int
+    :param fsync: flush moved files and destination directories to disk when all files are moved
+    :type fsync: bool
+    :return: summary: number of files and bytes moved, count of each method used, time spent
+    :rtype: TransferSummary
     """
-    src_files = glob(src_files_path)
-    for fsrc in src_files:
-        try:
-            move(fsrc, dst)
-        except shutil_Error:
-            pass
+    return _transfer_files(src_files_path, dst, move=True, threads=threads, fsync=fsync, skip_existing=True)
 
 
-def copy_files(src_files_path, dst):
+def copy_files(src_files_path, dst, threads=None, fsync=False, link=False):
     """
     copy source file(s) to the destination
+    Files are copied with the cheapest method available (see `transfer_file()`) on `threads` threads.
     :param src_files_path: source path (file name or path with wildcard)
     :type src_files_path: str
     :param dst: destination path; if directory, files will be copied in it
     :type dst: str
+    :param threads: number of threads
+    :type threads: int
+    :param fsync: flush copied files and destination directories to disk when all files are copied
+    :type fsync: bool
+    :param link: hard-link copies to the source files, when possible
+    :type link: bool
+    :return: summary: number of files and bytes copied, count of each method used, time spent
+    :rtype: TransferSummary
     """
-    src_files = glob(src_files_path)
-    for fsrc in src_files:
-        try:
-            copy2(fsrc, dst)
-        except shutil_Error:
-            raise shutil_Error('Error copying file ' + fsrc + ' to ' + dst)
+    return _transfer_files(src_files_path, dst, move=False, link=link, threads=threads, fsync=fsync)
 
 
 def move_dir(src, dst):
@@ -234,6 +1736,7 @@ def move_dir(src, dst):
     :param dst: destination path
     :type dst: str
     """
+    from shutil import move
     try:
         move(src, dst)
     except OSError as e:
@@ -245,6 +1748,7 @@ def move_dir(src, dst):
 
 
 def copy_dir(src, dest):
+    from shutil import copytree
     try:
         copytree(src, dest)
     except OSError as e:
@@ -268,6 +1772,106 @@ def copy_dir(src, dest):
             run_shell_cmd(cmd)
 
 
+def _reflink_fd(fd_src, fd_dst):
+    from fcntl import ioctl
+    ficlone = 0x40049409
+    ioctl(fd_dst, ficlone, fd_src)
+
+
+def reflink_file(src, dst):
+    """
+    Create copy-on-write clone of the file (Linux FICLONE ioctl; supported by e.g. btrfs, xfs).
+    Raises OSError if the filesystem does not support it.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            _reflink_fd(fsrc.fileno(), fdst.fileno())
+        except OSError:
+            fdst.close()
+            remove_file(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """
+    Put file `src` to `dst` as cheaply as possible: hard link, then reflink, then copy.
+    :param src: source file name
+    :type src: str
+    :param dst: destination file name
+    :type dst: str
+    :return: method used: 'link', 'reflink' or 'copy'
+    :rtype: str
+    """
+    from shutil import copy2
+    remove_file(dst)
+    try:
+        hardlink(src, dst)
+        return 'link'
+    except OSError:
+        pass
+    try:
+        reflink_file(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    copy2(src, dst)
+    return 'copy'
+
+
+def file_checksum(filename, algorithm='sha256', block_size=1 << 20):
+    """
+    Return hex digest of the file content.
+    :param filename: file name
+    :type filename: str
+    :param algorithm: any algorithm supported by `hashlib`
+    :type algorithm: str
+    :param block_size: read block size
+    :type block_size: int
+    :return: hex digest
+    :rtype: str
+    """
+    import hashlib
+    h = hashlib.new(algorithm)
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_hash(filename, block_size=1 << 20):
+    """ Return fast 128-bit content hash (BLAKE2b) of the file. """
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_files(filenames, threads=None, cache=None):
+    """
+    Return size, mtime and content hash of the files; hashes are computed on a thread pool
+    (hashlib releases the GIL), files found in `cache` are not read at all.
+    :param filenames: file names
+    :type filenames: list
+    :param threads: number of threads
+    :type threads: int
+    :param cache: hash cache
+    :type cache: FileHashCache
+    :return: dict file name -> (size, mtime in ns, hash)
+    :rtype: dict
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    cache = cache if cache is not None else FileHashCache()
+    stats = {f: stat(f) for f in filenames}
+    to_hash = [f for f, st in stats.items() if cache.get(st) is None]
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=threads or _transfer_threads()) as executor:
+            for f, digest in zip(to_hash, executor.map(file_hash, to_hash)):
+                cache.set(stats[f], digest)
+    return {f: (st.st_size, st.st_mtime_ns, cache.get(st)) for f, st in stats.items()}
+
+
 def is_non_zero_file(fpath):
     """ Check if file exists and is non-zero length. """
     return isfile(fpath) and getsize(fpath) > 0
@@ -289,48 +1893,180 @@ def _ftp_split_path(fname):
     return host, pathname, filename
 
 
-def ftp_glob(dirname):
+def ftp_pool():
+    """ Return the default (process-wide) FTP connection pool. """
+    import atexit
+    global _ftp_pool
+    with _ftp_pool_lock:
+        if _ftp_pool is None:
+            _ftp_pool = FTPConnectionPool()
+            atexit.register(_ftp_pool.close)
+    return _ftp_pool
+
+
+def ftp_glob(dirname, pool=None):
     """
     return list of files/dirs that correspond to the wildcard-containing dirname
     :param dirname: ftp dirname to file/dir
     :type dirname: str
+    :param pool: FTP connection pool (the default pool, if None)
+    :type pool: FTPConnectionPool
     :return: list of files/dirs
     :rtype: list
     """
+    import ftplib
     f = dirname.replace("ftp://", "")
     host, fpath = f.split("/", 1)
     fpath = "/" + fpath
-    ftp = ftplib.FTP(host)
-    ftp.login()
+    pool = pool or ftp_pool()
     try:
-        files = ftp.nlst(fpath)
-    except:
+        with pool.connection(host) as ftp:
+            files = ftp.nlst(fpath)
+    except ftplib.all_errors:
         files = None
     return files
 
 
-def ftp_get_file(fname, fout):
+def _ftp_remote_size(ftp, remote_path):
+    import ftplib
+    try:
+        return ftp.size(remote_path)
+    except ftplib.error_perm:
+        return None  # server does not support SIZE
+
+
+def _ftp_remote_mtime(ftp, remote_path):
+    import ftplib
+    try:
+        return ftp.sendcmd('MDTM ' + remote_path).split()[-1]
+    except ftplib.error_perm:
+        return None  # server does not support MDTM
+
+
+def ftp_stat(fname, pool=None):
     """
-    download file via ftp
+    Return size and modification time of the remote file; either can be None if the server does not report it.
+    :param fname: ftp path to file
+    :type fname: str
+    :param pool: FTP connection pool (the default pool, if None)
+    :type pool: FTPConnectionPool
+    :return: tuple (size, mtime as YYYYMMDDHHMMSS string)
+    :rtype: tuple
     """
     hostname, pathname, fin = _ftp_split_path(fname)
-    ftp = ftplib.FTP(hostname)
-    ftp.login()
-    ftp.cwd(pathname)
+    remote_path = pathname + '/' + fin
+    pool = pool or ftp_pool()
+    with pool.connection(hostname) as ftp:
+        ftp.voidcmd('TYPE I')
+        size = _ftp_remote_size(ftp, remote_path)
+        mtime = _ftp_remote_mtime(ftp, remote_path)
+    return size, mtime
+
+
+def _read_text(filename):
     try:
-        ftp.retrbinary("RETR " + fin, open(fout, 'wb').write)
-    except:
-        print("Error downloading file:", fin)
-        remove_dir(fout)
+        with open(filename) as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+def ftp_get_file(fname, fout, pool=None, resume=True, retries=2):
+    """
+    download file via ftp
+
+    The file is downloaded to `<fout>.part` and renamed to `fout` only when it is complete (its size is verified
+    against the remote size, when the server reports it), so an existing `fout` is never appended to.
+    The remote size and modification time are saved in `<fout>.part.stamp`; an interrupted transfer is resumed
+    from the size of the partial file (with `REST`), both between attempts and between calls, only if the remote
+    file has not changed since, otherwise it is downloaded again from the start.
+
+    :param fname: ftp path to file
+    :type fname: str
+    :param fout: output file name
+    :type fout: str
+    :param pool: FTP connection pool (the default pool, if None)
+    :type pool: FTPConnectionPool
+    :param resume: resume download of a partial file; otherwise, partial file is deleted on failure
+    :type resume: bool
+    :param retries: how many times to retry failed download
+    :type retries: int
+    :return: True if the file was downloaded
+    :rtype: bool
+    """
+    import ftplib
+    hostname, pathname, fin = _ftp_split_path(fname)
+    remote_path = pathname + '/' + fin
+    part = fout + '.part'
+    stamp_file = part + '.stamp'
+    pool = pool or ftp_pool()
+    error = None
+    for _ in range(retries + 1):
+        try:
+            with pool.connection(hostname) as ftp:
+                ftp.voidcmd('TYPE I')
+                size = _ftp_remote_size(ftp, remote_path)
+                stamp = '{}\t{}\n'.format(size, _ftp_remote_mtime(ftp, remote_path))
+                offset = 0
+                # a partial file of unknown size can not be verified, so it is not resumed
+                if resume and size is not None and isfile(part) and _read_text(stamp_file) == stamp:
+                    offset = getsize(part)
+                    if offset > size:
+                        offset = 0
+                if not offset:
+                    with open(stamp_file, 'w') as fh:
+                        fh.write(stamp)
+                if size is None or offset < size:
+                    with open(part, 'ab' if offset else 'wb') as fh:
+                        ftp.retrbinary('RETR ' + remote_path, fh.write, rest=offset or None)
+            if size is None or getsize(part) == size:
+                replace_file(part, fout)
+                remove_file(stamp_file)
+                return True
+            error = 'size mismatch: expected {} bytes, got {}'.format(size, getsize(part))
+        except ftplib.all_errors as e:
+            error = e
+    print("Error downloading file:", fin, error)
+    if not resume:
+        remove_file(part)
+        remove_file(stamp_file)
+    return False
+
+
+def ftp_get_files(fnames, dst_dir, threads=8, pool=None, resume=True, retries=2):
+    """
+    download many files via ftp concurrently, reusing pooled connections
+    :param fnames: ftp paths to files
+    :type fnames: list
+    :param dst_dir: output directory
+    :type dst_dir: str
+    :param threads: number of concurrent downloads
+    :type threads: int
+    :param pool: FTP connection pool (the default pool, if None)
+    :type pool: FTPConnectionPool
+    :param resume: resume download of partial files
+    :type resume: bool
+    :param retries: how many times to retry failed download
+    :type retries: int
+    :return: dict ftp path -> True if the file was downloaded
+    :rtype: dict
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    pool = pool or ftp_pool()
+    make_dir(dst_dir)
+
+    def get_file(fname):
+        fout = path.join(dst_dir, _ftp_split_path(fname)[2])
+        return ftp_get_file(fname, fout, pool=pool, resume=resume, retries=retries)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return dict(zip(fnames, executor.map(get_file, fnames)))
 
 
-def get_gzip_filehandle(fname):
+def get_gzip_filehandle(fname, threads=None):
     """
     Return file handle for the gzip file opened in read-text mode.
     """
-    from gzip import open as gz_open
-    # fh = gz_open(fname, 'rt')
-    fh = gz_open(filename=fname, mode='rt', encoding='utf-8')
-    return fh
+    return open_file(fname, threads=threads)
 
 # endregion
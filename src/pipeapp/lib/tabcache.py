@@ -0,0 +1,346 @@
+"""
+Binary columnar cache of tab-delimited files: parse a file once, memory-map its columns afterwards
+"""
+
+# region: imports
+import os
+import json
+from os import path, stat, getpid
+from mmap import mmap, ACCESS_READ
+
+from .shell import full_path, make_dir, remove_dir, open_file, TabBatchReader, _import_numpy
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+FORMAT_VERSION = 1
+# dtype -> (array typecode of the stored values, NumPy dtype); str/category columns store int32 codes of labels
+storage_types = {
+    'int': ('q', '<i8'),
+    'float': ('d', '<f8'),
+    'str': ('i', '<i4'),
+    'category': ('i', '<i4'),
+}
+# endregion
+
+
+# region: classes
+class LabelTable:
+    """
+    Labels of a dictionary-encoded column: UTF-8 blob of all labels and an array of their offsets, memory-mapped.
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+        self._codes = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, code):
+        return bytes(self._blob[self._offsets[code]:self._offsets[code + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for code in range(len(self)):
+            yield self[code]
+
+    def code(self, label):
+        """ Return code of the label (e.g. to filter NumPy codes: `col.codes == col.labels.code('+')`), or None. """
+        if self._codes is None:
+            self._codes = {label: code for code, label in enumerate(self)}
+        return self._codes.get(label)
+
+
+class DictColumn:
+    """
+    Column of strings stored as integer codes (`codes`) of the labels (`labels`).
+    """
+
+    def __init__(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.labels[int(c)] for c in self.codes[i]]
+        return self.labels[int(self.codes[i])]
+
+    def __iter__(self):
+        labels = list(self.labels)
+        for c in self.codes:
+            yield labels[c]
+
+
+class _Map:
+    """
+    Memory map with the memoryviews exported from it: they must be released before the map is closed.
+    """
+
+    def __init__(self, m):
+        self.m = m
+        self.views = []
+
+    def view(self, view=None):
+        view = memoryview(self.m) if view is None else view
+        self.views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        try:
+            self.m.close()
+        except BufferError:
+            # the caller still holds slices of the columns: the map is closed when they are garbage collected
+            pass
+
+
+class TabColumns:
+    """
+    Columns of a tab-delimited file loaded from `TabColumnCache`.
+
+    Numeric columns are memory-mapped arrays (NumPy arrays, or memoryviews with the 'array' backend);
+    str and category columns are `DictColumn`s. Nothing is parsed when the columns are loaded.
+
+    # example:
+    >>> with TabColumnCache('/scratch/tab_cache').load('genes.tsv', dtypes={'len': int}) as cols:
+    >>>   print(cols.nrows, sum(cols['len']), cols['id'][0])
+    """
+
+    def __init__(self, meta, columns, maps):
+        self.meta = meta
+        self.nrows = meta['nrows']
+        self._columns = columns
+        self._maps = maps
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def keys(self):
+        return self._columns.keys()
+
+    def iter_records(self):
+        """ Iterate over rows as dicts, as `tab_file_reader()` does (but with typed values). """
+        names = list(self._columns)
+        for values in zip(*[self._columns[name] for name in names]):
+            yield dict(zip(names, values))
+
+    def close(self):
+        self._columns = {}
+        for m in self._maps:
+            m.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TabColumnCache:
+    """
+    Binary columnar cache of tab-delimited files.
+
+    The first `load()` of a file parses it once (see `TabBatchReader`) and saves each requested column as a binary
+    array: int and float values as int64/float64, str and category values as int32 codes plus a table of labels.
+    Later loads memory-map the arrays, without parsing or decoding anything. Entries are keyed by the source file
+    (inode, size and mtime) and the requested columns and dtypes, so a changed file is parsed again.
+    The 'numpy' backend saves columns as .npy files and returns NumPy arrays; the 'array' backend needs no NumPy.
+
+    # example:
+    >>> cache = TabColumnCache(path.join(self.dir_tmp, 'tab_cache'))
+    >>> cols = cache.load('hits.tsv', columns=['query', 'target', 'evalue'], dtypes={'evalue': float})
+    """
+    backends = ('numpy', 'array')
+
+    def __init__(self, cache_dir, backend=None):
+        """
+        :param cache_dir: cache directory
+        :type cache_dir: str
+        :param backend: 'numpy' or 'array' (by default, 'numpy' if NumPy is installed)
+        :type backend: str
+        """
+        if backend is None:
+            from importlib.util import find_spec
+            backend = 'numpy' if find_spec('numpy') is not None else 'array'
+        if backend not in self.backends:
+            raise ValueError('TabColumnCache: no such backend: {}'.format(backend))
+        self.cache_dir = full_path(cache_dir)
+        self.backend = backend
+        make_dir(self.cache_dir)
+
+    def key(self, filename, columns=None, dtypes=None, headline=True, fieldnames=None):
+        """ Cache key of the file and the requested columns. """
+        import hashlib
+        st = stat(filename)
+        spec = [FORMAT_VERSION, self.backend, path.realpath(filename), st.st_dev, st.st_ino, st.st_size,
+                st.st_mtime_ns, columns, sorted((dtypes or {}).items()), headline, fieldnames]
+        return hashlib.sha256(json.dumps(spec).encode('utf-8')).hexdigest()[:32]
+
+    def load(self, filename, columns=None, dtypes=None, headline=True, fieldnames=None, threads=None):
+        """
+        Load columns of the tab-delimited file, parsing it only if it is not in the cache yet.
+
+        :param filename: tab-delimited file name (may be compressed)
+        :type filename: str
+        :param columns: names of the columns (all columns by default)
+        :type columns: list
+        :param dtypes: column name -> dtype; dtype is one of int, float, str or 'category' (str by default)
+        :type dtypes: dict
+        :param headline: should we use the first line as the headline (containing field names)?
+        :type headline: bool
+        :param fieldnames: field names, if file has no headline
+        :type fieldnames: list
+        :param threads: number of decompression threads
+        :type threads: int
+        :return: columns
+        :rtype: TabColumns
+        """
+        columns = list(columns) if columns else None
+        dtypes = {col: TabBatchReader._dtype_name(dt) for col, dt in (dtypes or {}).items()}
+        entry_dir = path.join(self.cache_dir, self.key(filename, columns, dtypes, headline, fieldnames))
+        if not path.exists(path.join(entry_dir, 'meta.json')):
+            self._build(entry_dir, filename, columns, dtypes, headline, fieldnames, threads)
+        return self._load(entry_dir)
+
+    def _build(self, entry_dir, filename, columns, dtypes, headline, fieldnames, threads):
+        from array import array
+        columns = self._fieldnames(filename, columns, headline, fieldnames)
+        column_dtypes = {col: dtypes.get(col, 'str') for col in columns}
+        # str columns are read as categories: dictionary-encoded while they are parsed
+        reader = TabBatchReader(filename, columns=columns, headline=headline, fieldnames=fieldnames,
+                                output='columns', threads=threads,
+                                dtypes={col: dt if dt in ('int', 'float') else 'category'
+                                        for col, dt in column_dtypes.items()})
+        values = {col: array(storage_types[dt][0]) for col, dt in column_dtypes.items()}
+        nrows = 0
+        if columns:
+            for batch in reader:
+                for col, batch_values in batch.items():
+                    values[col].extend(batch_values)
+                nrows += len(batch[columns[0]])
+        labels = {col: reader.categories.get(col, []) for col, dt in column_dtypes.items()
+                  if dt not in ('int', 'float')}
+
+        tmp_dir = '{}.{}.tmp'.format(entry_dir, getpid())
+        make_dir(tmp_dir)
+        meta = {'version': FORMAT_VERSION, 'backend': self.backend, 'source': path.realpath(filename),
+                'nrows': nrows, 'columns': []}
+        try:
+            for i, (col, arr) in enumerate(values.items()):
+                dtype = column_dtypes[col]
+                meta['columns'].append({'name': col, 'dtype': dtype, 'file': str(i)})
+                self._save_array(path.join(tmp_dir, str(i)), arr, storage_types[dtype][1])
+                if col in labels:
+                    encoded = [label.encode('utf-8') for label in labels[col]]
+                    blob = b''.join(encoded)
+                    offsets = array('Q', [0])
+                    pos = 0
+                    for label in encoded:
+                        pos += len(label)
+                        offsets.append(pos)
+                    with open(path.join(tmp_dir, '{}.labels'.format(i)), 'wb') as fh:
+                        fh.write(blob)
+                    with open(path.join(tmp_dir, '{}.offsets'.format(i)), 'wb') as fh:
+                        offsets.tofile(fh)
+            with open(path.join(tmp_dir, 'meta.json'), 'w') as fh:
+                json.dump(meta, fh)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # another process has built the same entry meanwhile
+                pass
+        finally:
+            if path.exists(tmp_dir):
+                remove_dir(tmp_dir)
+
+    @staticmethod
+    def _fieldnames(filename, columns, headline, fieldnames):
+        if columns:
+            return columns
+        if headline:
+            with open_file(filename) as fh:
+                line = fh.readline()
+            return line.replace('#', '').strip().split('\t') if line else []
+        return list(fieldnames)
+
+    def _save_array(self, filename, arr, numpy_dtype):
+        if self.backend == 'numpy':
+            numpy = _import_numpy()
+            numpy.save(filename + '.npy', numpy.frombuffer(arr, dtype=numpy_dtype) if len(arr) else
+                       numpy.zeros(0, dtype=numpy_dtype))
+        else:
+            with open(filename, 'wb') as fh:
+                arr.tofile(fh)
+
+    def _load(self, entry_dir):
+        with open(path.join(entry_dir, 'meta.json')) as fh:
+            meta = json.load(fh)
+        columns, maps = {}, []
+        for col in meta['columns']:
+            filename = path.join(entry_dir, col['file'])
+            typecode, numpy_dtype = storage_types[col['dtype']]
+            if self.backend == 'numpy':
+                numpy = _import_numpy()
+                data = numpy.load(filename + '.npy', mmap_mode='r' if meta['nrows'] else None)
+            else:
+                data = _map_array(filename, typecode, maps)
+            if col['dtype'] in ('int', 'float'):
+                columns[col['name']] = data
+            else:
+                labels = LabelTable(_map_bytes(filename + '.labels', maps),
+                                    _map_array(filename + '.offsets', 'Q', maps))
+                columns[col['name']] = DictColumn(data, labels)
+        return TabColumns(meta, columns, maps)
+
+    def clear(self):
+        """ Remove all the cached files. """
+        remove_dir(self.cache_dir)
+        make_dir(self.cache_dir)
+
+
+# endregion
+
+
+# region: functions
+def _map_bytes(filename, maps):
+    """ Memory-map the file read-only; return a memoryview of it (empty for an empty file). """
+    with open(filename, 'rb') as fh:
+        if not stat(fh.fileno()).st_size:
+            return memoryview(b'')
+        m = _Map(mmap(fh.fileno(), 0, access=ACCESS_READ))
+    maps.append(m)
+    return m.view()
+
+
+def _map_array(filename, typecode, maps):
+    """ Memory-map array of `typecode` items saved with `array.tofile()`. """
+    view = _map_bytes(filename, maps)
+    if not len(view):
+        return memoryview(b'').cast(typecode)
+    return maps[-1].view(view.cast(typecode))
+
+
+def tab_columns(filename, cache_dir, columns=None, dtypes=None, headline=True, fieldnames=None, backend=None,
+                threads=None):
+    """
+    Load columns of the tab-delimited file through the columnar cache in `cache_dir`;
+    see `TabColumnCache.load()` for parameters.
+    :rtype: TabColumns
+    """
+    return TabColumnCache(cache_dir, backend=backend).load(filename, columns=columns, dtypes=dtypes,
+                                                           headline=headline, fieldnames=fieldnames, threads=threads)
+
+# endregion
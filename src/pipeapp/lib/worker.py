@@ -0,0 +1,491 @@
+"""
+Warm worker daemon: runs apps in processes forked from a parent that has already imported them
+"""
+
+# region: imports
+import os
+import sys
+import json
+import signal
+import socket
+import struct
+import logging
+from os import path, getenv
+from select import select
+from time import monotonic
+from importlib import import_module
+from argparse import ArgumentParser
+# endregion
+
+# region: constants
+__author__ = 'David Managadze'
+SOCKET_ENV_VAR = 'PIPEAPP_WORKER_SOCKET'
+FALLBACK_ENV_VAR = 'PIPEAPP_WORKER_FALLBACK'
+REQUEST_TIMEOUT = 10  # seconds a client may take to send its request
+HEADER = struct.Struct('<I')  # length of the JSON request that follows
+# apps the daemon preloads by default: name -> 'module:Class'
+default_apps = {
+    'example_app': 'pipeapp.apps.example_app:ExampleApp',
+}
+# modules that the library imports lazily; importing them once in the daemon saves it in every job
+default_preload = ('subprocess', 'shutil', 'json', 'hashlib', 'concurrent.futures', 'yaml')
+# endregion
+
+# region: variables
+_log = logging.getLogger(__name__)
+# endregion
+
+
+# region: classes
+class WorkerServer:
+    """
+    Daemon that imports the apps once and runs each job in a process forked from itself.
+
+    Jobs are requested over a Unix socket (see `WorkerClient`). A job is run in a new process group,
+    in the working directory and environment of the client, with the client's stdin/stdout/stderr
+    (passed over the socket), so it behaves as if the app had been started from the client's command line.
+    If the client goes away, the job is killed. At most `workers` jobs run at once; the other clients wait.
+
+    # example:
+    >>> WorkerServer('/tmp/pipeapp.sock', apps={'example_app': 'pipeapp.apps.example_app:ExampleApp'}).serve_forever()
+    """
+
+    def __init__(self, socket_path=None, apps=None, workers=None, preload=default_preload):
+        """
+        :param socket_path: Unix socket path (env var PIPEAPP_WORKER_SOCKET or a per-user path in /tmp by default)
+        :type socket_path: str
+        :param apps: app name -> BasicApp subclass or 'module:Class'
+        :type apps: dict
+        :param workers: max number of jobs running at once (all CPUs by default)
+        :type workers: int
+        :param preload: names of the modules to import in advance; the missing ones are ignored
+        :type preload: tuple
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.apps = {name: load_app(app) for name, app in (apps or default_apps).items()}
+        for module in preload:
+            try:
+                import_module(module)
+            except ImportError:
+                pass
+        self.workers = workers or os.cpu_count() or 1
+        self.jobs = {}  # pid -> [connection (None, if the client is gone), app name, start time]
+        self._sock = None
+        self._wakeup = None
+        self._stopping = False
+
+    def _bind(self):
+        if path.exists(self.socket_path):
+            if socket_is_alive(self.socket_path):
+                raise OSError('Worker is already running on socket: {}'.format(self.socket_path))
+            os.remove(self.socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)  # jobs run as the daemon's user, so only that user may request them
+        self._sock.listen(128)
+
+    def serve_forever(self):
+        """
+        Serve jobs until SIGTERM or SIGINT; then stop accepting new jobs and wait for the running ones.
+        A second signal kills the running jobs.
+        """
+        self._bind()
+        # SIGCHLD wakes up select() through the pipe, so finished jobs are reported without polling
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        old_wakeup_fd = signal.set_wakeup_fd(self._wakeup[1], warn_on_full_buffer=False)
+        old_handlers = {sig: signal.signal(sig, self._on_signal) for sig in (signal.SIGTERM, signal.SIGINT)}
+        old_handlers[signal.SIGCHLD] = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        _log.info('Worker listening on {} (apps: {}; workers: {})'.format(
+            self.socket_path, ', '.join(sorted(self.apps)), self.workers))
+        try:
+            while not self._stopping or self.jobs:
+                rlist = [self._wakeup[0]] + [job[0] for job in self.jobs.values() if job[0] is not None]
+                if not self._stopping and len(self.jobs) < self.workers:
+                    rlist.append(self._sock)
+                try:
+                    readable, _, _ = select(rlist, [], [], 1)
+                except InterruptedError:
+                    readable = []
+                for r in readable:
+                    if r is self._sock:
+                        self._accept()
+                    elif r == self._wakeup[0]:
+                        _drain(self._wakeup[0])
+                    else:
+                        self._check_client(r)
+                self._reap()
+        finally:
+            for sig, handler in old_handlers.items():
+                signal.signal(sig, handler)
+            signal.set_wakeup_fd(old_wakeup_fd)
+            for fd in self._wakeup:
+                os.close(fd)
+            self._sock.close()
+            if path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            _log.info('Worker stopped')
+
+    def _on_signal(self, signum, frame):
+        if self._stopping:
+            for pid in self.jobs:
+                _kill_job(pid, signal.SIGKILL)
+        self._stopping = True
+
+    def _accept(self):
+        conn, _ = self._sock.accept()
+        try:
+            conn.settimeout(REQUEST_TIMEOUT)
+            request, fds = _recv_request(conn)
+            conn.settimeout(None)
+        except EOFError:
+            # availability check of a client (see `socket_is_alive()`)
+            conn.close()
+            return
+        except (OSError, ValueError) as e:
+            _log.warning('Bad request: {}'.format(e))
+            conn.close()
+            return
+        name = request.get('app')
+        if name not in self.apps:
+            # let the client run the app by itself
+            for fd in fds:
+                os.close(fd)
+            _send_response(conn, {'error': 'unknown app: {}'.format(name)})
+            conn.close()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_job(conn, request, fds)
+        try:
+            os.setpgid(pid, pid)  # also set by the child; whichever runs first, the group exists before any kill
+        except OSError:
+            pass
+        for fd in fds:
+            os.close(fd)
+        self.jobs[pid] = [conn, name, monotonic()]
+        _log.info('Job {} started: {} {}'.format(pid, name, ' '.join(request.get('argv') or [])))
+
+    def _run_job(self, conn, request, fds):
+        """ Run the job in the forked child process; never returns. """
+        code = 1
+        try:
+            # forget everything of the daemon's
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(sig, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeup:
+                os.close(fd)
+            self._sock.close()
+            conn.close()
+            for job in self.jobs.values():
+                if job[0] is not None:
+                    job[0].close()
+            _log.handlers.clear()
+            os.setpgid(0, 0)  # so that the job can be killed with all its subprocesses
+            # take the client's stdin/stdout/stderr, working directory and environment
+            for fd, std_fd in zip(fds, (0, 1, 2)):
+                os.dup2(fd, std_fd)
+                os.close(fd)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            code = exit_code(run_app(self.apps[request['app']], request['app'], request.get('argv'),
+                                     request.get('kwargs')))
+        except SystemExit as e:
+            code = exit_code(e.code)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            try:
+                logging.shutdown()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code & 0xff)
+
+    def _check_client(self, conn):
+        """ Kill the job if its client has closed the connection. """
+        try:
+            gone = not conn.recv(1)
+        except OSError:
+            gone = True
+        if not gone:
+            return
+        for pid, job in self.jobs.items():
+            if job[0] is conn:
+                _log.warning('Client of job {} is gone, killing it'.format(pid))
+                _kill_job(pid, signal.SIGTERM)
+                conn.close()
+                job[0] = None
+
+    def _reap(self):
+        while self.jobs:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            job = self.jobs.pop(pid, None)
+            if job is None:
+                continue
+            conn, name, start = job
+            returncode = os.waitstatus_to_exitcode(status)
+            _log.info('Job {} finished: {} (return code: {}; {:.2f}s)'.format(
+                pid, name, returncode, monotonic() - start))
+            if conn is not None:
+                try:
+                    _send_response(conn, {'returncode': returncode})
+                except OSError:
+                    pass
+                conn.close()
+
+
+class WorkerClient:
+    """
+    Client of `WorkerServer`.
+
+    # example:
+    >>> client = WorkerClient()
+    >>> if client.available():
+    >>>   returncode = client.run('example_app', ['--workdir', 'step_1.tmp'])
+    """
+
+    def __init__(self, socket_path=None):
+        """
+        :param socket_path: Unix socket path (env var PIPEAPP_WORKER_SOCKET or a per-user path in /tmp by default)
+        :type socket_path: str
+        """
+        self.socket_path = socket_path or default_socket_path()
+
+    def available(self):
+        """ Check if the worker daemon is running. """
+        return socket_is_alive(self.socket_path)
+
+    def run(self, name, argv=None, kwargs=None, stdin=0, stdout=1, stderr=2):
+        """
+        Run the app on the worker and wait for it to finish.
+
+        :param name: app name
+        :type name: str
+        :param argv: command line arguments, parsed by `run_from_console()` of the app module
+        :type argv: list
+        :param kwargs: arguments of `main()` of the app class, used instead of `argv` (must be JSON-serializable)
+        :type kwargs: dict
+        :param stdin: file descriptor the job reads its stdin from
+        :param stdout: file descriptor the job writes its stdout to
+        :param stderr: file descriptor the job writes its stderr to
+        :return: return code of the job (negative signal number, if it was killed by a signal)
+        :rtype: int
+        :raises LookupError: if the worker does not have the app
+        """
+        request = {
+            'app': name,
+            'argv': list(argv or []),
+            'kwargs': kwargs,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        }
+        payload = json.dumps(request).encode('utf-8')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            socket.send_fds(sock, [HEADER.pack(len(payload))], [stdin, stdout, stderr])
+            sock.sendall(payload)
+            response = sock.makefile('rb').readline()
+        if not response:
+            raise ConnectionError('Worker closed connection before the job finished: {}'.format(self.socket_path))
+        response = json.loads(response.decode('utf-8'))
+        if 'error' in response:
+            raise LookupError(response['error'])
+        return response['returncode']
+
+
+# endregion
+
+
+# region: functions
+def default_socket_path():
+    """ Return socket path from env var PIPEAPP_WORKER_SOCKET, or the default per-user socket path. """
+    from tempfile import gettempdir
+    return getenv(SOCKET_ENV_VAR) or path.join(gettempdir(), 'pipeapp-worker-{}.sock'.format(os.getuid()))
+
+
+def socket_is_alive(socket_path):
+    """ Check if anybody listens on the Unix socket. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def load_app(app):
+    """
+    Import app class.
+    :param app: 'module:Class' or the class itself
+    :return: app class
+    """
+    if not isinstance(app, str):
+        return app
+    module_name, _, attr = app.partition(':')
+    if not attr:
+        raise ValueError('App must be given as module:Class, got: {}'.format(app))
+    obj = import_module(module_name)
+    for name in attr.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def run_app(app_class, name, argv=None, kwargs=None):
+    """
+    Run app in the current process, either with `app_class.main(**kwargs)`, or, if `kwargs` is None,
+    by letting `run_from_console()` of the app module parse the command line arguments `argv`.
+
+    :return: return value of `main()` or `run_from_console()`
+    """
+    if kwargs is not None:
+        sys.argv = [name]
+        kwargs.setdefault('name', name)
+        return app_class.main(**kwargs)
+    console = getattr(sys.modules[app_class.__module__], 'run_from_console', None)
+    if console is None:
+        raise ValueError('Module of app {} has no run_from_console() to parse arguments'.format(name))
+    sys.argv = [name] + list(argv or [])
+    return console()
+
+
+def exit_code(code):
+    """ Convert return value of an app (or `SystemExit.code`) to process exit code, as `sys.exit()` does. """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _recv_request(conn):
+    """ Read job request and the client's stdin/stdout/stderr file descriptors. """
+    data, fds, _, _ = socket.recv_fds(conn, HEADER.size, 3)
+    if not data and not fds:
+        raise EOFError('connection closed without request')
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError('expected 3 file descriptors, got {}'.format(len(fds)))
+    try:
+        data += _recv_exactly(conn, HEADER.size - len(data))
+        payload = _recv_exactly(conn, HEADER.unpack(data)[0])
+        return json.loads(payload.decode('utf-8')), fds
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def _recv_exactly(conn, size):
+    chunks = []
+    while size > 0:
+        chunk = conn.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ValueError('connection closed in the middle of the request')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _send_response(conn, response):
+    conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _kill_job(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _fallback_allowed():
+    return getenv(FALLBACK_ENV_VAR, '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def run_from_console():
+    """
+    Thin client, a drop-in replacement of an app's console script:
+        pipeapp_run <app name> [app arguments]
+    runs the app on the worker daemon, or in this process if the daemon is not running or does not have the app
+    (unless env var PIPEAPP_WORKER_FALLBACK=0).
+    """
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print('usage: pipeapp_run <app name> [app arguments]\n\n'
+              'Run app on the worker daemon (see pipeapp_worker) listening on ${} or {}'.format(
+                  SOCKET_ENV_VAR, default_socket_path()), file=sys.stderr)
+        return 2
+    name, argv = sys.argv[1], sys.argv[2:]
+    client = WorkerClient()
+    if client.available():
+        try:
+            returncode = client.run(name, argv)
+            # killed by a signal: report it as the shell does
+            return returncode if returncode >= 0 else 128 - returncode
+        except LookupError as e:
+            if not _fallback_allowed():
+                print('pipeapp_run: {}'.format(e), file=sys.stderr)
+                return 127
+    elif not _fallback_allowed():
+        print('pipeapp_run: worker is not running on {}'.format(client.socket_path), file=sys.stderr)
+        return 1
+    try:
+        app_class = load_app(default_apps.get(name, name))
+    except ValueError:
+        print('pipeapp_run: unknown app: {} (known apps: {}; others are given as module:Class)'.format(
+            name, ', '.join(sorted(default_apps))), file=sys.stderr)
+        return 2
+    return exit_code(run_app(app_class, name, argv))
+
+
+def serve_from_console():
+    arg_parser = ArgumentParser(prog='pipeapp_worker',
+                                description='Warm worker daemon that runs apps in processes forked from itself',
+                                usage='%(prog)s [--socket <socket> --app <name>=<module>:<Class> --workers <n>]',
+                                add_help=True)
+    arg_parser.add_argument('-s', '--socket', help='Unix socket path (default: ${} or {})'.format(
+        SOCKET_ENV_VAR, default_socket_path()))
+    arg_parser.add_argument('-a', '--app', action='append', default=[],
+                            help='app to preload, as name=module:Class (may be repeated; default: {})'.format(
+                                ', '.join('{}={}'.format(k, v) for k, v in sorted(default_apps.items()))))
+    arg_parser.add_argument('-w', '--workers', type=int, help='max number of jobs running at once (default: CPUs)')
+    arg_parser.add_argument('-l', '--log', help='log file name (default: stderr)')
+    args = arg_parser.parse_args()
+
+    apps = dict(app.split('=', 1) for app in args.app) if args.app else None
+    handler = logging.FileHandler(args.log) if args.log else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(fmt='%(asctime)s\t%(levelname)s:\t%(message)s',
+                                           datefmt='%Y-%m-%d %H:%M:%S'))
+    _log.addHandler(handler)
+    _log.setLevel(logging.INFO)
+    _log.propagate = False
+    WorkerServer(args.socket, apps=apps, workers=args.workers).serve_forever()
+    return 0
+
+# endregion
+
+
+if __name__ == '__main__':
+    exit(serve_from_console())
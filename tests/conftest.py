@@ -0,0 +1,8 @@
+"""
+Test configuration: import `pipeapp` from the source tree.
+"""
+
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src'))
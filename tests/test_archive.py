@@ -0,0 +1,103 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from pipeapp.lib.shell import unzip, list_archive, open_archive_member, tab_file_reader
+
+MEMBERS = {
+    'data/genes.tsv': b'#id\tlen\ng1\t100\ng2\t200\n',
+    'data/genes.tsv.gz': gzip.compress(b'#id\tlen\ng3\t300\n'),
+    'data/sub/notes.txt': b'notes\n',
+    'README': b'readme\n',
+}
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    filename = str(tmp_path / 'data.zip')
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('data/', b'')
+        for name, data in sorted(MEMBERS.items()):
+            zf.writestr(name, data)
+        # many small members for the threads to share
+        for i in range(20):
+            zf.writestr('many/f{:02d}.txt'.format(i), 'file {}\n'.format(i) * (i + 1))
+    return filename
+
+
+@pytest.fixture
+def tar_path(tmp_path):
+    filename = str(tmp_path / 'data.tar.gz')
+    with tarfile.open(filename, 'w:gz') as tf:
+        info = tarfile.TarInfo('data')
+        info.type = tarfile.DIRTYPE
+        tf.addfile(info)
+        for name, data in sorted(MEMBERS.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return filename
+
+
+def read(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_unzip(tmp_path, zip_path, threads):
+    extract_dir = str(tmp_path / 'out')
+    names = unzip(zip_path, extract_dir, threads=threads)
+    # the directory entry too
+    assert len(names) == 1 + len(MEMBERS) + 20
+    for name, data in MEMBERS.items():
+        assert read(os.path.join(extract_dir, name)) == data
+    for i in range(20):
+        data = 'file {}\n'.format(i) * (i + 1)
+        assert read(os.path.join(extract_dir, 'many', 'f{:02d}.txt'.format(i))) == data.encode()
+    assert os.path.exists(zip_path)
+
+
+def test_unzip_members(tmp_path, zip_path):
+    extract_dir = str(tmp_path / 'out')
+    assert unzip(zip_path, extract_dir, members=['data/*.tsv*', 'README'], threads=2, remove_zip=True) == \
+        ['README', 'data/genes.tsv', 'data/genes.tsv.gz']
+    assert sorted(os.listdir(extract_dir)) == ['README', 'data']
+    assert sorted(os.listdir(os.path.join(extract_dir, 'data'))) == ['genes.tsv', 'genes.tsv.gz']
+    assert not os.path.exists(zip_path)
+
+
+def test_list_archive(zip_path, tar_path):
+    for archive in (zip_path, tar_path):
+        assert sorted(list_archive(archive, ['data/*', 'README'])) == sorted(MEMBERS)
+        # `*` matches `/` as well
+        assert list_archive(archive, 'data/*.txt') == ['data/sub/notes.txt']
+        assert list_archive(archive, ['README', 'nope*']) == ['README']
+    # directory entries are not listed
+    assert len(list_archive(zip_path)) == len(MEMBERS) + 20
+
+
+def test_open_archive_member(zip_path, tar_path):
+    for archive in (zip_path, tar_path):
+        with open_archive_member(archive, 'README') as fh:
+            assert fh.read() == 'readme\n'
+        with open_archive_member(archive, 'data/sub/notes.txt', mode='rb') as fh:
+            assert fh.read() == b'notes\n'
+        # a compressed member is decompressed too
+        with open_archive_member(archive, 'data/genes.tsv.gz') as fh:
+            assert fh.read() == '#id\tlen\ng3\t300\n'
+        with pytest.raises(KeyError):
+            open_archive_member(archive, 'nope')
+    with pytest.raises(KeyError):
+        open_archive_member(tar_path, 'data')
+
+
+def test_tab_file_reader_member(zip_path, tar_path):
+    for archive in (zip_path, tar_path):
+        assert list(tab_file_reader(archive, member='data/genes.tsv')) == [{'id': 'g1', 'len': '100'},
+                                                                           {'id': 'g2', 'len': '200'}]
+        assert [r['id'] for r in tab_file_reader(archive, member='data/genes.tsv.gz')] == ['g3']
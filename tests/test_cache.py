@@ -0,0 +1,158 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from pipeapp.lib.cache import DownloadCache
+
+
+class FakeRemote:
+    """ Remote files: url -> content; counts the downloads. """
+
+    def __init__(self, files, delay=0):
+        self.files = dict(files)
+        self.mtimes = dict.fromkeys(self.files, 1000)
+        self.fetched = []
+        self.delay = delay
+        self.known = True
+
+    def stat(self, url):
+        if not self.known:
+            return None, None
+        return len(self.files[url]), self.mtimes[url]
+
+    def fetch(self, url, filename):
+        self.fetched.append(url)
+        time.sleep(self.delay)
+        with open(filename, 'wb') as fh:
+            fh.write(self.files[url])
+
+    def update(self, url, content):
+        self.files[url] = content
+        self.mtimes[url] += 1
+
+    def get(self, cache, url, dst):
+        return cache.get(url, dst, fetch=self.fetch, stat_remote=self.stat)
+
+
+def read(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+@pytest.fixture
+def remote():
+    return FakeRemote({'ftp://host/a.gz': b'a' * 100, 'ftp://host/b.gz': b'b' * 100, 'ftp://host/c.gz': b'c' * 100})
+
+
+def test_hit_is_hard_linked(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    first, second = str(tmp_path / 'first.gz'), str(tmp_path / 'second.gz')
+    assert remote.get(cache, 'ftp://host/a.gz', first) is False
+    assert remote.get(cache, 'ftp://host/a.gz', second) is True
+    assert remote.fetched == ['ftp://host/a.gz']
+    assert read(second) == b'a' * 100
+    st = os.stat(second)
+    assert st.st_ino == os.stat(first).st_ino and st.st_nlink == 3
+    # nobody can modify the cached file through its links
+    assert stat.S_IMODE(st.st_mode) == 0o444
+    assert os.listdir(cache.dir_tmp) == []
+
+
+def test_changed_remote_file(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    dst = str(tmp_path / 'a.gz')
+    remote.get(cache, 'ftp://host/a.gz', dst)
+    remote.update('ftp://host/a.gz', b'new')
+    assert remote.get(cache, 'ftp://host/a.gz', dst) is False
+    assert read(dst) == b'new'
+    assert len(cache.entries()) == 2
+
+
+def test_remote_file_without_size_and_mtime_is_not_cached(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    remote.known = False
+    dst = str(tmp_path / 'a.gz')
+    assert remote.get(cache, 'ftp://host/a.gz', dst) is False
+    remote.update('ftp://host/a.gz', b'new')
+    assert remote.get(cache, 'ftp://host/a.gz', dst) is False
+    assert read(dst) == b'new'
+    assert remote.fetched == ['ftp://host/a.gz'] * 2
+    assert cache.entries() == []
+
+
+def test_modified_cached_file(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    dst = str(tmp_path / 'a.gz')
+    remote.get(cache, 'ftp://host/a.gz', dst)
+    # same size, another content
+    os.chmod(dst, 0o644)
+    time.sleep(0.01)
+    with open(dst, 'r+b') as fh:
+        fh.write(b'x')
+    assert remote.get(cache, 'ftp://host/a.gz', str(tmp_path / 'again.gz')) is False
+    assert read(str(tmp_path / 'again.gz')) == b'a' * 100
+
+
+def test_verify_checksum(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'), verify=True)
+    dst = str(tmp_path / 'a.gz')
+    remote.get(cache, 'ftp://host/a.gz', dst)
+    assert remote.get(cache, 'ftp://host/a.gz', dst) is True
+    # corrupted, with the mtime preserved: only the checksum can tell
+    st = os.stat(dst)
+    os.chmod(dst, 0o644)
+    with open(dst, 'r+b') as fh:
+        fh.write(b'x')
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert remote.get(cache, 'ftp://host/a.gz', str(tmp_path / 'again.gz')) is False
+
+
+def test_lru_eviction(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_bytes=250)
+    for name in ['a', 'b', 'a', 'c']:
+        remote.get(cache, 'ftp://host/{}.gz'.format(name), str(tmp_path / name))
+        time.sleep(0.02)
+    # b is the least recently used
+    assert cache.size() == 200
+    assert remote.get(cache, 'ftp://host/a.gz', str(tmp_path / 'a2')) is True
+    assert remote.get(cache, 'ftp://host/c.gz', str(tmp_path / 'c2')) is True
+    assert remote.get(cache, 'ftp://host/b.gz', str(tmp_path / 'b2')) is False
+    # evicted files stay in their destinations
+    assert read(str(tmp_path / 'b')) == b'b' * 100
+
+    cache.max_bytes = 100
+    cache.evict()
+    assert [key for _, _, key in cache.entries()] == [DownloadCache.key('ftp://host/b.gz', 100, 1000)]
+
+
+def test_concurrent_downloads_of_one_file(tmp_path):
+    remote = FakeRemote({'ftp://host/a.gz': b'a' * 100}, delay=0.2)
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    results = {}
+
+    def get(i):
+        results[i] = remote.get(cache, 'ftp://host/a.gz', str(tmp_path / 'a{}'.format(i)))
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # one thread downloads the file under the lock, the others wait and take it from the cache
+    assert remote.fetched == ['ftp://host/a.gz']
+    assert sorted(results.values()) == [False, True, True, True]
+
+
+def test_failed_download(tmp_path, remote):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    with pytest.raises(IOError):
+        cache.get('ftp://host/a.gz', str(tmp_path / 'a.gz'), fetch=lambda url, fname: False,
+                  stat_remote=remote.stat)
+    with pytest.raises(IOError):
+        cache.get('ftp://host/a.gz', str(tmp_path / 'a.gz'), fetch=lambda url, fname: open(fname, 'w').close(),
+                  stat_remote=remote.stat)
+    assert cache.entries() == []
+    assert os.listdir(cache.dir_tmp) == []
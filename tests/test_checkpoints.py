@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from pipeapp.lib.app import PipelineApp
+
+
+class FilterApp(PipelineApp):
+    fingerprint_conf_keys = ('min_length', 'threads')
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    def make_app(resume=False, app_class=FilterApp, name='ckpt_app', **env):
+        for key, value in env.items():
+            os.environ['{}_{}'.format(name.upper(), key)] = value
+        try:
+            return app_class(name=name, workdir=str(tmp_path / 'work'), resume=resume, cleanup_mode='sync',
+                             no_conf_root_key=True)
+        finally:
+            for key in env:
+                del os.environ['{}_{}'.format(name.upper(), key)]
+    return make_app
+
+
+def write(filename, text):
+    with open(filename, 'w') as fh:
+        fh.write(text)
+
+
+def test_run_control_settings_keep_checkpoints(make_app):
+    fingerprint = make_app().step_fingerprint('align', params={'k': 5})
+    # env vars of the resume mode, cleanup, logging and the pipeline runner (THREADS) do not change results
+    app = make_app(resume=True, RESUME='1', CLEANUP_MODE='thread', WAIT_CLEANUP='1', LOG_FORMAT='json',
+                   PROFILE='run', THREADS='8')
+    assert app.conf['THREADS'] == '8'
+    assert app.step_fingerprint('align', params={'k': 5}) == fingerprint
+
+
+def test_fingerprint_conf_keys(make_app):
+    app = make_app()
+    fingerprint = app.step_fingerprint('align')
+    app.conf['unrelated'] = 'value'
+    assert app.step_fingerprint('align') == fingerprint
+    app.conf['min_length'] = '50'
+    assert app.step_fingerprint('align') != fingerprint
+    # set from env var <APP_NAME>_MIN_LENGTH
+    assert make_app(resume=True, MIN_LENGTH='50').step_fingerprint('align') == app.step_fingerprint('align')
+    assert app.step_fingerprint('align', params={'k': 5}) != app.step_fingerprint('align', params={'k': 6})
+    assert app.step_fingerprint('align') != app.step_fingerprint('cluster')
+
+
+def test_run_step_resume(make_app, tmp_path):
+    fasta = str(tmp_path / 'in.faa')
+    aln = str(tmp_path / 'out.aln')
+    write(fasta, '>a\nACGT\n')
+    calls = []
+
+    def align():
+        calls.append('align')
+        write(aln, 'aligned\n')
+
+    def run_step(app, params=None):
+        return app.run_step('align', align, inputs=[fasta], outputs=[aln], params=params or {'k': 5})
+
+    assert run_step(make_app())
+    assert not run_step(make_app(resume=True, THREADS='4'))
+    assert calls == ['align']
+
+    # changed input, output or parameters
+    write(fasta, '>a\nACGTT\n')
+    assert run_step(make_app(resume=True))
+    write(aln, 'edited\n')
+    assert run_step(make_app(resume=True))
+    assert run_step(make_app(resume=True), params={'k': 6})
+    assert not run_step(make_app(resume=True), params={'k': 6})
+    # without resume, workdir and checkpoints are dropped
+    assert run_step(make_app(), params={'k': 6})
+    assert len(calls) == 5
@@ -0,0 +1,72 @@
+import logging
+import os
+from subprocess import Popen
+
+import pytest
+
+from pipeapp.lib import shell
+from pipeapp.lib.shell import remove_dir_background, wait_for_cleanup
+
+
+def make_tree(dirname, files=20):
+    for sub in ('a', 'b/c'):
+        os.makedirs(os.path.join(dirname, sub))
+        for i in range(files):
+            with open(os.path.join(dirname, sub, 'f{}'.format(i)), 'w') as fh:
+                fh.write('x')
+
+
+@pytest.mark.parametrize('mode', ['process', 'thread'])
+def test_remove_dir_background(tmp_path, mode):
+    work = str(tmp_path / 'work')
+    make_tree(work)
+    assert remove_dir_background(work, mode=mode)
+    # the path is free immediately
+    assert not os.path.exists(work)
+    os.makedirs(work)
+    wait_for_cleanup()
+    assert os.listdir(str(tmp_path)) == ['work']
+    assert shell._background_cleanups == []
+
+
+def test_missing_dir(tmp_path):
+    assert not remove_dir_background(str(tmp_path / 'missing'))
+    with pytest.raises(ValueError):
+        remove_dir_background(str(tmp_path), mode='rsync')
+
+
+def test_finished_processes_are_reaped(tmp_path):
+    first, second = str(tmp_path / 'first'), str(tmp_path / 'second')
+    make_tree(first)
+    make_tree(second)
+    remove_dir_background(first)
+    proc = shell._background_cleanups[-1]
+    # wait for the exit without reaping the process
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    assert proc.returncode is None
+    # the next call reaps the finished `rm` process
+    remove_dir_background(second)
+    assert proc.returncode == 0
+    assert proc not in shell._background_cleanups
+    wait_for_cleanup()
+    assert shell._background_cleanups == []
+
+
+def test_failed_removal_is_logged(caplog):
+    with shell._background_cleanups_lock:
+        shell._background_cleanups.append(Popen(['sh', '-c', 'exit 1', 'rm', '/trash/dir']))
+    with caplog.at_level(logging.WARNING, logger='pipeapp.lib.shell'):
+        wait_for_cleanup()
+    assert 'Background removal of /trash/dir failed with exit code 1' in caplog.text
+    assert shell._background_cleanups == []
+
+
+def test_running_removal_is_kept():
+    proc = Popen(['sleep', '0.5'])
+    with shell._background_cleanups_lock:
+        shell._background_cleanups.append(proc)
+    wait_for_cleanup(timeout=0.01)
+    assert shell._background_cleanups == [proc]
+    wait_for_cleanup()
+    assert proc.returncode == 0
+    assert shell._background_cleanups == []
@@ -0,0 +1,186 @@
+import io
+import os
+import gzip
+import bz2
+import lzma
+import shutil
+import time
+import zlib
+
+import pytest
+
+from pipeapp.lib import codec
+from pipeapp.lib.codec import (BgzfWriter, BgzfRandomReader, detect_codec, is_bgzf, open_compressed,
+                               open_compressed_stream, read_gzi, BGZF_BLOCK_DATA)
+
+DATA = b''.join(b'line\t%d\t%s\n' % (i, b'ACGT' * (i % 7)) for i in range(50000))
+
+
+def write_bgzf(filename, data, threads=2, level=6):
+    with io.BufferedWriter(BgzfWriter(filename, level=level, threads=threads), buffer_size=1 << 20) as fh:
+        fh.write(data)
+
+
+@pytest.mark.parametrize('name, opener', [('gzip', gzip.open), ('bz2', bz2.open), ('xz', lzma.open)])
+def test_detect_and_read(tmp_path, name, opener):
+    filename = str(tmp_path / 'data.bin')  # no extension: detected from the magic bytes
+    with opener(filename, 'wb') as fh:
+        fh.write(DATA)
+    assert detect_codec(filename).name == name
+    with open_compressed(filename, mode='rb', threads=2) as fh:
+        assert fh.read() == DATA
+    with open(filename, 'rb') as raw, open_compressed_stream(raw, mode='rb') as fh:
+        assert fh.read() == DATA
+
+
+def test_plain_file(tmp_path):
+    filename = str(tmp_path / 'data.tsv')
+    with open(filename, 'wb') as fh:
+        fh.write(DATA)
+    assert detect_codec(filename) is None
+    with open_compressed(filename) as fh:
+        assert fh.readline() == 'line\t0\t\n'
+
+
+def test_multi_member_gzip(tmp_path):
+    filename = str(tmp_path / 'data.gz')
+    with open(filename, 'wb') as fh:
+        fh.write(gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:]))
+    assert not is_bgzf(filename)
+    with open_compressed(filename, mode='rb', threads=4) as fh:
+        assert fh.read() == DATA
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_bgzf_round_trip(tmp_path, threads):
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, DATA, threads=threads)
+    assert is_bgzf(filename)
+    with open(filename, 'rb') as fh:
+        assert fh.read()[-28:] == codec.BGZF_EOF
+    # a valid multi-member gzip file
+    assert gzip.decompress(open(filename, 'rb').read()) == DATA
+    with open_compressed(filename, mode='rb', threads=3) as fh:
+        assert fh.read() == DATA
+    with open_compressed(filename, mode='rt', threads=3) as fh:
+        assert sum(1 for _ in fh) == 50000
+
+
+def test_bgzf_crc_error(tmp_path):
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, DATA)
+    data = bytearray(open(filename, 'rb').read())
+    data[30] ^= 0xff  # inside the deflate data of the first block
+    open(filename, 'wb').write(bytes(data))
+    with pytest.raises((IOError, zlib.error)):
+        with open_compressed(filename, mode='rb', threads=2) as fh:
+            fh.read()
+
+
+def test_bgzf_random_reader(tmp_path):
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, DATA)
+    reader = BgzfRandomReader(filename)
+    assert reader.size == len(DATA)
+    for offset, size in [(0, 10), (BGZF_BLOCK_DATA - 5, 10), (3 * BGZF_BLOCK_DATA, 2 * BGZF_BLOCK_DATA + 7),
+                         (len(DATA) - 3, 100), (len(DATA), 10)]:
+        assert reader.read(offset, size) == DATA[offset:offset + size]
+    reader.close()
+
+    # the saved .gzi index is read back with the implicit first block; the last entry is the empty EOF block
+    coffsets, uoffsets = read_gzi(filename + '.gzi')
+    blocks = -(-len(DATA) // BGZF_BLOCK_DATA)
+    assert len(coffsets) == len(uoffsets) == blocks + 1
+    assert uoffsets[-1] == len(DATA)
+    assert uoffsets[:3] == [0, BGZF_BLOCK_DATA, 2 * BGZF_BLOCK_DATA]
+    reader = BgzfRandomReader(filename, save_index=False)
+    assert (reader.coffsets, reader.uoffsets) == (coffsets, uoffsets)
+    assert reader.read(12345, 54321) == DATA[12345:12345 + 54321]
+    reader.close()
+
+
+def test_bgzf_random_reader_index_of_changed_file(tmp_path):
+    filename = str(tmp_path / 'data.gz')
+    write_bgzf(filename, DATA[:100000])
+    BgzfRandomReader(filename).close()
+    gzi = read_gzi(filename + '.gzi')
+    # the .gzi index is as new as the file, but does not cover it: rebuilt
+    for data in (DATA, DATA[:50000]):
+        write_bgzf(filename, data)
+        os.utime(filename, ns=(1, 1))
+        reader = BgzfRandomReader(filename)
+        assert reader.size == len(data)
+        assert reader.read(len(data) - 10, 20) == data[-10:]
+        reader.close()
+        assert read_gzi(filename + '.gzi') != gzi
+        gzi = read_gzi(filename + '.gzi')
+    # another BGZF file appended: its blocks follow the EOF block of the first one
+    write_bgzf(filename + '.tail', b'tail')
+    with open(filename, 'ab') as fh, open(filename + '.tail', 'rb') as tail:
+        fh.write(tail.read())
+    os.utime(filename, ns=(1, 1))
+    reader = BgzfRandomReader(filename)
+    assert reader.read(0, len(DATA)) == DATA[:50000] + b'tail'
+    reader.close()
+
+
+def test_bgzf_random_reader_invalid_files(tmp_path):
+    filename = str(tmp_path / 'empty.gz')
+    open(filename, 'wb').close()
+    with pytest.raises(ValueError, match='Empty file'):
+        BgzfRandomReader(filename)
+    # BGZF with no data: only the EOF block
+    write_bgzf(filename, b'')
+    reader = BgzfRandomReader(filename)
+    assert reader.size == 0 and reader.read(0, 10) == b''
+    reader.close()
+    open(filename, 'wb').write(gzip.compress(DATA))
+    with pytest.raises(IOError, match='Invalid BGZF block header'):
+        BgzfRandomReader(filename, save_index=False)
+
+
+@pytest.mark.skipif(shutil.which('gzip') is None, reason='gzip is not installed')
+def test_gzip_tool(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'data.gz')
+    with open(filename, 'wb') as fh:
+        fh.write(gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:]))
+    # `gzip -d -c` has the same command line as pigz and igzip
+    monkeypatch.setenv(codec.GZIP_TOOL_ENV_VAR, 'gzip')
+    with open_compressed(filename, mode='rb', threads=2) as fh:
+        assert fh.raw.__class__ is codec._ChunkReader
+        assert fh.read() == DATA
+
+    # closed before the end of the data
+    fh = open_compressed(filename, mode='rt', threads=2)
+    assert fh.readline() == 'line\t0\t\n'
+    fh.close()
+
+    open(filename, 'wb').write(gzip.compress(DATA)[:-20])
+    with pytest.raises(IOError):
+        with open_compressed(filename, mode='rb', threads=2) as fh:
+            fh.read()
+
+    # disabled or not set (the default): the gzip module is used
+    monkeypatch.setenv(codec.GZIP_TOOL_ENV_VAR, 'none')
+    with open_compressed(filename, mode='rb', threads=2) as fh:
+        assert isinstance(fh, gzip.GzipFile)
+    monkeypatch.delenv(codec.GZIP_TOOL_ENV_VAR)
+    with open_compressed(filename, mode='rb', threads=2) as fh:
+        assert isinstance(fh, gzip.GzipFile)
+
+
+def test_gzip_tool_exit_code_is_checked_on_close(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'data.gz')
+    with open(filename, 'wb') as fh:
+        fh.write(gzip.compress(DATA))
+    # a tool that writes part of the data and fails
+    tool = str(tmp_path / 'failing-gzip')
+    with open(tool, 'w') as fh:
+        fh.write('#!/bin/sh\nprintf abc\nexit 3\n')
+    os.chmod(tool, 0o755)
+    monkeypatch.setenv(codec.GZIP_TOOL_ENV_VAR, tool)
+    fh = open_compressed(filename, mode='rb', threads=2)
+    assert fh.read(3) == b'abc'
+    time.sleep(0.5)
+    with pytest.raises(IOError, match='failing-gzip'):
+        fh.close()
@@ -0,0 +1,114 @@
+import os
+import pickle
+
+import pytest
+
+from pipeapp.lib import config
+from pipeapp.lib.config import Config, FrozenConfig, load_yaml_cached
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv(config.cache_dir_env_var, cache_dir)
+    return cache_dir
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """ Names of the files parsed with the YAML loader (not taken from the cache). """
+    parsed = []
+    load_yaml = config._load_yaml
+    monkeypatch.setattr(config, '_load_yaml', lambda filename: parsed.append(filename) or load_yaml(filename))
+    return parsed
+
+
+def write(filename, text):
+    with open(filename, 'w') as fh:
+        fh.write(text)
+
+
+def test_cache_is_used_until_file_changes(tmp_path, cache_dir, parsed):
+    filename = str(tmp_path / 'conf.yaml')
+    write(filename, 'app:\n  threads: 4\n  db: a.db\n')
+    assert load_yaml_cached(filename, root_key='app') == {'threads': 4, 'db': 'a.db'}
+    assert len(os.listdir(cache_dir)) == 1
+    assert load_yaml_cached(filename, root_key='app') == {'threads': 4, 'db': 'a.db'}
+    assert parsed == [filename]
+
+    # another size
+    write(filename, 'app:\n  threads: 16\n  db: a.db\n')
+    assert load_yaml_cached(filename, root_key='app')['threads'] == 16
+    # same size, another mtime
+    write(filename, 'app:\n  threads: 32\n  db: a.db\n')
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert load_yaml_cached(filename, root_key='app')['threads'] == 32
+    assert parsed == [filename] * 3
+    assert load_yaml_cached(filename, root_key='app')['threads'] == 32
+    assert len(parsed) == 3
+
+
+def test_root_key_is_part_of_cache_key(tmp_path, cache_dir, parsed):
+    filename = str(tmp_path / 'conf.yaml')
+    write(filename, 'one:\n  x: 1\ntwo:\n  x: 2\n')
+    assert load_yaml_cached(filename, root_key='one') == {'x': 1}
+    assert load_yaml_cached(filename, root_key='two') == {'x': 2}
+    assert load_yaml_cached(filename) == {'one': {'x': 1}, 'two': {'x': 2}}
+    assert len(parsed) == 3
+    with pytest.raises(KeyError):
+        load_yaml_cached(filename, root_key='three')
+
+
+def test_broken_or_foreign_cache_file(tmp_path, cache_dir, parsed):
+    filename = str(tmp_path / 'conf.yaml')
+    write(filename, 'x: 1\n')
+    load_yaml_cached(filename)
+    cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    write(cache_file, 'garbage')
+    assert load_yaml_cached(filename) == {'x': 1}
+    # blob of another key under the same file name (checksum collision)
+    with open(cache_file, 'wb') as fh:
+        pickle.dump(('other key', {'x': 2}), fh)
+    assert load_yaml_cached(filename) == {'x': 1}
+    assert len(parsed) == 3
+
+
+def test_cache_disabled(tmp_path, monkeypatch, parsed):
+    monkeypatch.setenv(config.cache_dir_env_var, '')
+    filename = str(tmp_path / 'conf.yaml')
+    write(filename, 'x: 1\n')
+    load_yaml_cached(filename)
+    load_yaml_cached(filename)
+    assert len(parsed) == 2
+    assert os.listdir(str(tmp_path)) == ['conf.yaml']
+
+
+def test_from_yaml(tmp_path, cache_dir):
+    filename = str(tmp_path / 'conf.yaml')
+    write(filename, 'app:\n  threads: 4\n')
+    conf = Config()
+    assert conf.from_yaml(filename, root_key='app')
+    assert conf == {'DEBUG': False, 'TESTING': False, 'threads': 4}
+    assert not conf.from_yaml(filename, root_key='other')
+    with pytest.raises(IOError):
+        conf.from_yaml(str(tmp_path / 'missing.yaml'))
+
+
+def test_snapshot_and_frozen_config(tmp_path):
+    conf = Config()
+    conf['threads'] = 8
+    snapshot = conf.save_snapshot(str(tmp_path / 'conf.snapshot'))
+    assert Config.from_snapshot(snapshot) == conf
+
+    frozen = conf.freeze()
+    with pytest.raises(TypeError):
+        frozen['threads'] = 1
+    with pytest.raises(TypeError):
+        frozen.update(threads=1)
+    restored = pickle.loads(pickle.dumps(frozen))
+    assert isinstance(restored, FrozenConfig) and restored == frozen
+    assert hash(restored) == hash(frozen)
+    thawed = frozen.thaw()
+    thawed['threads'] = 1
+    assert frozen['threads'] == 8
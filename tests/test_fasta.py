@@ -0,0 +1,171 @@
+import gzip
+import io
+import os
+import random
+
+import pytest
+
+from pipeapp.lib.codec import BgzfWriter
+from pipeapp.lib.fasta import IndexedFasta, FaiEntry, fasta_reader, read_fai, write_fai
+from pipeapp.lib import fasta as fasta_module
+
+random.seed(7)
+RECORDS = [('seq{}'.format(i), ''.join(random.choice('ACGT') for _ in range(n)))
+           for i, n in enumerate([1, 59, 60, 61, 125, 1000, 0, 7])]
+
+
+def fasta_text(records=RECORDS, width=60, newline='\n', final_newline=True):
+    lines = []
+    for name, seq in records:
+        lines.append('>{} description'.format(name))
+        lines.extend(seq[i:i + width] for i in range(0, len(seq), width))
+    return newline.join(lines) + (newline if final_newline else '')
+
+
+def write(filename, text):
+    with open(filename, 'wb') as fh:
+        fh.write(text.encode('ascii'))
+    return filename
+
+
+def check_records(fasta, records=RECORDS):
+    assert list(fasta.keys()) == [name for name, _ in records]
+    for name, seq in records:
+        assert fasta.length(name) == len(seq)
+        assert fasta[name] == seq
+        for start, end in [(0, 1), (5, 70), (59, 121), (len(seq) - 3, len(seq) + 10), (-5, 3), (10, 5)]:
+            assert fasta.fetch(name, start, end) == seq[max(0, start):end]
+
+
+def test_index_is_built_and_saved(tmp_path):
+    filename = write(str(tmp_path / 'seqs.fa'), fasta_text())
+    with fasta_reader(filename) as fasta:
+        assert len(fasta) == len(RECORDS)
+        assert 'seq5' in fasta and 'seq' not in fasta
+        check_records(fasta)
+    # same as `samtools faidx`
+    entries = read_fai(filename + '.fai')
+    assert entries[0] == FaiEntry('seq0', 1, 18, 1, 2)
+    assert entries[3] == FaiEntry('seq3', 61, 195, 60, 61)
+    with open(filename + '.fai') as fh:
+        assert fh.readline() == 'seq0\t1\t18\t1\t2\n'
+
+
+@pytest.mark.parametrize('newline, final_newline', [('\n', False), ('\r\n', True), ('\r\n', False)])
+def test_line_endings(tmp_path, newline, final_newline):
+    filename = write(str(tmp_path / 'seqs.fa'), fasta_text(newline=newline, final_newline=final_newline))
+    with IndexedFasta(filename, save_index=False) as fasta:
+        check_records(fasta)
+        assert list(fasta) == RECORDS
+    assert not os.path.exists(filename + '.fai')
+
+
+def test_small_index_chunks(tmp_path, monkeypatch):
+    # records and lines cut by the chunk boundaries
+    monkeypatch.setattr(fasta_module, 'INDEX_CHUNK_SIZE', 37)
+    filename = write(str(tmp_path / 'seqs.fa'), fasta_text(width=13))
+    with IndexedFasta(filename) as fasta:
+        check_records(fasta)
+
+
+def test_iteration(tmp_path):
+    filename = write(str(tmp_path / 'seqs.fa'), fasta_text())
+    # without the index: records are scanned in the memory map (`list()` would build the index for `len()`)
+    with IndexedFasta(filename) as fasta:
+        assert [record for record in fasta] == RECORDS
+        assert fasta._index is None
+    # with the index
+    with IndexedFasta(filename) as fasta:
+        assert len(fasta) == len(RECORDS)
+        records = list(fasta)
+        assert records == RECORDS
+        assert records[1].name == 'seq1' and records[1].sequence == RECORDS[1][1]
+
+
+def test_invalid_files(tmp_path):
+    filename = write(str(tmp_path / 'bad.fa'), '>a\nACGT\nAC\nACGT\n')
+    with pytest.raises(ValueError, match='Different line length'):
+        IndexedFasta(filename).index
+    filename = write(str(tmp_path / 'bad.fa'), '>a\nACGT\nACGTA\n')
+    with pytest.raises(ValueError, match='Different line length'):
+        IndexedFasta(filename).index
+    filename = write(str(tmp_path / 'noheader.fa'), 'ACGT\n>a\nACGT\n')
+    with pytest.raises(ValueError, match='header'):
+        IndexedFasta(filename).index
+    filename = str(tmp_path / 'seqs.fa.gz')
+    with gzip.open(filename, 'wt') as fh:
+        fh.write(fasta_text())
+    with pytest.raises(ValueError, match='BGZF'):
+        IndexedFasta(filename)
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    filename = write(str(tmp_path / 'seqs.fa'), fasta_text())
+    write_fai(filename + '.fai', [FaiEntry('old', 4, 5, 4, 5)])
+    os.utime(filename + '.fai', ns=(1, 1))
+    with IndexedFasta(filename) as fasta:
+        assert list(fasta.keys())[0] == 'seq0'
+    assert read_fai(filename + '.fai')[0].name == 'seq0'
+    # an up-to-date index is used as is
+    entries = read_fai(filename + '.fai')
+    write_fai(filename + '.fai', [entries[0]._replace(name='old')] + entries[1:])
+    with IndexedFasta(filename) as fasta:
+        assert list(fasta.keys())[0] == 'old'
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_index_of_changed_file_is_rebuilt(tmp_path, compressed):
+    filename = str(tmp_path / ('seqs.fa.gz' if compressed else 'seqs.fa'))
+
+    def write_fasta(records):
+        if compressed:
+            with io.BufferedWriter(BgzfWriter(filename, threads=1)) as fh:
+                fh.write(fasta_text(records).encode('ascii'))
+        else:
+            write(filename, fasta_text(records))
+        # the index may be as new as the file: the mtime alone can not tell it is stale
+        os.utime(filename, ns=(1, 1))
+
+    write_fasta(RECORDS)
+    with IndexedFasta(filename) as fasta:
+        check_records(fasta)
+    # appended
+    write_fasta(RECORDS + [('new', 'ACGT')])
+    with IndexedFasta(filename) as fasta:
+        check_records(fasta, RECORDS + [('new', 'ACGT')])
+    # truncated
+    write_fasta(RECORDS[:3])
+    with IndexedFasta(filename) as fasta:
+        check_records(fasta, RECORDS[:3])
+    # the index of the same data is reused, with or without the final line break
+    renamed = [entry._replace(name='r{}'.format(i)) for i, entry in enumerate(read_fai(filename + '.fai'))]
+    write_fai(filename + '.fai', renamed)
+    with IndexedFasta(filename) as fasta:
+        assert list(fasta.keys()) == ['r0', 'r1', 'r2']
+    if not compressed:
+        write(filename, fasta_text(RECORDS[:3], final_newline=False))
+        os.utime(filename, ns=(1, 1))
+        with IndexedFasta(filename) as fasta:
+            assert list(fasta.keys()) == ['r0', 'r1', 'r2']
+
+
+def test_empty_file(tmp_path):
+    filename = write(str(tmp_path / 'empty.fa'), '')
+    with IndexedFasta(filename) as fasta:
+        assert len(fasta) == 0
+        assert list(fasta) == []
+
+
+def test_bgzf_fasta(tmp_path):
+    filename = str(tmp_path / 'seqs.fa.gz')
+    records = [('s{}'.format(i), ''.join(random.choice('ACGT') for _ in range(random.randint(0, 3000))))
+               for i in range(100)]
+    with io.BufferedWriter(BgzfWriter(filename, threads=2), buffer_size=1 << 20) as fh:
+        fh.write(fasta_text(records).encode('ascii'))
+    # sequences span the BGZF blocks
+    with IndexedFasta(filename) as fasta:
+        check_records(fasta, records)
+    assert os.path.exists(filename + '.fai')
+    assert os.path.exists(filename + '.gzi')
+    with IndexedFasta(filename) as fasta:
+        assert list(fasta) == records
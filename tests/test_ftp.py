@@ -0,0 +1,162 @@
+import ftplib
+import os
+from threading import Lock
+
+from pipeapp.lib.shell import FTPConnectionPool, ftp_get_file, ftp_get_files, ftp_stat
+
+HOST = 'ftp.example.org'
+
+
+class FakeServer:
+    """ In-process stand-in for an FTP server: files, injected transfer failures, connection and REST log. """
+
+    def __init__(self, files):
+        self.files = dict(files)  # path -> (data, MDTM string)
+        self.fail_after = []  # bytes sent before each of the next transfers breaks
+        self.connections = 0
+        self.rests = []
+        self.lock = Lock()
+
+    def connect(self, host):
+        assert host == HOST
+        with self.lock:
+            self.connections += 1
+        return FakeFTP(self)
+
+
+class FakeFTP:
+    """ The subset of `ftplib.FTP` used by the pool and the download functions. """
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def voidcmd(self, cmd):
+        assert not self.closed
+        return '200 OK'
+
+    def size(self, remote_path):
+        if remote_path not in self.server.files:
+            raise ftplib.error_perm('550 No such file')
+        return len(self.server.files[remote_path][0])
+
+    def sendcmd(self, cmd):
+        verb, remote_path = cmd.split(' ', 1)
+        assert verb == 'MDTM'
+        if remote_path not in self.server.files:
+            raise ftplib.error_perm('550 No such file')
+        return '213 ' + self.server.files[remote_path][1]
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        remote_path = cmd.split(' ', 1)[1]
+        data = self.server.files[remote_path][0][rest or 0:]
+        with self.server.lock:
+            self.server.rests.append(rest)
+            fail_after = self.server.fail_after.pop(0) if self.server.fail_after else None
+        if fail_after is not None:
+            callback(data[:fail_after])
+            raise ftplib.error_temp('426 Connection closed; transfer aborted')
+        for start in range(0, len(data), blocksize):
+            callback(data[start:start + blocksize])
+        return '226 Transfer complete'
+
+    def close(self):
+        self.closed = True
+
+    def quit(self):
+        self.close()
+
+
+DATA = bytes(range(256)) * 1000
+
+
+def make_pool(server, max_connections=4):
+    return FTPConnectionPool(max_connections=max_connections, factory=server.connect)
+
+
+def test_download_and_pool_reuse(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000'), '/pub/b.bin': (DATA[:100], '20260101000000')})
+    pool = make_pool(server)
+    for name in ('a.bin', 'b.bin', 'a.bin'):
+        fout = str(tmp_path / name)
+        assert ftp_get_file('ftp://{}/pub/{}'.format(HOST, name), fout, pool=pool)
+    assert open(str(tmp_path / 'a.bin'), 'rb').read() == DATA
+    assert open(str(tmp_path / 'b.bin'), 'rb').read() == DATA[:100]
+    assert ftp_stat('ftp://{}/pub/a.bin'.format(HOST), pool=pool) == (len(DATA), '20260101000000')
+    # one logged-in connection served all the calls
+    assert server.connections == 1
+    assert sorted(os.listdir(str(tmp_path))) == ['a.bin', 'b.bin']
+    pool.close()
+
+
+def test_download_many(tmp_path):
+    files = {'/pub/f{}.bin'.format(i): (DATA[i:], '20260101000000') for i in range(10)}
+    server = FakeServer(files)
+    pool = make_pool(server, max_connections=2)
+    urls = ['ftp://{}{}'.format(HOST, f) for f in sorted(files)]
+    results = ftp_get_files(urls, str(tmp_path / 'out'), threads=4, pool=pool)
+    assert results == dict.fromkeys(urls, True)
+    for f, (data, _) in files.items():
+        assert open(str(tmp_path / 'out' / os.path.basename(f)), 'rb').read() == data
+    assert server.connections <= 2
+
+
+def test_retry_resumes_transfer(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000')})
+    server.fail_after = [1000, 5000]
+    fout = str(tmp_path / 'a.bin')
+    assert ftp_get_file('ftp://{}/pub/a.bin'.format(HOST), fout, pool=make_pool(server), retries=2)
+    assert open(fout, 'rb').read() == DATA
+    assert server.rests == [None, 1000, 6000]
+    # a failed transfer drops its connection
+    assert server.connections == 3
+    assert os.listdir(str(tmp_path)) == ['a.bin']
+
+
+def test_resume_between_calls(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000')})
+    server.fail_after = [2000]
+    pool = make_pool(server)
+    url = 'ftp://{}/pub/a.bin'.format(HOST)
+    fout = str(tmp_path / 'a.bin')
+    assert not ftp_get_file(url, fout, pool=pool, retries=0)
+    assert not os.path.exists(fout)
+    assert os.path.getsize(fout + '.part') == 2000
+    assert ftp_get_file(url, fout, pool=pool, retries=0)
+    assert open(fout, 'rb').read() == DATA
+    assert server.rests == [None, 2000]
+
+
+def test_changed_remote_file_restarts(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000')})
+    server.fail_after = [2000]
+    pool = make_pool(server)
+    url = 'ftp://{}/pub/a.bin'.format(HOST)
+    fout = str(tmp_path / 'a.bin')
+    assert not ftp_get_file(url, fout, pool=pool, retries=0)
+    # same size, new content
+    new_data = DATA[::-1]
+    server.files['/pub/a.bin'] = (new_data, '20260102000000')
+    assert ftp_get_file(url, fout, pool=pool, retries=0)
+    assert open(fout, 'rb').read() == new_data
+    assert server.rests == [None, None]
+
+
+def test_existing_output_is_replaced(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000')})
+    fout = str(tmp_path / 'a.bin')
+    with open(fout, 'wb') as fh:
+        fh.write(b'stale content of an older version')
+    assert ftp_get_file('ftp://{}/pub/a.bin'.format(HOST), fout, pool=make_pool(server))
+    assert open(fout, 'rb').read() == DATA
+    assert server.rests == [None]
+
+
+def test_no_resume_removes_partial_file(tmp_path):
+    server = FakeServer({'/pub/a.bin': (DATA, '20260101000000')})
+    server.fail_after = [100, 100]
+    fout = str(tmp_path / 'a.bin')
+    assert not ftp_get_file('ftp://{}/pub/a.bin'.format(HOST), fout, pool=make_pool(server), resume=False,
+                            retries=1)
+    assert os.listdir(str(tmp_path)) == []
+    assert server.rests == [None, None]
@@ -0,0 +1,95 @@
+import gzip
+import os
+
+import pytest
+
+from pipeapp.lib.shell import IndexedLineFile, IndexedTabFile, tab_file_reader
+
+
+def write(tmp_path, name, data):
+    filename = str(tmp_path / name)
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    return filename
+
+
+def test_lines(tmp_path):
+    filename = write(tmp_path, 'lines.txt', b'first\nsecond\r\n\nlast')  # no newline at the end
+    with IndexedLineFile(filename) as lines:
+        assert len(lines) == 4
+        assert list(lines) == ['first', 'second', '', 'last']
+        assert lines[1] == 'second'
+        assert lines[-1] == 'last'
+        assert lines[1:3] == ['second', '']
+        assert lines[::-1] == ['last', '', 'second', 'first']
+        with pytest.raises(IndexError):
+            lines[4]
+        with pytest.raises(IndexError):
+            lines[-5]
+
+
+def test_empty_file(tmp_path):
+    filename = write(tmp_path, 'empty.txt', b'')
+    with IndexedLineFile(filename) as lines:
+        assert len(lines) == 0
+        assert list(lines) == []
+
+
+def test_index_is_saved_and_reused(tmp_path, monkeypatch):
+    filename = write(tmp_path, 'lines.txt', b''.join(b'line %d\n' % i for i in range(1000)))
+    with IndexedLineFile(filename) as lines:
+        assert len(lines) == 1000
+    assert os.path.exists(filename + '.lidx')
+
+    # the saved index is loaded: the file is not scanned again
+    monkeypatch.setattr(IndexedLineFile, '_build_index', lambda self: pytest.fail('index was rebuilt'))
+    with IndexedLineFile(filename) as lines:
+        assert lines[999] == 'line 999'
+    monkeypatch.undo()
+
+    # a changed file (size, mtime) invalidates the index
+    with open(filename, 'ab') as fh:
+        fh.write(b'line 1000\n')
+    with IndexedLineFile(filename) as lines:
+        assert len(lines) == 1001
+        assert lines[-1] == 'line 1000'
+
+
+def test_no_saved_index(tmp_path):
+    filename = write(tmp_path, 'lines.txt', b'a\nb\n')
+    index_filename = str(tmp_path / 'other.idx')
+    with IndexedLineFile(filename, index_filename=index_filename, save_index=False) as lines:
+        assert list(lines) == ['a', 'b']
+    assert not os.path.exists(index_filename)
+    assert not os.path.exists(filename + '.lidx')
+
+
+def test_compressed_file(tmp_path):
+    filename = str(tmp_path / 'lines.txt.gz')
+    with gzip.open(filename, 'wb') as fh:
+        fh.write(b'a\nb\n')
+    with pytest.raises(ValueError):
+        IndexedLineFile(filename)
+
+
+def test_tab_file(tmp_path):
+    filename = write(tmp_path, 'genes.tsv', b'#gene\tlength\tscore\ng1\t100\t0.5\ng2\t200\t1.5\ng3\t300\t2.5\n')
+    with IndexedTabFile(filename) as records:
+        assert records.fieldnames == ['gene', 'length', 'score']
+        assert len(records) == 3
+        assert records[0] == {'gene': 'g1', 'length': '100', 'score': '0.5'}
+        assert records[-1]['gene'] == 'g3'
+        assert [r['gene'] for r in records[1:]] == ['g2', 'g3']
+        assert list(records) == list(tab_file_reader(filename))
+
+    with IndexedTabFile(filename, headline=False, fieldnames=['a', 'b', 'c']) as records:
+        assert len(records) == 4
+        assert records[1] == {'a': 'g1', 'b': '100', 'c': '0.5'}
+
+
+def test_empty_tab_file(tmp_path):
+    filename = write(tmp_path, 'empty.tsv', b'')
+    with IndexedTabFile(filename) as records:
+        assert records.fieldnames is None
+        assert len(records) == 0
+        assert list(records) == []
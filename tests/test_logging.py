@@ -0,0 +1,91 @@
+import json
+import logging
+
+import pytest
+
+from pipeapp.lib import app as app_module
+from pipeapp.lib.app import BasicApp, JsonLinesFormatter
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    apps = []
+
+    def make_app(name='log_app', **kwargs):
+        kwargs.setdefault('log', str(tmp_path / 'app.log'))
+        app = BasicApp(name=name, no_conf_root_key=True, **kwargs)
+        apps.append(app)
+        return app
+    yield make_app
+    for app in apps:
+        installed = app_module._log_handlers.get(app.log.name)
+        if installed is not None:
+            installed.remove()
+
+
+def read_lines(filename):
+    with open(filename) as fh:
+        return fh.read().splitlines()
+
+
+def test_json_lines_formatter():
+    record = logging.LogRecord('pipeapp', logging.WARNING, __file__, 1, 'value %s', ('x',), None)
+    entry = json.loads(JsonLinesFormatter().format(record))
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'pipeapp'
+    assert entry['message'] == 'value x'
+    assert len(entry['time']) == len('2024-01-01T00:00:00.000')
+    assert 'exception' not in entry
+
+
+def test_json_logfile(make_app, tmp_path):
+    app = make_app(log_format='json')
+    app.log.debug('debug message')
+    try:
+        raise ValueError('bad value')
+    except ValueError:
+        app.log.exception('failed')
+    app.flush_log()
+    entries = [json.loads(line) for line in read_lines(str(tmp_path / 'app.log'))]
+    assert [e['message'] for e in entries[-2:]] == ['debug message', 'failed']
+    # the traceback is kept apart from the message
+    assert 'ValueError: bad value' in entries[-1]['exception']
+    assert all(e['logger'] == app.log.name for e in entries)
+
+
+def test_text_logfile_and_levels(make_app, tmp_path, capsys):
+    app = make_app(log_file_level='INFO')
+    app.log.debug('hidden')
+    app.log.info('shown')
+    app.flush_log()
+    lines = read_lines(str(tmp_path / 'app.log'))
+    assert lines[-1].endswith('\tINFO:\tshown')
+    assert not any('hidden' in line for line in lines)
+    assert 'shown' in capsys.readouterr().out
+
+
+def test_app_created_again(make_app, tmp_path, capsys):
+    make_app()
+    logger = make_app().log
+    # the handlers are installed once
+    assert len(logger.handlers) == 2
+    logger.info('once')
+    app_module._log_handlers[logger.name].flush()
+    assert capsys.readouterr().out.count('once') == 1
+    assert sum('once' in line for line in read_lines(str(tmp_path / 'app.log'))) == 1
+
+    # another logfile: the handlers are replaced
+    app = make_app(log=str(tmp_path / 'other.log'))
+    assert len(app.log.handlers) == 2
+    app.log.info('other')
+    app.flush_log()
+    assert any(line.endswith('other') for line in read_lines(str(tmp_path / 'other.log')))
+    assert not any(line.endswith('other') for line in read_lines(str(tmp_path / 'app.log')))
+
+    # without a logfile: only the console handler
+    assert len(make_app(log=None).log.handlers) == 1
+
+
+def test_unknown_log_format(make_app):
+    with pytest.raises(ValueError):
+        make_app(log_format='xml')
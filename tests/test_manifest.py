@@ -0,0 +1,145 @@
+import os
+
+import pytest
+
+from pipeapp.lib import shell
+from pipeapp.lib.manifest import ManifestFile, ManifestEntry
+from pipeapp.lib.shell import FileHashCache
+
+
+def write(filename, text):
+    with open(filename, 'w') as fh:
+        fh.write(text)
+
+
+@pytest.fixture
+def files(tmp_path):
+    data = tmp_path / 'data'
+    data.mkdir()
+    names = []
+    for i in range(5):
+        name = str(data / 'f{}.faa'.format(i))
+        write(name, '>seq{}\nACGT\n'.format(i))
+        names.append(name)
+    return names
+
+
+def test_write_read_append(tmp_path, files):
+    filename = str(tmp_path / 'files.manifest')
+    written = ManifestFile(filename, entries=files[:3], generator='test', action='write')
+    assert written.write_stats['entries'] == 3
+    mft = ManifestFile(filename, action='read')
+    assert mft.entries == files[:3]
+    assert mft.metadata == {}
+    with ManifestFile(filename, action='append') as appended:
+        appended.append(files[3])
+        appended.extend(files[4:])
+    mft = ManifestFile(filename, action='iter')
+    assert list(mft) == files
+    assert files[4] in mft
+    assert os.path.join(os.path.dirname(files[0]), '.', 'f0.faa') in mft
+    assert str(tmp_path / 'missing') not in mft
+    with pytest.raises(Exception):
+        ManifestFile(filename, action='delete')
+
+
+def test_metadata(tmp_path, files):
+    filename = str(tmp_path / 'files.manifest')
+    ManifestFile(filename, entries=files, action='write', metadata=True)
+    mft = ManifestFile(filename, action='read')
+    assert mft.entries == files
+    st = os.stat(files[0])
+    entry = mft.metadata[files[0]]
+    assert (entry.size, entry.mtime) == (st.st_size, st.st_mtime_ns)
+    assert entry.hash == shell.file_hash(files[0])
+    assert list(mft.iter_entries(metadata=True))[0] == entry
+
+
+def test_diff(tmp_path, files):
+    old_filename = str(tmp_path / 'old.manifest')
+    new_filename = str(tmp_path / 'new.manifest')
+    ManifestFile(old_filename, entries=files[:4], action='write', metadata=True)
+    # f1 has new content, f2 is only touched (same content), f3 is removed, f4 is added
+    write(files[1], '>seq1\nACGTACGT\n')
+    os.utime(files[2], ns=(1, 1))
+    ManifestFile(new_filename, entries=[files[0], files[1], files[2], files[4]], action='write', metadata=True)
+    old = ManifestFile(old_filename, action='read')
+    new = ManifestFile(new_filename, action='read')
+    diff = new.diff(old)
+    assert diff.added == [files[4]]
+    assert diff.removed == [files[3]]
+    assert diff.changed == [files[1]]
+
+
+def test_diff_without_hashes(tmp_path, files):
+    old = ManifestFile(str(tmp_path / 'old.manifest'), entries=files[:2], action='iter')
+    old.metadata = {files[0]: ManifestEntry(files[0], 10, 1, None), files[1]: ManifestEntry(files[1], 10, 1, None)}
+    new = ManifestFile(str(tmp_path / 'new.manifest'), entries=files[:2], action='iter')
+    new.metadata = {files[0]: ManifestEntry(files[0], 10, 1, 'abc'), files[1]: ManifestEntry(files[1], 10, 2, 'abc')}
+    # size and mtime are compared, if either manifest has no hash
+    assert new.diff(old).changed == [files[1]]
+    # no metadata at all: unchanged
+    plain = ManifestFile(str(tmp_path / 'plain.manifest'), entries=files[:2], action='iter')
+    assert new.diff(plain) == ([], [], [])
+
+
+def test_hash_cache_is_persisted(tmp_path, files, monkeypatch):
+    filename = str(tmp_path / 'files.manifest')
+    cache_file = str(tmp_path / 'cache' / 'files.hashes')
+    os.makedirs(os.path.dirname(cache_file))
+    ManifestFile(filename, entries=files, action='write', metadata=True, hash_cache=cache_file)
+    assert os.path.exists(cache_file)
+
+    # the next run does not hash the unchanged files again
+    hashed = []
+    file_hash = shell.file_hash
+    monkeypatch.setattr(shell, 'file_hash', lambda f: hashed.append(f) or file_hash(f))
+    write(files[0], '>seq0\nTTTT\n')
+    mft = ManifestFile(filename, entries=files, action='write', metadata=True, hash_cache=cache_file)
+    assert hashed == [files[0]]
+    assert mft.metadata[files[0]].hash == file_hash(files[0])
+
+    # hashes of the files that are not in the rewritten manifest are dropped
+    ManifestFile(filename, entries=files[:2], action='write', metadata=True, hash_cache=cache_file)
+    assert len(FileHashCache(cache_file)) == 2
+    assert hashed == [files[0]]
+
+
+def test_hash_cache_in_memory(tmp_path, files):
+    filename = str(tmp_path / 'files.manifest')
+    # by default, nothing but the manifest is written
+    ManifestFile(filename, entries=files, action='write', metadata=True)
+    assert sorted(os.listdir(str(tmp_path))) == ['data', 'files.manifest']
+    cache = FileHashCache()
+    ManifestFile(filename, entries=files, action='write', metadata=True, hash_cache=cache)
+    assert len(cache) == len(files)
+    assert sorted(os.listdir(str(tmp_path))) == ['data', 'files.manifest']
+
+
+def test_read_twice(tmp_path, files):
+    filename = str(tmp_path / 'files.manifest')
+    ManifestFile(filename, entries=files, action='write', metadata=True)
+    mft = ManifestFile(filename, action='read')
+    mft.read()
+    assert mft.entries == files
+    assert len(mft.metadata) == len(files)
+    # entries given to the constructor are replaced by the ones read
+    mft = ManifestFile(filename, entries=files[:2], action='iter')
+    mft.read()
+    assert mft.entries == files
+
+
+def test_file_hash_cache(tmp_path, files):
+    cache_file = str(tmp_path / 'hashes.pkl')
+    cache = FileHashCache(cache_file)
+    st = os.stat(files[0])
+    assert cache.get(st) is None
+    cache.set(st, 'abc')
+    cache.save()
+    assert FileHashCache(cache_file).get(st) == 'abc'
+    # a changed file has another key
+    write(files[0], 'changed')
+    assert FileHashCache(cache_file).get(os.stat(files[0])) is None
+    # a broken cache file is ignored
+    write(cache_file, 'not a pickle')
+    assert len(FileHashCache(cache_file)) == 0
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from pipeapp.lib import metrics
+from pipeapp.lib.metrics import PhaseMetrics, usage_delta, read_proc_io, format_usage, metrics_file_name
+
+
+def busy(n=200000):
+    return sum(i * i for i in range(n))
+
+
+def read_entries(filename):
+    with open(filename) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_usage_delta():
+    start = {'wall': 10.0, 'cpu': 1.0, 'children_cpu': 0.5, 'max_rss_kb': 100, 'children_max_rss_kb': 0,
+             'io': {'rchar': 10, 'wchar': 20, 'read_bytes': 0, 'write_bytes': 4096}}
+    end = {'wall': 12.5, 'cpu': 2.25, 'children_cpu': 0.75, 'max_rss_kb': 300, 'children_max_rss_kb': 50,
+           'io': {'rchar': 110, 'wchar': 20, 'read_bytes': 4096, 'write_bytes': 8192}}
+    record = usage_delta(start, end)
+    assert record == {'wall_s': 2.5, 'cpu_s': 1.25, 'children_cpu_s': 0.25, 'max_rss_kb': 300,
+                      'children_max_rss_kb': 50, 'rchar': 100, 'wchar': 0, 'read_bytes': 4096, 'write_bytes': 4096}
+    # I/O counters not available
+    record = usage_delta(dict(start, io=None), end)
+    assert [record[key] for key in metrics.PROC_IO_FIELDS] == [None] * 4
+    record['phase'] = 'run'
+    assert format_usage(record) == 'run: 2.50s wall, 1.25s CPU (0.25s in child processes), 0 MB max RSS'
+    assert format_usage(dict(usage_delta(start, end), phase='run')).endswith('0.0 MB read, 0.0 MB written')
+
+
+def test_read_proc_io(tmp_path, monkeypatch):
+    fake = tmp_path / 'io'
+    fake.write_text('rchar: 100\nwchar: 200\nsyscr: 3\nread_bytes: 4096\nwrite_bytes: 0\n')
+    monkeypatch.setattr(metrics, 'PROC_IO_FILE', str(fake))
+    assert read_proc_io() == {'rchar': 100, 'wchar': 200, 'read_bytes': 4096, 'write_bytes': 0}
+    fake.write_text('garbage\n')
+    assert read_proc_io() is None
+    monkeypatch.setattr(metrics, 'PROC_IO_FILE', str(tmp_path / 'missing'))
+    assert read_proc_io() is None
+
+
+def test_phases_saved(tmp_path):
+    filename = metrics_file_name(str(tmp_path), 'app')
+    metrics_ = PhaseMetrics()
+    with metrics_.phase('init'):
+        busy()
+    with metrics_.phase('run'):
+        subprocess.check_call(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'])
+    with pytest.raises(ValueError):
+        with metrics_.phase('exit'):
+            raise ValueError('failed')
+    metrics_.save(filename, app='app', status='failed')
+    # appended: one line per run
+    metrics_.save(filename, app='app', status='ok')
+
+    entries = read_entries(filename)
+    assert filename == str(tmp_path / 'app.metrics.json')
+    assert [e['status'] for e in entries] == ['failed', 'ok']
+    entry = entries[0]
+    assert entry['app'] == 'app'
+    # a phase that raised is recorded too
+    assert [p['phase'] for p in entry['phases']] == ['init', 'run', 'exit']
+    for record in entry['phases']:
+        assert record['wall_s'] >= 0 and record['cpu_s'] >= 0 and record['max_rss_kb'] > 0
+        assert 'traced_peak_bytes' not in record
+    assert entry['phases'][0]['cpu_s'] > 0
+    assert entry['phases'][1]['children_cpu_s'] > 0
+
+    total = entry['total']
+    assert total['phase'] == 'total'
+    assert total['wall_s'] == pytest.approx(sum(p['wall_s'] for p in entry['phases']), abs=1e-5)
+    assert total['max_rss_kb'] == max(p['max_rss_kb'] for p in entry['phases'])
+    if entry['phases'][0]['rchar'] is not None:
+        assert total['rchar'] == sum(p['rchar'] for p in entry['phases'])
+    # no profiler reports without `profile` or `trace_memory`
+    assert os.listdir(str(tmp_path)) == ['app.metrics.json']
+
+
+def test_profile_and_trace_memory(tmp_path):
+    prefix = str(tmp_path / 'app.run')
+    metrics_ = PhaseMetrics()
+    with metrics_.phase('run', profile=True, trace_memory=True, dump_prefix=prefix):
+        data = [bytes(1000) for _ in range(1000)]
+        busy()
+    with metrics_.phase('exit', trace_memory=True):
+        del data
+    metrics_.save(str(tmp_path / 'app.metrics.json'))
+
+    assert sorted(os.listdir(str(tmp_path))) == ['app.metrics.json', 'app.run.prof', 'app.run.prof.txt',
+                                                 'app.run.tracemalloc.txt']
+    run, exit_ = read_entries(str(tmp_path / 'app.metrics.json'))[0]['phases']
+    assert run['traced_peak_bytes'] >= 1000 * 1000
+    assert exit_['traced_peak_bytes'] < run['traced_peak_bytes']
+
+    import pstats
+    stats = pstats.Stats(prefix + '.prof')
+    assert any(func[2] == 'busy' for func in stats.stats)
+    with open(prefix + '.prof.txt') as fh:
+        assert 'busy' in fh.read()
+    with open(prefix + '.tracemalloc.txt') as fh:
+        lines = fh.read().splitlines()
+    assert lines[0] == '# peak traced memory: {} bytes'.format(run['traced_peak_bytes'])
+    assert any(__file__ in line for line in lines[2:])
@@ -0,0 +1,61 @@
+import gzip
+
+import pytest
+
+from pipeapp.lib.shell import parallel_map_tab, tab_file_ranges, tab_file_reader
+
+
+def gene_length(record):
+    return record['id'], int(record['end']) - int(record['start'])
+
+
+def write_genes(filename, n=2000, headline=True):
+    with open(filename, 'w') as fh:
+        if headline:
+            fh.write('#id\tstart\tend\n')
+        for i in range(n):
+            fh.write('g{}\t{}\t{}\n'.format(i, i, i + 1 + i % 37))
+    return filename
+
+
+def test_ranges_are_aligned_to_lines(tmp_path):
+    filename = write_genes(str(tmp_path / 'genes.tsv'))
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+    # boundaries fall in the middle of lines
+    header, ranges = tab_file_ranges(filename, chunk_size=1000)
+    assert header == '#id\tstart\tend\n'
+    assert len(ranges) > 10
+    assert ranges[0][0] == len(header)
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[end - 1:end] == b'\n'
+
+    header, ranges = tab_file_ranges(filename, chunk_size=1000, headline=False)
+    assert header is None and ranges[0][0] == 0
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_results_match_serial_map(tmp_path, ordered):
+    filename = write_genes(str(tmp_path / 'genes.tsv'))
+    expected = [gene_length(record) for record in tab_file_reader(filename)]
+    results = list(parallel_map_tab(filename, gene_length, workers=2, chunk_size=997, ordered=ordered))
+    if ordered:
+        assert results == expected
+    else:
+        assert sorted(results) == sorted(expected)
+
+
+def test_file_without_headline(tmp_path):
+    filename = write_genes(str(tmp_path / 'genes.tsv'), n=100, headline=False)
+    results = list(parallel_map_tab(filename, gene_length, workers=2, chunk_size=64, headline=False,
+                                    fieldnames=['id', 'start', 'end']))
+    assert results == [('g{}'.format(i), 1 + i % 37) for i in range(100)]
+
+
+def test_compressed_file(tmp_path):
+    filename = str(tmp_path / 'genes.tsv.gz')
+    with gzip.open(filename, 'wt') as fh:
+        fh.write('#id\n')
+    with pytest.raises(ValueError):
+        tab_file_ranges(filename)
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from pipeapp.lib.app import PipelineApp
+from pipeapp.lib.pipeline import Pipeline, PipelineStep, STATUS_DONE, STATUS_UP_TO_DATE, STATUS_FAILED, \
+    STATUS_NOT_RUN
+
+
+class ConcatApp(PipelineApp):
+    """ Writes the names of its inputs and its own name to `result.txt` in its workdir; logs its run. """
+
+    def init(self, **kwargs):
+        pass
+
+    def run(self, inputs=(), run_log=None, fail=False, **kwargs):
+        with open(run_log, 'a') as fh:
+            fh.write('{}\n'.format(self.name))
+        if fail:
+            raise RuntimeError('step failed')
+        parts = []
+        for dirname in inputs:
+            with open(os.path.join(dirname, 'result.txt')) as fh:
+                parts.append(fh.read().strip())
+        with open(os.path.join(self.workdir, 'result.txt'), 'w') as fh:
+            fh.write('{}({})\n'.format(self.name, ','.join(parts)))
+
+    def exit(self, **kwargs):
+        pass
+
+
+def make_pipeline(base_dir, fail=(), check='mtime', cpus=2):
+    run_log = os.path.join(base_dir, 'run.log')
+
+    def step(name, inputs=(), **kwargs):
+        kwargs = dict(inputs=[os.path.join(base_dir, i) for i in inputs], run_log=run_log, fail=name in fail,
+                      cleanup_mode='sync', **kwargs)
+        return PipelineStep(name, ConcatApp, inputs=inputs, outputs=[name + '.out'], kwargs=kwargs)
+
+    # diamond: a -> (b, c) -> d
+    return Pipeline([step('d', ['b.out', 'c.out']), step('b', ['a.out']), step('c', ['a.out']), step('a')],
+                    base_dir=base_dir, cpus=cpus, check=check)
+
+
+def run_log(base_dir):
+    with open(os.path.join(base_dir, 'run.log')) as fh:
+        steps = fh.read().split()
+    os.remove(os.path.join(base_dir, 'run.log'))
+    return steps
+
+
+def result(base_dir, name):
+    with open(os.path.join(base_dir, name + '.out', 'result.txt')) as fh:
+        return fh.read().strip()
+
+
+def test_dependency_order(tmp_path):
+    base_dir = str(tmp_path)
+    pipeline = make_pipeline(base_dir)
+    assert pipeline.order == ['a', 'b', 'c', 'd']
+    assert pipeline.dependencies == {'a': set(), 'b': {'a'}, 'c': {'a'}, 'd': {'b', 'c'}}
+    assert pipeline.plan(['b']) == ['a', 'b']
+
+    status = pipeline.run()
+    assert status == dict.fromkeys('abcd', STATUS_DONE)
+    steps = run_log(base_dir)
+    assert steps[0] == 'a' and steps[-1] == 'd' and sorted(steps) == ['a', 'b', 'c', 'd']
+    assert result(base_dir, 'd') == 'd(b(a()),c(a()))'
+    assert not os.path.exists(os.path.join(base_dir, 'a.out.tmp'))
+
+
+def test_up_to_date_steps_are_skipped(tmp_path):
+    base_dir = str(tmp_path)
+    make_pipeline(base_dir).run()
+    run_log(base_dir)
+    assert make_pipeline(base_dir).run() == dict.fromkeys('abcd', STATUS_UP_TO_DATE)
+    assert not os.path.exists(os.path.join(base_dir, 'run.log'))
+
+    # a newer output of b: b is up to date, but d (and only d) is not
+    path_b = os.path.join(base_dir, 'b.out')
+    st = os.stat(os.path.join(base_dir, 'd.out'))
+    os.utime(path_b, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert make_pipeline(base_dir).plan() == ['d']
+    assert make_pipeline(base_dir).plan(force=True) == ['a', 'b', 'c', 'd']
+
+
+def test_fingerprint_check(tmp_path):
+    base_dir = str(tmp_path)
+    make_pipeline(base_dir, check='fingerprint').run()
+    run_log(base_dir)
+    assert make_pipeline(base_dir, check='fingerprint').plan() == []
+    # a changed output invalidates the step that wrote it and the steps that depend on it
+    with open(os.path.join(base_dir, 'c.out', 'result.txt'), 'w') as fh:
+        fh.write('edited\n')
+    os.utime(os.path.join(base_dir, 'c.out'), ns=(1, 1))
+    assert make_pipeline(base_dir, check='fingerprint').plan() == ['c', 'd']
+
+
+def test_failure_stops_dependent_steps(tmp_path):
+    base_dir = str(tmp_path)
+    status = make_pipeline(base_dir, fail=('b',), cpus=1).run()
+    assert status['a'] == STATUS_DONE
+    assert status['b'] == STATUS_FAILED
+    assert status['d'] == STATUS_NOT_RUN
+    # no new steps are started after the failure
+    assert status['c'] == STATUS_NOT_RUN
+    assert run_log(base_dir) == ['a', 'b']
+    assert not os.path.exists(os.path.join(base_dir, 'b.out'))
+
+
+def test_keep_going(tmp_path):
+    base_dir = str(tmp_path)
+    status = make_pipeline(base_dir, fail=('b',), cpus=1).run(keep_going=True)
+    assert status == {'a': STATUS_DONE, 'b': STATUS_FAILED, 'c': STATUS_DONE, 'd': STATUS_NOT_RUN}
+    assert sorted(run_log(base_dir)) == ['a', 'b', 'c']
+    # the next run retries the failed step only
+    status = make_pipeline(base_dir).run()
+    assert status == {'a': STATUS_UP_TO_DATE, 'b': STATUS_DONE, 'c': STATUS_UP_TO_DATE, 'd': STATUS_DONE}
+
+
+def test_invalid_pipelines(tmp_path):
+    base_dir = str(tmp_path)
+    with pytest.raises(ValueError, match='cycle'):
+        Pipeline([PipelineStep('a', ConcatApp, inputs=['b.out'], outputs=['a.out']),
+                  PipelineStep('b', ConcatApp, inputs=['a.out'], outputs=['b.out'])], base_dir=base_dir)
+    with pytest.raises(ValueError, match='also output'):
+        Pipeline([PipelineStep('a', ConcatApp, outputs=['x']), PipelineStep('b', ConcatApp, outputs=['x'])],
+                 base_dir=base_dir)
+    with pytest.raises(ValueError, match='unknown step'):
+        Pipeline([PipelineStep('a', ConcatApp, outputs=['x'], after=['z'])], base_dir=base_dir)
+    with pytest.raises(ValueError, match='Duplicate'):
+        Pipeline([PipelineStep('a', ConcatApp, outputs=['x']), PipelineStep('a', ConcatApp, outputs=['y'])],
+                 base_dir=base_dir)
+    with pytest.raises(KeyError):
+        make_pipeline(base_dir).plan(['z'])
@@ -0,0 +1,144 @@
+import random
+from collections import Counter
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from pipeapp.lib import seqbatch  # noqa: E402
+from pipeapp.lib.seqbatch import SequenceBatch, DNA, PROTEIN, encode_sequences, kmer_labels  # noqa: E402
+
+random.seed(11)
+SEQUENCES = [''.join(random.choice('ACGTacgtN') for _ in range(n)) for n in [0, 1, 2, 3, 50, 0, 400, 7, 1000, 4]]
+
+
+@pytest.fixture(params=[seqbatch.CHUNK_RESIDUES, 64, 1])
+def chunk_residues(request, monkeypatch):
+    # small chunks: sequences are processed in many chunks, and longer sequences are chunks of their own
+    monkeypatch.setattr(seqbatch, 'CHUNK_RESIDUES', request.param)
+    return request.param
+
+
+def python_kmer_counts(sequences, k, alphabet=DNA):
+    counts = Counter()
+    for sequence in sequences:
+        sequence = sequence.upper()
+        for i in range(len(sequence) - k + 1):
+            kmer = sequence[i:i + k]
+            if all(residue in alphabet for residue in kmer):
+                counts[kmer] += 1
+    return [counts[kmer] for kmer in kmer_labels(k, alphabet)]
+
+
+def test_packing(tmp_path):
+    batch = encode_sequences(SEQUENCES)
+    assert len(batch) == len(SEQUENCES)
+    assert batch.names == list(range(len(SEQUENCES)))
+    assert list(batch.lengths) == [len(s) for s in SEQUENCES]
+    assert batch.total_length == sum(map(len, SEQUENCES))
+    assert [batch[i] for i in range(len(batch))] == SEQUENCES
+
+    batch = SequenceBatch.from_records([('a', b'ACGT'), ('b', ''), ('c', 'MKV')])
+    assert batch.names == ['a', 'b', 'c'] and batch[2] == 'MKV'
+
+    filename = str(tmp_path / 'seqs.fa')
+    with open(filename, 'w') as fh:
+        fh.write('>x\nACGT\nAC\n>y\n>z\nGG\n')
+    batch = SequenceBatch.from_fasta(filename)
+    assert batch.names == ['x', 'y', 'z']
+    assert [batch[i] for i in range(3)] == ['ACGTAC', '', 'GG']
+
+    batch = SequenceBatch.from_sequences([])
+    assert len(batch) == 0 and batch.total_length == 0
+
+
+def test_take_and_filter():
+    batch = SequenceBatch.from_sequences(SEQUENCES, names=['s{}'.format(i) for i in range(len(SEQUENCES))])
+    part = batch[2:5]
+    assert part.names == ['s2', 's3', 's4']
+    assert [part[i] for i in range(len(part))] == SEQUENCES[2:5]
+    part = batch.take([8, 0, 6])
+    assert [part[i] for i in range(len(part))] == [SEQUENCES[8], SEQUENCES[0], SEQUENCES[6]]
+    part = batch[numpy.array([len(s) % 2 == 1 for s in SEQUENCES])]
+    assert [part[i] for i in range(len(part))] == [s for s in SEQUENCES if len(s) % 2 == 1]
+
+    part = batch.filter_length(min_length=3, max_length=400)
+    assert [part[i] for i in range(len(part))] == [s for s in SEQUENCES if 3 <= len(s) <= 400]
+    assert len(batch.filter_length(min_length=1)) == len(SEQUENCES) - 2
+    assert len(batch.filter_length(min_length=5000)) == 0
+
+
+@pytest.mark.parametrize('run_copy_residues', [1, 1 << 30])
+def test_take(monkeypatch, run_copy_residues):
+    # runs of sequences copied one by one, or residues gathered by a mask or by their positions
+    monkeypatch.setattr(seqbatch, 'RUN_COPY_RESIDUES', run_copy_residues)
+    names = ['s{}'.format(i) for i in range(len(SEQUENCES))]
+    batch = SequenceBatch.from_sequences(SEQUENCES, names=names)
+    mask = numpy.array([i % 3 != 1 for i in range(len(SEQUENCES))])
+    for indices in [slice(2, 5), slice(None, None, -2), slice(8, 2), [8, 0, 6], [3, 4, 5, 3, 4], [-1], [],
+                    numpy.array([6, 7, 8, 9]), mask, ~mask]:
+        expected = numpy.arange(len(SEQUENCES))[indices].tolist()
+        part = batch.take(indices)
+        assert part.names == [names[i] for i in expected]
+        assert [part[i] for i in range(len(part))] == [SEQUENCES[i] for i in expected]
+        assert part.total_length == len(part.data) == sum(len(SEQUENCES[i]) for i in expected)
+    # a contiguous range of sequences shares the buffer
+    assert numpy.shares_memory(batch[6:9].data, batch.data)
+    assert numpy.shares_memory(batch.take(numpy.arange(len(SEQUENCES)) > 5).data, batch.data)
+    with pytest.raises(IndexError):
+        batch.take([len(SEQUENCES)])
+    with pytest.raises(IndexError):
+        batch.take(mask[1:])
+
+
+def test_length_stats():
+    stats = SequenceBatch.from_sequences(['A' * n for n in [2, 3, 4, 5, 6, 10]]).length_stats()
+    # half of the total (15) is reached by 10 + 6
+    assert stats == {'count': 6, 'total': 30, 'min': 2, 'max': 10, 'mean': 5.0, 'median': 4.5, 'n50': 6}
+    assert SequenceBatch.from_sequences([]).length_stats()['n50'] == 0
+
+
+def test_residue_counts(chunk_residues):
+    batch = SequenceBatch.from_sequences(SEQUENCES)
+    counts = batch.residue_counts(DNA)
+    assert counts.shape == (len(SEQUENCES), 4)
+    for row, sequence in zip(counts, SEQUENCES):
+        upper = Counter(sequence.upper())
+        assert list(row) == [upper[residue] for residue in DNA]
+    counts = batch.residue_counts('ACgt', ignore_case=False)
+    for row, sequence in zip(counts, SEQUENCES):
+        assert list(row) == [Counter(sequence)[residue] for residue in 'ACgt']
+
+    composition = batch.composition(DNA)
+    assert list(composition[0]) == [0.0] * 4
+    expected = [Counter(SEQUENCES[4].upper())[residue] / len(SEQUENCES[4]) for residue in DNA]
+    assert numpy.allclose(composition[4], expected)
+    proteins = SequenceBatch.from_sequences(['MKVLA', 'WWY'])
+    assert proteins.residue_counts(PROTEIN)[1, PROTEIN.index('W')] == 2
+
+
+def test_gc_content(chunk_residues):
+    batch = SequenceBatch.from_sequences(SEQUENCES)
+    expected = [sum(s.upper().count(r) for r in 'GC') / len(s) if s else 0.0 for s in SEQUENCES]
+    assert numpy.allclose(batch.gc_content(), expected)
+    assert list(batch.count_residues('N')) == [s.count('N') for s in SEQUENCES]
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 5])
+def test_kmer_counts(chunk_residues, k):
+    batch = SequenceBatch.from_sequences(SEQUENCES)
+    # windows across the sequence boundaries and windows with N are not counted
+    assert list(batch.kmer_counts(k)) == python_kmer_counts(SEQUENCES, k)
+    counts = batch.kmer_counts(k, ignore_case=False)
+    assert list(counts) == python_kmer_counts([s.replace('a', 'N').replace('c', 'N').replace('g', 'N')
+                                               .replace('t', 'N') for s in SEQUENCES], k)
+
+
+def test_kmer_errors_and_labels():
+    batch = SequenceBatch.from_sequences(['ACGT'])
+    with pytest.raises(ValueError):
+        batch.kmer_counts(0)
+    with pytest.raises(ValueError):
+        batch.kmer_counts(10, alphabet=PROTEIN)
+    assert kmer_labels(2, 'AB') == ['AA', 'AB', 'BA', 'BB']
+    assert list(batch.kmer_counts(5)) == [0] * 4 ** 5
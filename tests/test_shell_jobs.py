@@ -0,0 +1,57 @@
+import os
+
+from pipeapp.lib.shell import ShellJob, run_shell_job, run_shell_jobs, conf_threads
+
+
+def test_run_shell_jobs(tmp_path):
+    results = run_shell_jobs(['echo one', 'exit 3', ShellJob('echo two >&2', name='err')], threads=2,
+                             output_dir=str(tmp_path))
+    assert [r.name for r in results] == ['job_0', 'job_1', 'err']
+    assert [r.returncode for r in results] == [0, 3, 0]
+    assert [r.attempts for r in results] == [1, 1, 1]
+    assert not any(r.timed_out for r in results)
+    assert open(str(tmp_path / 'job_0.out')).read() == 'one\n'
+    assert open(str(tmp_path / 'err.err')).read() == 'two\n'
+    assert results[2].stderr == str(tmp_path / 'err.err')
+
+
+def test_retries(tmp_path):
+    counter = str(tmp_path / 'counter')
+    # fails on the first two attempts
+    cmd = 'echo x >> {0}; test $(wc -l < {0}) -ge 3'.format(counter)
+    result = run_shell_job(ShellJob(cmd, retries=5))
+    assert (result.returncode, result.attempts) == (0, 3)
+    result = run_shell_jobs(['exit 1'], retries=2)[0]
+    assert (result.returncode, result.attempts) == (1, 3)
+
+
+def test_timeout_kills_process_group(tmp_path):
+    marker = str(tmp_path / 'marker')
+    # the background child is in the same process group as the shell, so it is killed as well
+    cmd = '(sleep 1; touch {}) & sleep 5'.format(marker)
+    result = run_shell_jobs([ShellJob(cmd, timeout=0.3)])[0]
+    assert result.timed_out
+    assert result.returncode < 0
+    assert result.wall_time < 4
+    run_shell_jobs(['sleep 1.2'])
+    assert not os.path.exists(marker)
+
+
+def test_timeout_not_reached():
+    result = run_shell_jobs(['true'], timeout=5)[0]
+    assert (result.returncode, result.timed_out) == (0, False)
+
+
+def test_same_stdout_and_stderr(tmp_path):
+    log = str(tmp_path / 'job.log')
+    job = ShellJob('echo out1; echo err1 >&2; echo out2; echo err2 >&2', stdout=log, stderr=log)
+    result = run_shell_jobs([job])[0]
+    assert result.returncode == 0
+    assert open(log).read().split() == ['out1', 'err1', 'out2', 'err2']
+
+
+def test_conf_threads():
+    assert conf_threads({'threads': 3}) == 3
+    assert conf_threads({'THREADS': '2'}) == 2
+    assert conf_threads({}, default=5) == 5
+    assert conf_threads(None) >= 1
@@ -0,0 +1,71 @@
+import signal
+
+import pytest
+
+from pipeapp.lib.shell import ShellPipeline, split_shell_pipe, run_shell_cmd
+
+PIPE_BUFFER = 1 << 16  # default pipe capacity on Linux
+
+
+def test_split_shell_pipe():
+    assert split_shell_pipe('sort -k2,2 | uniq -c') == [['sort', '-k2,2'], ['uniq', '-c']]
+    assert split_shell_pipe("grep 'a|b' x") == [['grep', 'a|b', 'x']]
+
+
+def test_large_stderr_does_not_block():
+    # every stage writes more to stderr than a pipe holds before it writes to stdout
+    script = 'head -c {} /dev/zero | tr "\\0" e >&2; echo {}'
+    cmds = [['sh', '-c', script.format(4 * PIPE_BUFFER, 'first')],
+            ['sh', '-c', 'cat; ' + script.format(4 * PIPE_BUFFER, 'second')]]
+    with ShellPipeline(cmds) as pipe:
+        lines = list(pipe)
+    assert lines == ['first\n', 'second\n']
+    assert pipe.returncodes == [0, 0]
+    assert [len(s) for s in pipe.stderr] == [4 * PIPE_BUFFER] * 2
+
+
+def test_generator_stdin():
+    n = 100000
+
+    def records():
+        for i in range(n):
+            yield {'id': 'g{}'.format(i), 'length': i % 1000}
+
+    with ShellPipeline('sort -k2,2n -k1,1 | cut -f1', stdin=records()) as pipe:
+        lines = list(pipe)
+    assert pipe.returncodes == [0, 0]
+    assert len(lines) == n
+    assert lines[:2] == ['g0\n', 'g1000\n']
+
+    with ShellPipeline([['cat']], stdin=iter(['a', b'b\n', ('c', 1)])) as pipe:
+        assert list(pipe) == ['a\n', 'b\n', 'c\t1\n']
+
+
+def test_consumer_exits_early():
+    # `yes` gets SIGPIPE when `head` exits, instead of running (or blocking) forever
+    with ShellPipeline('yes | head -n 3') as pipe:
+        assert list(pipe) == ['y\n'] * 3
+    assert pipe.returncodes == [-signal.SIGPIPE, 0]
+
+    # the caller stops reading: the rest of the output is discarded on exit
+    with ShellPipeline('seq 1000000') as pipe:
+        assert next(iter(pipe)) == '1\n'
+    assert pipe.returncodes == [0]
+
+
+def test_stdin_error_is_raised():
+    def records():
+        yield 'a'
+        raise RuntimeError('broken input')
+
+    with pytest.raises(RuntimeError, match='broken input'):
+        with ShellPipeline('cat', stdin=records()) as pipe:
+            list(pipe)
+
+
+def test_run_shell_cmd():
+    stdout, stderr = run_shell_cmd('printf "b\\na\\n" | sort')
+    assert stdout.read() == b'a\nb\n'
+    assert stderr.read() == b''
+    stdout.close()
+    stderr.close()
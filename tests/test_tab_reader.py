@@ -0,0 +1,79 @@
+"""
+Tests of the batched, typed tab file reader.
+"""
+
+import gzip
+
+import pytest
+
+from pipeapp.lib.shell import TabBatchReader, tab_batch_reader, tab_file_reader
+
+LINES = ['#id\tcontig\tstart\tscore\n', 'g1\tc1\t10\t0.5\n', 'g2\tc2\t20\t1.5\n', 'g3\tc1\t30\t2.5\n']
+
+
+@pytest.fixture
+def tab_file(tmp_path):
+    filename = tmp_path / 'genes.tsv'
+    filename.write_text(''.join(LINES))
+    return str(filename)
+
+
+def test_records_are_projected_and_typed(tab_file):
+    batches = list(tab_batch_reader(tab_file, columns=['start', 'id'], dtypes={'start': int}))
+    assert len(batches) == 1
+    assert [(r.start, r.id) for r in batches[0]] == [(10, 'g1'), (20, 'g2'), (30, 'g3')]
+
+
+def test_columns_output_and_batch_size(tab_file):
+    batches = list(TabBatchReader(tab_file, columns=['score'], dtypes={'score': float}, batch_size=2,
+                                  output='columns'))
+    assert batches == [{'score': [0.5, 1.5]}, {'score': [2.5]}]
+
+
+def test_categories_are_encoded_across_batches(tab_file):
+    reader = TabBatchReader(tab_file, columns=['contig'], dtypes={'contig': 'category'}, batch_size=1,
+                            output='columns')
+    codes = [code for batch in reader for code in batch['contig']]
+    assert codes == [0, 1, 0]
+    assert reader.categories['contig'] == ['c1', 'c2']
+
+
+def test_gzipped_file_without_headline(tmp_path):
+    filename = str(tmp_path / 'genes.tsv.gz')
+    with gzip.open(filename, 'wt') as fh:
+        fh.write(''.join(LINES[1:]))
+    batches = list(tab_batch_reader(filename, headline=False, fieldnames=['id', 'contig', 'start', 'score'],
+                                    columns=['id', 'start'], dtypes={'start': 'int'}, output='columns'))
+    assert batches == [{'id': ['g1', 'g2', 'g3'], 'start': [10, 20, 30]}]
+
+
+def test_blank_lines_are_skipped(tmp_path):
+    filename = tmp_path / 'blank.tsv'
+    filename.write_text(LINES[0] + LINES[1] + '\n' + LINES[2] + '\r\n\n')
+    batches = list(tab_batch_reader(str(filename), columns=['start'], dtypes={'start': int}, batch_size=2,
+                                    output='columns'))
+    assert [v for batch in batches for v in batch['start']] == [10, 20]
+    assert all(batch['start'] for batch in batches)
+
+
+def test_same_records_as_tab_file_reader(tab_file):
+    records = [r._asdict() for batch in tab_batch_reader(tab_file) for r in batch]
+    assert records == list(tab_file_reader(tab_file))
+
+
+def test_errors(tab_file, tmp_path):
+    with pytest.raises(KeyError):
+        list(tab_batch_reader(tab_file, columns=['no_such_column']))
+    with pytest.raises(ValueError):
+        TabBatchReader(tab_file, dtypes={'start': complex})
+    short = tmp_path / 'short.tsv'
+    short.write_text(LINES[0] + 'g1\tc1\n')
+    with pytest.raises(ValueError):
+        list(tab_batch_reader(str(short), columns=['score']))
+
+
+def test_numpy_output(tab_file):
+    numpy = pytest.importorskip('numpy')
+    batch = next(iter(TabBatchReader(tab_file, dtypes={'start': int, 'contig': 'category'}, output='numpy')))
+    assert batch['start'].dtype == numpy.int64 and batch['start'].sum() == 60
+    assert batch['contig'].tolist() == [0, 1, 0]
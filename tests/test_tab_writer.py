@@ -0,0 +1,154 @@
+import errno
+import gzip
+import os
+
+import pytest
+
+from pipeapp.lib import shell
+from pipeapp.lib.codec import is_bgzf
+from pipeapp.lib.shell import TabFileWriter, TabBatchReader, tab_file_writer, tab_file_reader
+
+
+def test_write_rows(tmp_path):
+    filename = str(tmp_path / 'genes.tsv')
+    with tab_file_writer(filename, ['id', 'len', 'note']) as writer:
+        writer.write({'id': 'g1', 'len': 100})
+        writer.write(('g2', 200, 'x'))
+        writer.write_rows([{'id': 'g3', 'len': 300, 'note': None}, {'id': 'g4', 'len': 400, 'note': 'y'}])
+        writer.write_rows(iter([('g5', 500, 'z')]))
+        writer.write_columns({'id': ['g6', 'g7'], 'len': [600, 700], 'note': ['a', 'b']})
+        writer.write_columns([['g8'], [800], ['c']])
+        # nothing is visible under the final name before the writer is closed
+        assert not os.path.exists(filename)
+    assert writer.nrows == 8
+    assert os.listdir(str(tmp_path)) == ['genes.tsv']
+    with open(filename) as fh:
+        lines = fh.read().splitlines()
+    assert lines[:3] == ['#id\tlen\tnote', 'g1\t100\t', 'g2\t200\tx']
+    records = list(tab_file_reader(filename))
+    assert [r['id'] for r in records] == ['g{}'.format(i) for i in range(1, 9)]
+    assert lines[3] == 'g3\t300\t'
+    assert records[3] == {'id': 'g4', 'len': '400', 'note': 'y'}
+
+
+def test_single_field_and_no_headline(tmp_path):
+    filename = str(tmp_path / 'ids.txt')
+    with TabFileWriter(filename, ['id'], headline=False) as writer:
+        writer.write({'id': 'a'})
+        writer.write_rows([{'id': 'b'}, {'id': 'c'}])
+    with open(filename) as fh:
+        assert fh.read() == 'a\nb\nc\n'
+
+
+def test_bgzf_output(tmp_path):
+    filename = str(tmp_path / 'hits.tsv.gz')
+    rows = [('q{}'.format(i), 't{}'.format(i % 97), i * 0.5) for i in range(100000)]
+    # small blocks: many flushes and many BGZF blocks
+    with TabFileWriter(filename, ['query', 'target', 'score'], threads=3, buffer_size=1 << 16) as writer:
+        writer.write_rows(rows)
+    assert is_bgzf(filename)
+    with gzip.open(filename, 'rt') as fh:
+        text = fh.read()
+    assert text.count('\n') == len(rows) + 1
+    batches = list(TabBatchReader(filename, dtypes={'score': float}, output='columns', threads=2))
+    assert sum(len(b['query']) for b in batches) == len(rows)
+    assert batches[-1]['score'][-1] == rows[-1][2]
+
+
+def test_compress_option(tmp_path):
+    filename = str(tmp_path / 'plain.gz')
+    with TabFileWriter(filename, ['a'], compress=False) as writer:
+        writer.write(('x',))
+    with open(filename) as fh:
+        assert fh.read() == '#a\nx\n'
+    filename = str(tmp_path / 'compressed.tsv')
+    with TabFileWriter(filename, ['a'], compress=True, threads=1) as writer:
+        writer.write(('x',))
+    assert is_bgzf(filename)
+
+
+def test_exception_discards_file(tmp_path):
+    filename = str(tmp_path / 'out' / 'genes.tsv.gz')
+    os.makedirs(os.path.dirname(filename))
+    tmp_dir = str(tmp_path / 'tmp')
+    os.makedirs(tmp_dir)
+    with pytest.raises(RuntimeError):
+        with TabFileWriter(filename, ['id'], tmp_dir=tmp_dir) as writer:
+            writer.write(('g1',))
+            assert os.listdir(tmp_dir) == [os.path.basename(writer.tmp_filename)]
+            raise RuntimeError()
+    assert os.listdir(tmp_dir) == []
+    assert not os.path.exists(filename)
+
+    # written in tmp_dir, moved next to the file on close
+    with TabFileWriter(filename, ['id'], tmp_dir=tmp_dir) as writer:
+        writer.write(('g1',))
+    assert os.listdir(tmp_dir) == []
+    assert [r['id'] for r in tab_file_reader(filename)] == ['g1']
+
+
+def test_temporary_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'genes.tsv')
+    # two writers of one file do not share the temporary file
+    first, second = TabFileWriter(filename, ['id']), TabFileWriter(filename, ['id'])
+    assert first.tmp_filename != second.tmp_filename
+    assert os.path.dirname(first.tmp_filename) == str(tmp_path)
+    second.close(discard=True)
+    first.close()
+    umask = os.umask(0o022)
+    try:
+        with TabFileWriter(filename, ['id']) as writer:
+            writer.write(('g1',))
+    finally:
+        os.umask(umask)
+    assert os.stat(filename).st_mode & 0o777 == 0o644
+
+    # `tmp_dir` on another file system: copied next to the file
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, 'cross-device link')
+    monkeypatch.setattr(shell, 'rename_file', rename)
+    tmp_dir = str(tmp_path / 'tmp')
+    os.makedirs(tmp_dir)
+    with TabFileWriter(filename, ['id'], tmp_dir=tmp_dir) as writer:
+        writer.write(('g2',))
+    assert [r['id'] for r in tab_file_reader(filename)] == ['g2']
+    assert os.listdir(tmp_dir) == []
+    assert sorted(os.listdir(str(tmp_path))) == ['genes.tsv', 'tmp']
+
+
+def test_buffer_size(tmp_path):
+    flushed = []
+
+    class Writer(TabFileWriter):
+        def flush(self):
+            flushed.append(self._size)
+            super().flush()
+    # rows of very different lengths: the buffered size is counted exactly
+    with Writer(str(tmp_path / 'a.tsv'), ['id'], headline=False, buffer_size=1000) as writer:
+        writer.write_rows([('x',)] + [('y' * 99,)] * 20)
+        assert flushed == [1 + 99 * 20]
+    assert flushed[-1] == 0
+
+
+def test_errors(tmp_path):
+    with pytest.raises(ValueError):
+        TabFileWriter(str(tmp_path / 'a.tsv'))
+    with TabFileWriter(str(tmp_path / 'b.tsv'), headline=False) as writer:
+        writer.write(('x', 1))
+        with pytest.raises(ValueError):
+            writer.write({'id': 'x'})
+        with pytest.raises(ValueError):
+            writer.write_rows([{'id': 'x'}])
+        with pytest.raises(ValueError):
+            writer.write_columns({'id': ['x']})
+    with open(str(tmp_path / 'b.tsv')) as fh:
+        assert fh.read() == 'x\t1\n'
+
+
+def test_numpy_columns(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    filename = str(tmp_path / 'lengths.tsv')
+    with TabFileWriter(filename, ['id', 'len']) as writer:
+        writer.write_columns({'id': numpy.array(['a', 'b']), 'len': numpy.arange(2, dtype=numpy.int64)})
+    with open(filename) as fh:
+        assert fh.read() == '#id\tlen\na\t0\nb\t1\n'
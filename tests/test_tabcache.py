@@ -0,0 +1,111 @@
+import gzip
+import os
+
+import pytest
+
+from pipeapp.lib import tabcache
+from pipeapp.lib.shell import tab_file_reader
+from pipeapp.lib.tabcache import TabColumnCache, tab_columns
+
+ROWS = [('g{}'.format(i), str(100 + i), '{:.2f}'.format(i / 4), '+-'[i % 2], 'gène {}'.format(i % 3))
+        for i in range(2500)]
+HEADER = ('id', 'len', 'score', 'strand', 'note')
+
+
+def write_tab(filename, rows=ROWS, header=HEADER, compress=False):
+    text = '#' + '\t'.join(header) + '\n' if header else ''
+    text += ''.join('\t'.join(row) + '\n' for row in rows)
+    opener = gzip.open if compress else open
+    with opener(filename, 'wt', encoding='utf-8') as fh:
+        fh.write(text)
+    return filename
+
+
+@pytest.fixture(params=['array', 'numpy'])
+def backend(request):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    return request.param
+
+
+def test_load_columns(tmp_path, backend):
+    filename = write_tab(str(tmp_path / 'genes.tsv'))
+    with tab_columns(filename, str(tmp_path / 'cache'), dtypes={'len': int, 'score': float, 'strand': 'category'},
+                     backend=backend) as cols:
+        assert cols.nrows == len(ROWS)
+        assert list(cols) == list(HEADER)
+        assert list(cols['len'][:3]) == [100, 101, 102]
+        assert sum(cols['len']) == sum(100 + i for i in range(len(ROWS)))
+        assert cols['score'][4] == 1.0
+        assert cols['id'][0] == 'g0' and cols['id'][-1] == 'g2499'
+        assert cols['id'][1:3] == ['g1', 'g2']
+        assert list(cols['note'])[:4] == ['gène 0', 'gène 1', 'gène 2', 'gène 0']
+        assert list(cols['strand'].labels) == ['+', '-']
+        assert cols['strand'].labels.code('-') == 1
+        assert cols['strand'].labels.code('?') is None
+        records = list(cols.iter_records())
+        assert records[7] == {'id': 'g7', 'len': 107, 'score': 1.75, 'strand': '-', 'note': 'gène 1'}
+        assert [r['id'] for r in records] == [r['id'] for r in tab_file_reader(filename)]
+
+
+def test_cache_is_reused_and_invalidated(tmp_path, backend, monkeypatch):
+    filename = write_tab(str(tmp_path / 'genes.tsv'))
+    cache = TabColumnCache(str(tmp_path / 'cache'), backend=backend)
+    with cache.load(filename, columns=['id', 'len'], dtypes={'len': int}) as cols:
+        assert cols.nrows == len(ROWS)
+
+    builds = []
+    build = TabColumnCache._build
+    monkeypatch.setattr(TabColumnCache, '_build', lambda self, *args: builds.append(args[1]) or build(self, *args))
+    with cache.load(filename, columns=['id', 'len'], dtypes={'len': int}) as cols:
+        assert list(cols) == ['id', 'len']
+    assert builds == []
+
+    # other columns or dtypes are another entry
+    with cache.load(filename, columns=['len']) as cols:
+        assert cols['len'][0] == '100'
+    assert builds == [filename]
+
+    # a changed file is parsed again
+    write_tab(filename, ROWS[:10])
+    with cache.load(filename, columns=['id', 'len'], dtypes={'len': int}) as cols:
+        assert cols.nrows == 10
+    assert builds == [filename, filename]
+
+    cache.clear()
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_compressed_file_without_headline(tmp_path, backend):
+    filename = write_tab(str(tmp_path / 'genes.tsv.gz'), header=None, compress=True)
+    with tab_columns(filename, str(tmp_path / 'cache'), headline=False, fieldnames=list(HEADER),
+                     dtypes={'len': int}, backend=backend) as cols:
+        assert cols.nrows == len(ROWS)
+        assert cols['len'][len(ROWS) - 1] == 100 + len(ROWS) - 1
+        assert cols['strand'][0] == '+'
+
+
+def test_empty_file(tmp_path, backend):
+    filename = write_tab(str(tmp_path / 'empty.tsv'), rows=[])
+    with tab_columns(filename, str(tmp_path / 'cache'), dtypes={'len': int}, backend=backend) as cols:
+        assert cols.nrows == 0
+        assert len(cols['len']) == 0
+        assert list(cols['id']) == []
+        assert len(cols['id'].labels) == 0
+
+
+def test_numpy_backend_returns_arrays(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    filename = write_tab(str(tmp_path / 'genes.tsv'))
+    with tab_columns(filename, str(tmp_path / 'cache'), dtypes={'len': int, 'score': float},
+                     backend='numpy') as cols:
+        assert isinstance(cols['len'], numpy.ndarray) and cols['len'].dtype == numpy.int64
+        assert cols['score'].dtype == numpy.float64
+        codes = cols['strand'].codes
+        assert int((codes == cols['strand'].labels.code('+')).sum()) == (len(ROWS) + 1) // 2
+
+
+def test_invalid_backend(tmp_path):
+    with pytest.raises(ValueError):
+        TabColumnCache(str(tmp_path / 'cache'), backend='arrow')
+    assert tabcache.storage_types['category'] == tabcache.storage_types['str']
@@ -0,0 +1,146 @@
+import errno
+import os
+
+import pytest
+
+from pipeapp.lib import shell
+from pipeapp.lib.shell import copy_files, move_files, transfer_file, fsync_paths
+
+
+def write(filename, data):
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    return filename
+
+
+def read(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for i in range(6):
+        write(str(src / 'f{}.txt'.format(i)), os.urandom(1000 * (i + 1)))
+    return str(src)
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    def reflink(fd_in, fd_out):
+        raise OSError(errno.EOPNOTSUPP, 'no reflink')
+    monkeypatch.setattr(shell, '_reflink_fd', reflink)
+
+
+def failing(*args):
+    raise OSError(errno.ENOSYS, 'not supported')
+
+
+def listing(dirname):
+    return sorted(os.listdir(dirname))
+
+
+def test_copy_files(tmp_path, src_dir):
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    summary = copy_files(os.path.join(src_dir, '*.txt'), dst, threads=3, fsync=True)
+    assert summary.files == 6
+    assert summary.bytes == sum(1000 * (i + 1) for i in range(6))
+    assert sum(summary.methods.values()) == 6
+    for fname in listing(src_dir):
+        assert read(os.path.join(dst, fname)) == read(os.path.join(src_dir, fname))
+    assert listing(dst) == listing(src_dir)
+
+    summary = copy_files(os.path.join(src_dir, 'f0.txt'), str(tmp_path / 'dst' / 'linked.txt'), link=True)
+    assert summary.methods == {'link': 1}
+    assert os.stat(os.path.join(dst, 'linked.txt')).st_ino == os.stat(os.path.join(src_dir, 'f0.txt')).st_ino
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'sendfile', 'copy'])
+def test_copy_methods(tmp_path, src_dir, no_reflink, monkeypatch, method):
+    if method != 'copy_file_range':
+        monkeypatch.setattr(os, 'copy_file_range', failing, raising=False)
+    if method == 'copy':
+        monkeypatch.setattr(os, 'sendfile', failing, raising=False)
+    src = os.path.join(src_dir, 'f5.txt')
+    dst = str(tmp_path / 'copy.txt')
+    os.chmod(src, 0o640)
+    assert transfer_file(src, dst) == (method, 6000)
+    assert read(dst) == read(src)
+    assert os.stat(dst).st_mode == os.stat(src).st_mode
+    assert listing(str(tmp_path)) == ['copy.txt', 'src']
+
+
+def test_move_across_file_systems(tmp_path, src_dir, no_reflink, monkeypatch):
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, 'cross-device link')
+    monkeypatch.setattr(shell, 'rename_file', rename)
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    data = {fname: read(os.path.join(src_dir, fname)) for fname in listing(src_dir)}
+    summary = move_files(os.path.join(src_dir, '*'), dst, threads=2)
+    assert summary.files == 6
+    assert 'rename' not in summary.methods
+    assert listing(src_dir) == []
+    assert {fname: read(os.path.join(dst, fname)) for fname in listing(dst)} == data
+
+
+def test_failed_copy_leaves_no_partial_file(tmp_path, src_dir, monkeypatch):
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, 'cross-device link')
+
+    def copy_data(src, dst):
+        write(dst, b'partial')
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(shell, 'rename_file', rename)
+    monkeypatch.setattr(shell, '_copy_file_data', copy_data)
+    src = os.path.join(src_dir, 'f0.txt')
+    dst = str(tmp_path / 'moved.txt')
+    with pytest.raises(OSError):
+        transfer_file(src, dst, move=True)
+    assert os.path.exists(src)
+    assert listing(str(tmp_path)) == ['src']
+    # an existing destination is kept as it was
+    write(dst, b'old')
+    with pytest.raises(OSError):
+        transfer_file(src, dst, move=True)
+    assert read(dst) == b'old'
+    assert listing(str(tmp_path)) == ['moved.txt', 'src']
+
+
+def test_several_files_to_one_destination(tmp_path, src_dir):
+    dst = str(tmp_path / 'one.txt')
+    pattern = os.path.join(src_dir, '*.txt')
+    summary = copy_files(pattern, dst, threads=4)
+    assert summary.files == 6
+    # in order: the last file wins, as with a sequential copy
+    assert read(dst) == read(shell.glob(pattern)[-1])
+
+
+def test_directory_transfer(tmp_path, src_dir):
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    os.makedirs(os.path.join(src_dir, 'sub'))
+    write(os.path.join(src_dir, 'sub', 'g.txt'), b'x' * 500)
+    summary = copy_files(src_dir, dst)
+    assert summary == summary._replace(files=1, bytes=21500, methods={'copy': 1})
+    assert read(os.path.join(dst, 'src', 'sub', 'g.txt')) == b'x' * 500
+    summary = move_files(src_dir, str(tmp_path / 'moved'))
+    assert (summary.files, summary.bytes, summary.methods) == (1, 21500, {'move': 1})
+    assert not os.path.exists(src_dir)
+
+
+def test_fsync_paths(tmp_path, src_dir, monkeypatch):
+    synced = []
+    fsync = os.fsync
+
+    def record(fd):
+        synced.append(os.readlink('/proc/self/fd/{}'.format(fd)))
+        fsync(fd)
+    monkeypatch.setattr(os, 'fsync', record)
+    files = [os.path.join(src_dir, fname) for fname in listing(src_dir)]
+    fsync_paths(files + [str(tmp_path)], threads=2)
+    # every file once, every directory once: the given one and the parents
+    assert sorted(synced) == sorted(files + [src_dir, str(tmp_path), str(tmp_path.parent)])
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import pytest
+
+from pipeapp.lib import worker
+from pipeapp.lib.worker import WorkerServer, WorkerClient, socket_is_alive
+
+
+class EchoApp:
+    """ Writes `text` to stdout and `error` to stderr of the job, and returns `code`. """
+
+    @classmethod
+    def main(cls, name=None, text='', error='', code=0, kill=False, where=None):
+        # to the file descriptors: pytest replaces sys.stdout and sys.stderr
+        os.write(1, '{}\n'.format(text).encode('utf-8'))
+        os.write(2, '{}\n'.format(error).encode('utf-8'))
+        if where:
+            # relative to the working directory of the job
+            with open(where, 'w') as fh:
+                fh.write('{}\t{}'.format(os.getcwd(), os.environ.get('ECHO_TEXT')))
+        if kill:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return code
+
+
+def run_from_console():
+    """ Console entry point of `EchoApp`, used by the worker for the jobs requested with `argv`. """
+    args = sys.argv[1:]
+    return EchoApp.main(text=' '.join(args), code=len(args))
+
+
+def serve(socket_path):
+    WorkerServer(socket_path, apps={'echo': EchoApp}, workers=2, preload=()).serve_forever()
+
+
+def start_server(socket_path):
+    proc = multiprocessing.get_context('fork').Process(target=serve, args=(socket_path,))
+    proc.start()
+    for _ in range(200):
+        if socket_is_alive(socket_path):
+            return proc
+        time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError('worker did not start')
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'w.sock')
+
+
+@pytest.fixture
+def server(socket_path, monkeypatch):
+    monkeypatch.setattr(worker, 'REQUEST_TIMEOUT', 0.5)
+    proc = start_server(socket_path)
+    yield proc
+    os.kill(proc.pid, signal.SIGTERM)
+    proc.join(10)
+    assert proc.exitcode == 0
+    assert not os.path.exists(socket_path)
+
+
+def run(client, tmp_path, *args, **kwargs):
+    """ Run the job with stdout and stderr in files; return exit code, stdout and stderr. """
+    out, err = str(tmp_path / 'out.txt'), str(tmp_path / 'err.txt')
+    with open(out, 'w') as fout, open(err, 'w') as ferr:
+        returncode = client.run(*args, stdout=fout.fileno(), stderr=ferr.fileno(), **kwargs)
+    with open(out) as fout, open(err) as ferr:
+        return returncode, fout.read(), ferr.read()
+
+
+def test_run_jobs(server, socket_path, tmp_path):
+    client = WorkerClient(socket_path)
+    assert client.available()
+    assert run(client, tmp_path, 'echo', kwargs={'text': 'hello', 'error': 'warning', 'code': 3}) == \
+        (3, 'hello\n', 'warning\n')
+    # arguments parsed by run_from_console() of the app module
+    assert run(client, tmp_path, 'echo', ['a', 'b']) == (2, 'a b\n', '\n')
+    # killed by a signal
+    assert run(client, tmp_path, 'echo', kwargs={'kill': True})[0] == -signal.SIGKILL
+    with pytest.raises(LookupError):
+        client.run('nope')
+
+
+def test_job_runs_in_clients_directory(server, socket_path, tmp_path, monkeypatch):
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    monkeypatch.chdir(str(workdir))
+    monkeypatch.setenv('ECHO_TEXT', 'from env')
+    assert run(WorkerClient(socket_path), tmp_path, 'echo', kwargs={'where': 'where.txt'})[0] == 0
+    with open(str(workdir / 'where.txt')) as fh:
+        assert fh.read() == '{}\tfrom env'.format(workdir)
+
+
+def test_client_without_request(server, socket_path, tmp_path):
+    # a client that sends nothing is dropped after REQUEST_TIMEOUT; the worker keeps serving
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.settimeout(5)
+        assert sock.recv(1) == b''
+    assert run(WorkerClient(socket_path), tmp_path, 'echo', kwargs={'text': 'ok'}) == (0, 'ok\n', '\n')
+
+
+def test_stale_socket(socket_path, tmp_path, monkeypatch):
+    # socket file left by a worker that was killed
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    assert os.path.exists(socket_path) and not socket_is_alive(socket_path)
+    assert not WorkerClient(socket_path).available()
+
+    proc = start_server(socket_path)
+    try:
+        assert run(WorkerClient(socket_path), tmp_path, 'echo', kwargs={'text': 'ok'})[0] == 0
+        # the socket of a running worker is not taken over
+        with pytest.raises(OSError, match='already running'):
+            WorkerServer(socket_path, apps={'echo': EchoApp}, preload=())._bind()
+    finally:
+        os.kill(proc.pid, signal.SIGTERM)
+        proc.join(10)
+
+
+def test_console_client(socket_path, monkeypatch, capsys):
+    monkeypatch.setenv(worker.SOCKET_ENV_VAR, socket_path)
+    monkeypatch.setattr(sys, 'argv', ['pipeapp_run', 'nope'])
+    assert worker.run_from_console() == 2
+    assert 'unknown app: nope' in capsys.readouterr().err
+
+    monkeypatch.setenv(worker.FALLBACK_ENV_VAR, '0')
+    assert worker.run_from_console() == 1
+    assert 'worker is not running' in capsys.readouterr().err
+
+    # no worker: the app is run in this process
+    monkeypatch.setenv(worker.FALLBACK_ENV_VAR, '1')
+    monkeypatch.setattr(sys, 'argv', ['pipeapp_run', '{}:EchoApp'.format(__name__), 'a', 'b', 'c'])
+    assert worker.run_from_console() == 3